@@ -1,7 +1,7 @@
 from pymDetector import *
-import asyncio
 import numpy as np
-import pymJournal
+from time import sleep
+from pymDriver import blocking
 
 
 class pynDummyDetector(pymDetector):
@@ -15,6 +15,8 @@ class pynDummyDetector(pymDetector):
         super().__init__(jobid)
         self.journal_id = None
         self.gain = 1.0
+        # simulated exposure time in seconds
+        self.exposure = 0.0
         self.running = False
 
     def _initialize(self):
@@ -24,15 +26,21 @@ class pynDummyDetector(pymDetector):
         pass
 
     def getsettings(self):
-        return {
+        settings = super().getsettings()
+        settings.update({
             'gain': {'current': self.gain, 'type': 'double', 'hint': 'Parameter Gain', 'ro': False},
-        }
+            'exposure': {'current': self.exposure, 'type': 'double', 'hint': 'Exposure time in s', 'ro': False},
+        })
+        return settings
 
     def updatejob(self, settings_dict):
-        res = False
+        res = super().updatejob(settings_dict)
         if 'gain' in settings_dict:
             self.gain = settings_dict["gain"]
             res = True
+        if 'exposure' in settings_dict:
+            self.exposure = float(settings_dict["exposure"])
+            res = True
 
         return res
 
@@ -43,30 +51,22 @@ class pynDummyDetector(pymDetector):
     def pre_acquire(self):
         pass
 
-    def acquire(self):
-        pass
+    @blocking
+    def acquire(self, n=1):
+        # blocking exposure of n frames into the buffer of the camera, as a camera SDK would do it
+        sleep(self.exposure * n)
+
+    async def read_frame(self):
+        return (await self.acquire_n(1))[0]
+
+    async def acquire_n(self, n):
+        # the ramp n times, read from the buffer at once
+        if self.exposure > 0:
+            await self.acquire(n)
+        return np.tile(np.arange(0, 255 * self.gain, self.gain), (n, 1))
 
     def post_acquire(self):
         pass
 
     def post_run(self):
         pass
-
-    async def run(self, parent_id):
-        # Acquire a journal id
-        self.journal_id = pymJournal.add_job(parent_id, title=str(self.description()))
-        self.running = True
-        # Return function call for late collection
-        return self.late_collection
-
-
-    async def late_collection(self):
-        jid = self.journal_id
-        # generate database entry with ramp values
-        data_id =  pymJournal.add_data(np.arange(0, 255 * self.gain, self.gain), self.journal_id)
-        # update job entry to chain to our added data
-        pymJournal.update_job(jid, assoc_data=data_id)
-        # clean up instance variables for next call
-        self.journal_id = None
-        self.running = False
-        return jid
\ No newline at end of file
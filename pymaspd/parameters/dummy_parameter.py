@@ -1,8 +1,10 @@
 from pymParameter import *
+from pymDriver import blocking
 import logging
 import asyncio
+import numpy as np
 
-from time import sleep
+from time import sleep, monotonic
 
 class dummy_parameter(pymParameter):
     def description(self):
@@ -12,7 +14,7 @@ class dummy_parameter(pymParameter):
     MIN_POSITION = -10000
     MAX_POSITION = 10000
 
-    MINIMAL_STEP = 1
+    MINIMAL_STEP = 0.01
     STEP_MULTIPLICATOR = 1
 
     RAW_UNIT = "mu"
@@ -23,6 +25,9 @@ class dummy_parameter(pymParameter):
 
     NUM_CHANNELS = 1
 
+    # simulated speed of the stage in raw units per second
+    SPEED = 10000
+
 
     def __init__(self):
         super().__init__()
@@ -32,41 +37,49 @@ class dummy_parameter(pymParameter):
 
         self.home_value = 0
         self.current_value = 0
-        self.hasAltUnit = HAS_ALTERNATIVE_UNIT
-        self.num_channels = NUM_CHANNELS
+        self.hasAltUnit = self.HAS_ALTERNATIVE_UNIT
+        self.num_channels = self.NUM_CHANNELS
 
         self.altUnitString = "fs"
         self.natUnitString = "mu"
 
-    def sanityCheckValue(self, value, channel):
-        if value < MIN_POSITION:
-            return MIN_POSITION
-        if value > MAX_POSITION:
-            return MAX_POSITION
+        # move in progress and its target
+        self.moving = None
+        self.target = None
+        self.stopping = False
 
+    def __getstate__(self):
+        # a move in progress isn't part of the pickled job tree
+        state = super().__getstate__()
+        state['moving'] = None
+        return state
+
+    def sanityCheckValue(self, value, channel):
+        return unbox(np.clip(value, self.MIN_POSITION, self.MAX_POSITION))
 
+    def getClosestParameterValue(self, value, channel):
+        # rounded to full steps, the rounding to decimals removes the float error of the multiplication
+        return unbox(np.round(np.round(np.asarray(value) / self.MINIMAL_STEP) * self.MINIMAL_STEP, 10))
 
     def getClosestParameterStep(self, step, channel):
         """
         return next reasonable stepsize for parameter. Also acts as a sanity check for steps
         """
-        if (step % MINIMAL_STEP):
-            return (step // MINIMAL_STEP) * MINIMAL_STEP
-        else:
-            return step
+        steps = np.maximum(np.floor(np.asarray(step) / self.MINIMAL_STEP + 1e-9), 1)
+        return unbox(np.round(steps * self.MINIMAL_STEP, 10))
 
 
     def convertToAlt(self, value, channel):
         """
         calculate alternative unit from raw
         """
-        return 1/0.299792458*value*ALT_UNIT_MULTIPLIER
+        return 1/0.299792458*value*self.ALT_UNIT_MULTIPLIER
 
     def convertFromAlt(self, value, channel):
         """
         calculate raw from alternative unit
         """
-        return value/ALT_UNIT_MULTIPLIER/(1/0.299792458)
+        return value/self.ALT_UNIT_MULTIPLIER/(1/0.299792458)
 
     async def set(self, value, channel, wait=True):
         """
@@ -79,23 +92,45 @@ class dummy_parameter(pymParameter):
 
         logging.debug("Dummy Stage received move command")
         # check if the value is sane
-        if not self.sanityCheckValue(value): raise pynParameterException("Value out of sane range")
-
+        if self.sanityCheckValue(value, channel) != value: raise pynParameterException("Value out of sane range")
 
+        # start the move unless we are on the way there already
+        if self.moving is None or self.moving.done() or self.target != value:
+            self.target = value
+            self.moving = asyncio.ensure_future(self.move(value))
         if (wait):
-            # do a blocking move
-            sleep(100) #simulate some walk
-            self.current_value = value
-            logging.debug("Dummy Stage reached target position")
-            return True
-        else:
-            # async movement of a stepper, not implemeneted
-            await asyncio.sleep(100)
-            self.current_value = value
-            logging.debug("Dummy Stage reached target position (asyncio)")
-            return True
-
+            return await self.moving
+        return True
 
+    @blocking(timeout=10, abort='stop')
+    def move(self, value):
+        """
+        blocking move, as a vendor SDK would do it. Runs on the thread of the stage
+        """
+        self.stopping = False
+        # the position is updated during the move, like the readback of a real stage
+        start = self.current_value
+        duration = abs(value - start) / self.SPEED
+        t0 = monotonic()
+        elapsed = 0
+        while elapsed < duration:
+            if self.stopping:
+                raise pynParameterException("Move stopped")
+            self.current_value = start + (value - start) * elapsed / duration
+            sleep(min(duration - elapsed, 0.01)) #simulate some walk
+            elapsed = monotonic() - t0
+        self.current_value = value
+        logging.debug("Dummy Stage reached target position")
+        return True
+
+    def stop(self):
+        self.stopping = True
+
+    def get_position(self, channel):
+        return self.current_value
+
+    def move_time(self, start, end, channel=0):
+        return np.abs(np.asarray(end, dtype=float) - start) / self.SPEED
 
     def get_current_value(self):
         return self.current_value
\ No newline at end of file
@@ -0,0 +1,52 @@
+from dummy_parameter import *
+
+
+class dummy_xy_stage(dummy_parameter):
+    """
+    Simulated XY stage with coordinated motion: both axes move at the same time, a move takes as long as the longest
+    axis needs
+    """
+    def description(self):
+        return ("Dummy XY Stage", None)
+
+    NUM_CHANNELS = 2
+
+    def __init__(self):
+        super().__init__()
+        self.positions = [0.0] * self.NUM_CHANNELS
+
+    def get_position(self, channel):
+        return self.positions[channel]
+
+    async def set(self, value, channel, wait=True):
+        return await self.set_multi({channel: value}, wait)
+
+    async def set_multi(self, values, wait=True):
+        for channel, value in values.items():
+            if self.sanityCheckValue(value, channel) != value: raise pynParameterException("Value out of sane range")
+        move = asyncio.ensure_future(self.move_axes(values))
+        if (wait):
+            return await move
+        return True
+
+    @blocking(timeout=10, abort='stop')
+    def move_axes(self, values):
+        """
+        blocking coordinated move of several axes, runs on the thread of the stage
+        """
+        self.stopping = False
+        starts = {channel: self.positions[channel] for channel in values}
+        duration = max(abs(value - starts[channel]) for channel, value in values.items()) / self.SPEED
+        t0 = monotonic()
+        elapsed = 0
+        while elapsed < duration:
+            if self.stopping:
+                raise pynParameterException("Move stopped")
+            for channel, value in values.items():
+                self.positions[channel] = starts[channel] + (value - starts[channel]) * elapsed / duration
+            sleep(min(duration - elapsed, 0.01)) #simulate some walk
+            elapsed = monotonic() - t0
+        for channel, value in values.items():
+            self.positions[channel] = value
+        logging.debug("Dummy XY Stage reached target position")
+        return True
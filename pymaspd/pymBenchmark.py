@@ -0,0 +1,221 @@
+"""
+Micro benchmarks for pymaspd internals. Run from the pymaspd directory:
+    python pymBenchmark.py [name ...]
+"""
+import os
+import json
+import sys
+import time
+import asyncio
+import shutil
+import logging
+import tempfile
+from datetime import datetime
+import numpy as np
+import zmq
+
+import pymJournal
+import pymWire
+import pymTemplate
+from pymJob import pymJobFactory
+from pymDetector import pymDetector
+
+
+def _best_of(func, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def bench_array_codec():
+    """
+    Compare the raw array codec of the journal with the .npy codec for frames from 1 KB to 64 MB
+    """
+    print("%10s %14s %14s %14s %14s" % ("size", "npy write", "raw write", "npy read", "raw read"))
+    size = 1024
+    while size <= 64 * 1024 ** 2:
+        arr = np.random.random(size // 8)
+        npy_blob = bytes(pymJournal._adapt_array_npy(arr))
+        raw_blob = bytes(pymJournal.adapt_array(arr))
+        repeat = 20 if size < 1024 ** 2 else 3
+        times = (_best_of(lambda: pymJournal._adapt_array_npy(arr), repeat),
+                 _best_of(lambda: pymJournal.adapt_array(arr), repeat),
+                 _best_of(lambda: pymJournal._convert_array_npy(npy_blob), repeat),
+                 _best_of(lambda: pymJournal.convert_array(raw_blob), repeat))
+        print("%10d %s" % (size, " ".join("%12.1fus" % (t * 1e6) for t in times)))
+        size *= 4
+
+
+def bench_job_tree(n_roots=10000, n_children=99):
+    """
+    Walk experiment trees in a journal of a million jobs: one query per node vs. one recursive query,
+    without and with the indexes of the schema migration
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        pymJournal.open(os.path.join(directory, "bench.db"))
+        pymJournal.create_new_db()
+        now = datetime.utcnow()
+        rows = []
+        for root in range(n_roots):
+            root_id = root * (n_children + 1) + 1
+            rows.append((root_id, None, now, "root", None, None))
+            rows.extend((root_id + k, root_id, now, "child", None, None) for k in range(1, n_children + 1))
+        pymJournal._cur.executemany('''INSERT INTO jobs VALUES (?,?,?,?,?,?)''', rows)
+        pymJournal._conn.commit()
+        print("%d jobs" % len(rows))
+        root_id = (n_roots // 2) * (n_children + 1) + 1
+
+        def walk(job_id):
+            return [job_id] + [node for child in pymJournal.get_job_children(job_id) for node in walk(child['id'])]
+
+        for indexed in (False, True):
+            if not indexed:
+                pymJournal._cur.execute('''DROP INDEX jobs_parent_id''')
+            else:
+                pymJournal._cur.execute('''CREATE INDEX jobs_parent_id ON jobs(parent_id)''')
+            repeat = 1 if not indexed else 20
+            t_walk = _best_of(lambda: walk(root_id), repeat)
+            t_tree = _best_of(lambda: pymJournal.get_job_tree(root_id), repeat)
+            print("%-12s per node: %10.1fms   recursive query: %10.1fms" %
+                  ("indexed" if indexed else "no index", t_walk * 1e3, t_tree * 1e3))
+        pymJournal.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_wire(max_size=100 * 1024 ** 2, max_json_size=10 * 1024 ** 2):
+    """
+    Transfer of an array reply over a local tcp connection: binary multipart format vs. JSON lists, 1 MB to 100 MB.
+    JSON is skipped above max_json_size, it takes minutes there
+    """
+    context = zmq.Context()
+    server = context.socket(zmq.PAIR)
+    client = context.socket(zmq.PAIR)
+    # inproc would hand over the buffers without ever copying them
+    port = server.bind_to_random_port("tcp://127.0.0.1")
+    client.connect("tcp://127.0.0.1:%d" % port)
+
+    def binary(reply):
+        server.send_multipart(pymWire.pack(reply), copy=False)
+        return pymWire.unpack(client.recv_multipart(copy=False))
+
+    def json_lists(reply):
+        server.send(pymWire.to_json(reply))
+        return json.loads(client.recv())
+
+    print("%10s %14s %14s %14s %14s" % ("size", "binary", "binary MB/s", "json", "json MB/s"))
+    try:
+        size = 1024 ** 2
+        while size <= max_size:
+            reply = {"get_1d_data": {"axis": np.arange(size // 16, dtype=float),
+                                     "data": np.random.random(size // 16)}}
+            repeat = 5 if size < 32 * 1024 ** 2 else 2
+            t_binary = _best_of(lambda: binary(reply), repeat)
+            line = "%10d %12.1fms %14.0f" % (size, t_binary * 1e3, size / 1024 ** 2 / t_binary)
+            if size <= max_json_size:
+                t_json = _best_of(lambda: json_lists(reply), 1)
+                line += " %12.1fms %14.1f" % (t_json * 1e3, size / 1024 ** 2 / t_json)
+            print(line)
+            size *= 10
+    finally:
+        client.close(linger=0)
+        server.close(linger=0)
+        context.term()
+
+
+def bench_template(n_points=3333):
+    """
+    Save and load job trees of about 10,000 jobs, a list of grids each running a detector and a list of parallel
+    acquisitions of 99 detectors: pickle vs. template. Pickles need new job ids after loading, templates get them while
+    loading. Cached is the way stored templates are started
+    """
+    import pickle
+    import pymList
+    import pymGrid
+    import pymParallel
+    from pymaspd_worker import pymaspd_worker
+
+    grids = pymJobFactory.createJob("pymList")
+    for k in range(n_points):
+        grid = pymJobFactory.createJob("pymGrid")
+        grid.updatejob({"axes": [{"range": (0, k), "steps": 10}], "job": "pymParallel"})
+        detector = pymJobFactory.createJob("pynDummyDetector")
+        detector.updatejob({"gain": k})
+        grid.appendjob(detector)
+        grids.appendjob(grid)
+    lists = pymJobFactory.createJob("pymList")
+    for k in range(100):
+        parallel = pymJobFactory.createJob("pymParallel")
+        for n in range(99):
+            detector = pymJobFactory.createJob("pynDummyDetector")
+            detector.updatejob({"gain": n})
+            parallel.appendjob(detector)
+        lists.appendjob(parallel)
+    worker = pymaspd_worker()
+
+    for name, root in (("grids", grids), ("detectors", lists)):
+        blob = pickle.dumps(root)
+        text = json.dumps(pymTemplate.dump(root), separators=(',', ':'))
+        plan = pymTemplate.prepare(json.loads(text))
+        print("%s: %d jobs, pickle %d bytes, template %d bytes" % (name, len(list(worker._walk(root))), len(blob),
+                                                                  len(text)))
+        times = (_best_of(lambda: pickle.dumps(root)),
+                 _best_of(lambda: worker.renumber(pickle.loads(blob))),
+                 _best_of(lambda: json.dumps(pymTemplate.dump(root), separators=(',', ':'))),
+                 _best_of(lambda: pymTemplate.load(json.loads(text))),
+                 _best_of(lambda: pymTemplate._build(*plan)))
+        print("    pickle save %.1fms, load %.1fms; template save %.1fms, load %.1fms, load cached %.1fms" %
+              tuple(t * 1e3 for t in times))
+
+
+def bench_burst(n_frames=10000, frame_size=256):
+    """
+    Repeated acquisition of one detector: n runs of single frames vs. one run of a burst of n frames, through the
+    journal writer
+    """
+    class RandomDetector(pymDetector):
+        def description(self):
+            return ("Random Detector", None)
+
+        async def read_frame(self):
+            return np.arange(frame_size, dtype=float)
+
+    async def acquire(bursts, burst):
+        detector = RandomDetector(pymJobFactory.newJobId())
+        detector.updatejob({'burst': burst})
+        for _ in range(bursts):
+            await (await detector.run(None))()
+
+    directory = tempfile.mkdtemp()
+    try:
+        for bursts, burst in ((n_frames, 1), (1, n_frames)):
+            pymJournal.open(os.path.join(directory, "bench%d.db" % burst), use_writer=True)
+            pymJournal.create_new_db()
+            t0 = time.perf_counter()
+            asyncio.run(acquire(bursts, burst))
+            pymJournal.flush()
+            elapsed = time.perf_counter() - t0
+            pymJournal.close()
+            print("%5d x burst of %5d: %8.1fms, %5d job rows" % (bursts, burst, elapsed * 1e3, bursts))
+    finally:
+        shutil.rmtree(directory)
+
+
+BENCHMARKS = {
+    'array_codec': bench_array_codec,
+    'job_tree': bench_job_tree,
+    'wire': bench_wire,
+    'template': bench_template,
+    'burst': bench_burst,
+}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    for name in sys.argv[1:] or BENCHMARKS:
+        print("== %s" % name)
+        BENCHMARKS[name]()
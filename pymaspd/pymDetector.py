@@ -1,9 +1,22 @@
 from pymJob import *
+import json
+import functools
+import numpy as np
+import pymJournal
+import pymEvents
+import pymDevices
 
 class pymDetector(pymJob):
     """ Class to acquire data from a specific detector. Please note that all instances of this class will be deleted
         after they ran. Use this as a wrapper of a module or use class variables if you need variables (such as hardware
-        handles) to persist throughout a session.
+        handles) to persist throughout a session, or better get the hardware handle from the device pool with
+        get_device(), which shares it with the other detectors using the same device and unloads it once unused.
+        Declare blocking calls of the hardware (eg. an exposure) with pymDriver.blocking, they must not block the
+        event loop.
+        run() may return a callable for late collection of the data. Several of these may be in flight at the same
+        time (see pymPipeline), so they must not rely on per-acquisition instance variables.
+        The default run() acquires a burst of frames with acquire_n() and stores them as one array with one journal
+        entry, detectors only need to implement read_frame() then, or acquire_n() if they buffer frames in hardware.
     """
     def description(self):
         raise NotImplementedError
@@ -11,9 +24,74 @@ class pymDetector(pymJob):
     def __init__(self, jobid):
         super().__init__(jobid)
         self.initialized = False
+        # frames per run
+        self.burst = 1
 
     def initialize(self):
-        if self.initialized:
-            return True
-        else:
-            return self._initialize()
+        if not self.initialized:
+            self.initialized = bool(self._initialize())
+        return self.initialized
+
+    def get_device(self, cls, config=None):
+        """
+        Shared hardware handle, see pymDevices.acquire. The reference is dropped with this detector.
+        Hold pymDevices.lock(device) while using it.
+        """
+        return pymDevices.acquire(cls, config, owner=self)
+
+    def getsettings(self):
+        return {
+            'burst': {'current': self.burst, 'type': 'int', 'hint': 'Frames per acquisition, stored as one array', 'ro': False},
+        }
+
+    def updatejob(self, settings_dict):
+        res = False
+        if 'burst' in settings_dict:
+            if int(settings_dict['burst']) < 1:
+                raise pymException.pymOutOfBound
+            self.burst = int(settings_dict['burst'])
+            res = True
+        return res
+
+    async def read_frame(self):
+        """
+        Acquire one frame
+        :return: numpy array
+        """
+        raise NotImplementedError
+
+    async def acquire_n(self, n):
+        """
+        Acquire n frames back to back. Detectors with a hardware buffer implement this, otherwise the frames are read
+        one by one
+        :return: numpy array of shape (n,) + frame shape
+        """
+        return np.stack([await self.read_frame() for _ in range(n)])
+
+    async def run(self, parent_id):
+        """
+        Acquire a burst of frames. A burst is one job in the journal with one array of shape (burst,) + frame shape,
+        single frames are stored as they are
+        :return: late collection storing the data
+        """
+        jid = pymJournal.add_job(parent_id, title=str(self.description()[0]),
+                                 json_meta=json.dumps({'burst': self.burst}) if self.burst > 1 else None)
+        self.running = True
+        try:
+            data = await self.acquire_n(self.burst)
+        finally:
+            self.running = False
+        if self.burst == 1:
+            data = data[0]
+        return functools.partial(self.store, jid, data)
+
+    async def store(self, jid, data):
+        """
+        Late collection of run(): store the data of a burst
+        :return: journal id of the burst
+        """
+        data_id = pymJournal.add_data(data, jid)
+        pymEvents.publish("data", {"journal_id": jid, "data_id": data_id}, [data])
+        # update job entry to chain to our added data
+        pymJournal.update_job(jid, assoc_data=data_id)
+        return jid
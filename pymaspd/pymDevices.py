@@ -0,0 +1,192 @@
+"""
+Process wide pool of devices: parameters and the hardware handles of detectors. Opening a connection to a device and
+homing it can take seconds, so every device (class and configuration) is created once and shared by all jobs using it.
+    acquire() hands out the shared instance and counts the reference, release() or the owner being garbage collected
+    drops it again
+    devices are initialized on first use (see pymParameter.go), not when they are acquired
+    lock() serializes the access of several jobs to a device
+    reap() unloads devices which have not been referenced for ttl seconds, the daemon calls it periodically
+"""
+import json
+import time
+import asyncio
+import logging
+import weakref
+import threading
+
+import pymDriver
+
+
+# seconds a device without references is kept before it gets unloaded, None to keep it forever
+ttl = 300.0
+
+# key -> pymDevice
+_devices = {}
+# id of instance -> pymDevice
+_instances = {}
+# locks of instances which are not pooled
+_locks = weakref.WeakKeyDictionary()
+_mutex = threading.RLock()
+
+
+class pymDevice:
+    """
+    Entry of the pool
+    """
+    def __init__(self, key, instance):
+        self.key = key
+        self.instance = instance
+        self.refcount = 0
+        # time the last reference got dropped
+        self.idle_since = time.monotonic()
+        self.lock = asyncio.Lock()
+        # owner -> finalizer dropping its reference
+        self.owners = weakref.WeakKeyDictionary()
+
+
+def device_key(cls, config=None):
+    """
+    Devices of the same class and configuration are shared
+    """
+    return cls.__module__ + "." + cls.__qualname__, json.dumps(config or {}, sort_keys=True)
+
+
+def acquire(cls, config=None, owner=None):
+    """
+    Get the shared instance of a device, creating it if necessary
+    :param cls: device class, see create()
+    :param config: dict of JSON serializable settings (eg. port or address), available as instance.config
+    :param owner: object holding the reference, it is dropped when owner is garbage collected. Every owner holds one
+    reference at most.
+    :return: the device instance
+    """
+    key = device_key(cls, config)
+    with _mutex:
+        device = _devices.get(key)
+        if device is None:
+            logging.debug("Creating device %s %s" % key)
+            instance = create(cls, config)
+            device = pymDevice(key, instance)
+            _devices[key] = device
+            _instances[id(instance)] = device
+        if owner is not None:
+            if owner in device.owners:
+                return device.instance
+            device.owners[owner] = weakref.finalize(owner, _drop, key)
+        device.refcount += 1
+        return device.instance
+
+
+def create(cls, config=None):
+    """
+    New instance of a device, outside of the pool
+    """
+    if hasattr(cls, 'create_device'):
+        return cls.create_device(config or {})
+    instance = cls()
+    instance.config = dict(config or {})
+    return instance
+
+
+def release(instance, owner=None):
+    """
+    Drop a reference to a pooled device. Instances which are not pooled are ignored.
+    :param owner: the owner given to acquire()
+    """
+    with _mutex:
+        device = _instances.get(id(instance))
+        if device is None or device.instance is not instance:
+            return
+        if owner is not None:
+            finalizer = device.owners.pop(owner, None)
+            if finalizer is None:
+                return
+            finalizer.detach()
+        _drop(device.key)
+
+
+def _drop(key):
+    with _mutex:
+        device = _devices.get(key)
+        if device is None:
+            return
+        device.refcount -= 1
+        if device.refcount <= 0:
+            device.refcount = 0
+            device.idle_since = time.monotonic()
+
+
+def lock(instance):
+    """
+    Lock of a device, hold it while using the device. Instances which are not pooled get a lock of their own.
+    :return: asyncio.Lock
+    """
+    with _mutex:
+        device = _instances.get(id(instance))
+        if device is not None and device.instance is instance:
+            return device.lock
+        if instance not in _locks:
+            _locks[instance] = asyncio.Lock()
+        return _locks[instance]
+
+
+def reap(now=None):
+    """
+    Unload devices which have not been referenced for ttl seconds
+    :return: number of unloaded devices
+    """
+    if ttl is None:
+        return 0
+    now = time.monotonic() if now is None else now
+    with _mutex:
+        idle = [device for device in _devices.values()
+                if device.refcount == 0 and now - device.idle_since >= ttl and not device.lock.locked()]
+        for device in idle:
+            _remove(device)
+    for device in idle:
+        _unload(device)
+    return len(idle)
+
+
+def unload_all():
+    """
+    Unload all devices, eg. at shutdown
+    """
+    with _mutex:
+        devices = list(_devices.values())
+        for device in devices:
+            _remove(device)
+    for device in devices:
+        _unload(device)
+
+
+def stats():
+    """
+    :return: list of dicts with key, references, idle seconds and move counters (see pymParameter.go) of the pooled
+    devices
+    """
+    now = time.monotonic()
+    with _mutex:
+        return [{"device": device.key[0], "config": device.key[1], "refcount": device.refcount,
+                 "idle": now - device.idle_since if device.refcount == 0 else 0.0,
+                 "moves": dict(getattr(device.instance, 'move_stats', {}))} for device in _devices.values()]
+
+
+def _remove(device):
+    del _devices[device.key]
+    del _instances[id(device.instance)]
+    for finalizer in device.owners.values():
+        finalizer.detach()
+
+
+def _unload(device):
+    logging.debug("Unloading device %s %s" % device.key)
+    unload = getattr(device.instance, 'unload', None)
+    try:
+        if unload is not None:
+            unload()
+    except Exception as err:
+        logging.warning("Unloading device %s failed: %s" % (device.key[0], err))
+    finally:
+        # the driver thread or process of blocking methods
+        pymDriver.shutdown(device.instance)
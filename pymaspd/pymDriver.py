@@ -0,0 +1,183 @@
+"""
+Adapter for blocking hardware drivers. Most vendor SDKs block until a move or an exposure is done, called from a
+coroutine that freezes the event loop and with it RPC and the journal. Methods declared with @blocking become
+coroutines which run the method on a thread of the device instead:
+    class my_stage(pymParameter):
+        @blocking(timeout=30, abort='stop')
+        def move(self, value):
+            self.sdk.move_absolute(value)   # blocks
+
+        def stop(self):
+            self.sdk.halt()
+
+        async def set(self, value, channel, wait=True):
+            return await self.move(value)
+Every device (instance) gets one thread, so its blocking methods run one after the other, in the order they were
+called. Drivers which are not thread safe at all set blocking_process = True on the class, their blocking methods run
+in a process of the device which holds an instance of its own, created like the device pool does (see
+pymDevices.create). Arguments and results have to be picklable then, and the state changed by the blocking methods
+stays in that process.
+A timeout raises pymJobTimeout. On a timeout or when the awaiting task gets cancelled the abort method (a plain, thread
+safe method) is called, a device process is killed and started again on the next call. A thread can't be killed, the
+next calls of the device wait for the blocking call to return.
+"""
+import sys
+import asyncio
+import logging
+import weakref
+import functools
+import importlib
+import threading
+import multiprocessing
+import concurrent.futures
+
+import pymException
+
+
+# instance -> pymDriverWorker
+_workers = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def blocking(func=None, timeout=None, abort=None):
+    """
+    Declare a method as blocking, it becomes a coroutine running on the thread (or process) of the device
+    :param timeout: seconds after which a call raises pymJobTimeout, None to wait forever
+    :param abort: name of the method stopping the device on a timeout or cancellation
+    """
+    def decorate(method):
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            return await call(self, method, args, kwargs, timeout, abort)
+        # the blocking method itself, eg. for device processes
+        wrapper.blocking = method
+        return wrapper
+    if func is not None:
+        return decorate(func)
+    return decorate
+
+
+async def call(instance, method, args=(), kwargs=None, timeout=None, abort=None):
+    """
+    Run a blocking method of a device on its thread or process
+    :param method: the function, not the bound method
+    :return: result of the method
+    """
+    worker = _worker(instance)
+    loop = asyncio.get_event_loop()
+    future = loop.run_in_executor(worker.executor, worker.run, instance, method, args, kwargs or {})
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        logging.warning("%s.%s timed out after %s s" % (type(instance).__name__, method.__name__, timeout))
+        await _abort(worker, instance, abort)
+        raise pymException.pymJobTimeout("%s.%s timed out" % (type(instance).__name__, method.__name__))
+    except asyncio.CancelledError:
+        await _abort(worker, instance, abort)
+        raise
+
+
+def shutdown(instance):
+    """
+    Stop the thread and process of a device, eg. when it gets unloaded
+    """
+    with _lock:
+        worker = _workers.pop(instance, None)
+    if worker is not None:
+        worker.shutdown()
+
+
+async def _abort(worker, instance, abort):
+    if worker.process is not None:
+        logging.warning("Killing process of %s" % type(instance).__name__)
+        worker.kill()
+    if abort is None:
+        return
+    try:
+        # the thread of the device is still busy with the blocking call
+        await asyncio.get_event_loop().run_in_executor(None, getattr(instance, abort))
+    except Exception as err:
+        logging.warning("Aborting %s failed: %s" % (type(instance).__name__, err))
+
+
+def _worker(instance):
+    with _lock:
+        worker = _workers.get(instance)
+        if worker is None:
+            worker = pymDriverWorker(type(instance), getattr(instance, 'config', None),
+                                     getattr(type(instance), 'blocking_process', False))
+            _workers[instance] = worker
+        return worker
+
+
+class pymDriverWorker:
+    """
+    Thread, and process if requested, running the blocking methods of one device
+    """
+    def __init__(self, cls, config, use_process):
+        self.cls = cls
+        self.config = config
+        self.use_process = use_process
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1,
+                                                              thread_name_prefix="pymaspd-%s" % cls.__name__)
+        self.process = None
+        self.conn = None
+
+    def run(self, instance, method, args, kwargs):
+        # on the thread of the device
+        if not self.use_process:
+            return method(instance, *args, **kwargs)
+        if self.process is None:
+            self.start()
+        conn = self.conn
+        try:
+            conn.send((method.__name__, args, kwargs))
+            ok, value = conn.recv()
+        except (EOFError, OSError):
+            raise pymException.pymJobException("Process of %s ended" % self.cls.__name__)
+        if ok:
+            return value
+        raise value
+
+    def start(self):
+        self.conn, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_serve, name="pymaspd-%s" % self.cls.__name__, daemon=True,
+                                               args=(child, self.cls.__module__, self.cls.__qualname__,
+                                                     list(sys.path), self.config))
+        self.process.start()
+        child.close()
+
+    def kill(self):
+        process, conn = self.process, self.conn
+        self.process = self.conn = None
+        if process is not None:
+            process.kill()
+            conn.close()
+
+    def shutdown(self):
+        self.kill()
+        self.executor.shutdown(wait=False)
+
+
+def _serve(conn, module, qualname, path, config):
+    # main loop of a device process. The class is imported by name, plugins may come from any plugin directory
+    sys.path[:] = path
+    import pymDevices
+    cls = importlib.import_module(module)
+    for name in qualname.split('.'):
+        cls = getattr(cls, name)
+    instance = pymDevices.create(cls, config)
+    while True:
+        try:
+            name, args, kwargs = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            reply = (True, getattr(cls, name).blocking(instance, *args, **kwargs))
+        except Exception as err:
+            reply = (False, err)
+        try:
+            conn.send(reply)
+        except Exception as err:
+            # eg. a result which can't be pickled
+            conn.send((False, pymException.pymJobException("%s: %s" % (name, err))))
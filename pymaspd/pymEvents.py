@@ -0,0 +1,82 @@
+"""
+Live events of pymaspd, published on a ZeroMQ PUB socket.
+Every event is a multipart message: the topic, a JSON header and one raw frame per attached array. The header holds
+the topic, a timestamp, the payload and dtype and shape of the attached arrays.
+Topics:
+    job_started, job_finished: a job of the queue started or finished
+    point: a scan point got collected (journal id of the scan, parameter value(s), journal id of the job run there)
+    data: a detector stored data (journal id of the job, data id, the array)
+    queue: the job queue changed (revision, kind of change, job id)
+"""
+import json
+import time
+import logging
+import zmq
+import numpy as np
+
+
+_sock = None
+# minimal interval in seconds between two events of a topic, events in between are dropped
+_rate_limits = {}
+_last_sent = {}
+# events dropped by rate limit or because the socket couldn't take them
+dropped = {}
+
+
+def open(addr, context=None, rate_limits=None):
+    """
+    Bind the PUB socket
+    :param addr: address to bind to
+    :param context: zmq context, defaults to the global instance
+    :param rate_limits: dict topic -> minimal interval in seconds
+    """
+    global _sock
+    close()
+    context = context or zmq.Context.instance()
+    _sock = context.socket(zmq.PUB)
+    _sock.bind(addr)
+    set_rate_limits(rate_limits or {})
+
+
+def close():
+    global _sock
+    if _sock is not None:
+        _sock.close(linger=0)
+        _sock = None
+
+
+def set_rate_limits(rate_limits):
+    _rate_limits.clear()
+    _rate_limits.update(rate_limits)
+
+
+def publish(topic, payload=None, arrays=()):
+    """
+    Publish an event. Never blocks: if nobody listens or the subscribers are too slow, the event is dropped.
+    Arrays are sent without copying, don't modify them afterwards.
+    :param topic: topic of the event
+    :param payload: JSON serializable payload
+    :param arrays: numpy arrays to attach as raw frames
+    :return: True if the event was sent
+    """
+    if _sock is None:
+        return False
+    now = time.monotonic()
+    interval = _rate_limits.get(topic)
+    if interval and now - _last_sent.get(topic, -interval) < interval:
+        dropped[topic] = dropped.get(topic, 0) + 1
+        return False
+    _last_sent[topic] = now
+    arrays = [a if a.flags.c_contiguous else np.ascontiguousarray(a) for a in arrays]
+    header = {"topic": topic, "time": time.time(), "payload": payload,
+              "arrays": [{"dtype": a.dtype.str, "shape": a.shape} for a in arrays]}
+    try:
+        _sock.send_multipart([topic.encode('utf8'), json.dumps(header).encode('utf8')] + arrays,
+                             flags=zmq.NOBLOCK, copy=False)
+    except zmq.Again:
+        dropped[topic] = dropped.get(topic, 0) + 1
+        return False
+    except (TypeError, ValueError) as err:
+        logging.warning("Couldn't publish %s event: %s" % (topic, err))
+        return False
+    return True
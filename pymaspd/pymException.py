@@ -17,4 +17,13 @@ class pymJobRunning(pymJobException):
 
 
 class pymOutOfBound(pymJobException):
-    pass
\ No newline at end of file
+    pass
+
+class pymJobTimeout(pymJobException):
+    pass
+
+class pymTemplateError(pymJobException):
+    pass
+
+class pymPluginError(pymJobNotExist):
+    pass
@@ -0,0 +1,224 @@
+import time
+import json
+import inspect
+import asyncio
+import logging
+import numpy as np
+import pymJournal
+import pymException
+import pymEvents
+from pymJob import *
+from pymParameter import *
+from pymGrid import pymGridAxis
+from pymPipeline import pymPipeline
+
+
+class pymFlyScan(pymJob):
+    __doc__ = "moves one parameter continuously over its range and runs one job after the other meanwhile"
+
+    def __init__(self, jobid):
+        super().__init__(jobid)
+        # parameter, channel and range, the steps are the frames we get
+        self.axis = pymGridAxis()
+        self.job = None
+        self.running = False
+        # seconds between two readbacks of the parameter's position
+        self.sample_interval = 0.01
+        # how many frames may be acquired but not yet collected
+        self.pipeline_depth = 1
+
+    def get_subjobs(self):
+        if isinstance(self.job, pymJob):
+            return [self.job]
+        return []
+
+    def ismutable(self):
+        if isinstance(self.job, pymJob):
+            return self.job.ismutable()
+        return False
+
+    def appendjob(self, job):
+        if self.ismutable():
+            return self.job.appendjob(job)
+        return False
+
+    def deletejob(self, job):
+        if self.ismutable():
+            return self.job.deletejob(job)
+        return False
+
+    def insertjobafter(self, job, refjob):
+        if self.ismutable():
+            return self.job.insertjobafter(job, refjob)
+        return False
+
+    def movejob(self, job, n):
+        if self.ismutable():
+            return self.job.movejob(job, n)
+        return False
+
+    def description(self):
+        if isinstance(self.axis.parameter, pymParameter):
+            param_name = str(self.axis.parameter.description()[0])
+        else:
+            param_name = "(tbd)"
+        desc = "Fly " + param_name + " from " + str(self.axis.range_min) + " to " + str(self.axis.range_max)
+        return (desc, [self.axis.parameter, self.job])
+
+    def updatejob(self, settings_dict):
+        """
+        Update settings of this job according to values supplied by the dictionary.
+        The dictionary is expected to supply values to the keys as give by the getsettings() method.
+        :param settings_dict:
+        :return: True if any settings have been changed successfully
+        """
+        res = False
+        axis_settings = {key: settings_dict[key] for key in ('parameter', 'channel', 'range') if key in settings_dict}
+        if axis_settings:
+            self.axis.updatesettings(axis_settings)
+            res = True
+
+        if 'job' in settings_dict:
+            if settings_dict['job'] != type(self.job).__name__:
+                self.job = pymJobFactory.createJob(settings_dict['job'])
+                res = True
+
+        if 'parameterSettings' in settings_dict:
+            if isinstance(self.axis.parameter, pymParameter):
+                if self.axis.parameter.updatesettings(settings_dict['parameterSettings']):
+                    res = True
+
+        if 'jobSettings' in settings_dict:
+            if isinstance(self.job, pymJob):
+                if self.job.updatejob(settings_dict['jobSettings']):
+                    res = True
+
+        if 'sampleInterval' in settings_dict:
+            if float(settings_dict['sampleInterval']) <= 0:
+                raise pymException.pymOutOfBound
+            self.sample_interval = float(settings_dict['sampleInterval'])
+            res = True
+
+        if 'pipelineDepth' in settings_dict:
+            if int(settings_dict['pipelineDepth']) < 1:
+                raise pymException.pymOutOfBound
+            self.pipeline_depth = int(settings_dict['pipelineDepth'])
+            res = True
+
+        return res
+
+    def getsettings(self):
+        """
+        Returns a dictionary with settings to be set. Each key includes a own dictionary with current values (current),
+        expected type (type), optional human readable hint (hint) and flag if parameter is read only (ro)
+        :return: settings_dict
+        """
+        return {
+            'parameter': {'current': self.axis.parameter, 'type': 'pynParameter', 'hint': 'Parameter which will be moved', 'ro': False},
+            'channel': {'current': self.axis.channel, 'type': 'int', 'hint': 'Channel of the parameter', 'ro': False},
+            'range': {'current': (self.axis.range_min, self.axis.range_max), 'type': 'touple', 'hint': 'Start and end of the move', 'ro': False},
+            'job': {'current': self.job, 'type': 'pynJob', 'hint': 'subjob which will be run during the move, back to back', 'ro': False},
+            'sampleInterval': {'current': self.sample_interval, 'type': 'double', 'hint': 'Seconds between readbacks of the parameter', 'ro': False},
+            'pipelineDepth': {'current': self.pipeline_depth, 'type': 'int', 'hint': 'Frames acquired ahead of data collection', 'ro': False},
+            'jobSettings': {'current': self.job.getsettings() if isinstance(self.job, pymJob) else None, 'type': 'settings_dict', 'hint': 'Settings of the attached subjob', 'ro': False},
+            'parameterSettings': {'current': self.axis.parameter.getsettings() if isinstance(self.axis.parameter, pymParameter) else None, 'type': 'settings_dict', 'hint': 'Settings of the attached parameter', 'ro': False},
+        }
+
+    def process_late_collection(self, result, frame):
+        """
+        Callback of the acquisition pipeline. Positions are known once the move is done, so frames are kept until then
+        """
+        self.frames.append((result, frame))
+
+    async def read_position(self, samples):
+        """
+        Append one (timestamp, position) readback of the parameter to samples
+        """
+        t0 = time.monotonic()
+        position = self.axis.parameter.get_position(self.axis.channel)
+        if inspect.isawaitable(position):
+            position = await position
+        if position is not None:
+            samples.append(((t0 + time.monotonic()) / 2, position))
+
+    async def sample(self, samples, done):
+        """
+        Read back the position of the parameter until done is set. get_position() may be a coroutine, eg. a blocking
+        driver call (see pymDriver)
+        :param samples: list the (timestamp, position) tuples are appended to
+        """
+        while not done.is_set():
+            await self.read_position(samples)
+            try:
+                await asyncio.wait_for(done.wait(), self.sample_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self, parent_id):
+        """
+        Run the fly scan as a asyncio coroutine: move to the start, start the move to the end and run the job back to
+        back until the parameter arrived. The parameter value of each frame is interpolated from the readbacks at the
+        middle of its run().
+        :return:
+        """
+        self.running = True
+        parameter, channel = self.axis.parameter, self.axis.channel
+        self.journal_id = pymJournal.add_job(parent_id, self.description()[0], json.dumps(
+            {'axis': self.axis.getsettings(),
+             'sample_interval': self.sample_interval}))
+        self.frames = []
+        times = []
+        samples = []
+        done = asyncio.Event()
+        pipeline = pymPipeline(self.pipeline_depth, self.process_late_collection)
+        move = None
+        sampler = None
+        try:
+            await parameter.go(self.axis.range_min, channel, wait=True)
+            # the readbacks have to cover all frames, from before the move starts until it is done
+            await self.read_position(samples)
+            sampler = asyncio.ensure_future(self.sample(samples, done))
+            move = asyncio.ensure_future(parameter.go(self.axis.range_max, channel, wait=True))
+            while not move.done():
+                t0 = time.monotonic()
+                result = await self.job.run(self.journal_id)
+                times.append((t0 + time.monotonic()) / 2)
+                await pipeline.submit(result, len(times) - 1)
+            # raises if the move failed
+            await move
+            done.set()
+            await sampler
+            await self.read_position(samples)
+            await pipeline.drain()
+        finally:
+            done.set()
+            for task in (move, sampler):
+                if task is not None and not task.done():
+                    task.cancel()
+            pipeline.cancel()
+            self.running = False
+        if not samples:
+            raise pymException.pymJobException("%s has no position readback" % type(parameter).__name__)
+        samples = np.asarray(samples, dtype=float)
+        values = np.interp(times, samples[:, 0], samples[:, 1])
+        # np.interp clamps, frames outside of the readbacks get no parameter value rather than a wrong one
+        times = np.asarray(times)
+        unsampled = np.flatnonzero((times < samples[0, 0]) | (times > samples[-1, 0])).tolist()
+        skip = set(unsampled)
+        if unsampled:
+            logging.warning("Fly scan: %d frames outside of the position readbacks" % len(unsampled))
+        for result, frame in self.frames:
+            if result and frame not in skip:
+                pymJournal.assign_parameter_to_job(result, float(values[frame]), self.journal_id)
+                pymEvents.publish("point", {"journal_id": self.journal_id, "value": float(values[frame]),
+                                            "assoc_job": result})
+        logging.debug("Fly scan took %d frames and %d position samples" % (len(times), len(samples)))
+        # the readbacks (monotonic time, position) are kept with the scan
+        pymJournal.update_job(self.journal_id, assoc_data=pymJournal.add_data(samples, self.journal_id),
+                              json_meta=json.dumps({'axis': self.axis.getsettings(),
+                                                    'sample_interval': self.sample_interval,
+                                                    'frames': len(times),
+                                                    'frame_times': times.tolist(),
+                                                    'unsampled_frames': unsampled,
+                                                    'assoc_list': [result for result, _ in self.frames]}))
+        return self.journal_id
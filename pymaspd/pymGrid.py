@@ -0,0 +1,234 @@
+import logging
+import json
+import asyncio
+import numpy as np
+import pymJournal
+import pymException
+import pymOrdering
+import pymEvents
+import pymDevices
+from pymJob import *
+from pymParameter import *
+from pymPipeline import pymPipeline
+
+
+class pymGridAxis:
+    """
+    One axis of a pymGrid: a parameter, its channel and the values it takes
+    """
+    def __init__(self, parameter=None, channel=0, range_min=0, range_max=0, steps=1):
+        self.parameter = parameter
+        self.channel = channel
+        self.range_min = range_min
+        self.range_max = range_max
+        self.steps = steps
+
+    def points(self):
+        values = np.linspace(self.range_min, self.range_max, self.steps)
+        if isinstance(self.parameter, pymParameter):
+            # clamped and rounded to reachable values, one call for all points
+            values = self.parameter.sanityCheckValue(values, self.channel)
+            values = np.asarray(self.parameter.getClosestParameterValue(values, self.channel), dtype=float)
+        return values
+
+    def parameter_name(self):
+        return type(self.parameter).__name__ if isinstance(self.parameter, pymParameter) else None
+
+    def getsettings(self):
+        return {
+            'parameter': self.parameter_name(),
+            'channel': self.channel,
+            'range': (self.range_min, self.range_max),
+            'steps': self.steps,
+        }
+
+    def updatesettings(self, settings_dict):
+        if 'parameter' in settings_dict:
+            if settings_dict['parameter'] != self.parameter_name():
+                pymDevices.release(self.parameter, owner=self)
+                self.parameter = pynParameterFactory.createParameter(settings_dict['parameter'], owner=self)
+        if 'channel' in settings_dict:
+            self.channel = settings_dict['channel']
+        if 'range' in settings_dict:
+            self.range_min, self.range_max = settings_dict['range']
+        if 'steps' in settings_dict:
+            if int(settings_dict['steps']) < 1:
+                raise pymException.pymOutOfBound
+            self.steps = int(settings_dict['steps'])
+
+
+class pymGrid(pymJob):
+    __doc__ = "scans several parameters over a grid as one job and does one job for each point"
+
+    def __init__(self, jobid):
+        super().__init__(jobid)
+        self.axes = []
+        self.job = None
+        self.running = False
+        self.ordering = 'serpentine'
+        # how many points may be acquired but not yet collected
+        self.pipeline_depth = 1
+
+    def get_subjobs(self):
+        if isinstance(self.job, pymJob):
+            return [self.job]
+        return []
+
+    def ismutable(self):
+        if isinstance(self.job, pymJob):
+            return self.job.ismutable()
+        return False
+
+    def appendjob(self, job):
+        if self.ismutable():
+            return self.job.appendjob(job)
+        return False
+
+    def deletejob(self, job):
+        if self.ismutable():
+            return self.job.deletejob(job)
+        return False
+
+    def insertjobafter(self, job, refjob):
+        if self.ismutable():
+            return self.job.insertjobafter(job, refjob)
+        return False
+
+    def movejob(self, job, n):
+        if self.ismutable():
+            return self.job.movejob(job, n)
+        return False
+
+    def description(self):
+        parts = []
+        for axis in self.axes:
+            if isinstance(axis.parameter, pymParameter):
+                param_name = str(axis.parameter.description()[0])
+            else:
+                param_name = "(tbd)"
+            parts.append(param_name + " from " + str(axis.range_min) + " to " + str(axis.range_max) +
+                         " (" + str(axis.steps) + " Steps)")
+        desc = "Grid (" + self.ordering + "): " + ", ".join(parts)
+        return (desc, [self.job])
+
+    def get_shape(self):
+        return tuple(axis.steps for axis in self.axes)
+
+    def updatejob(self, settings_dict):
+        """
+        Update settings of this job according to values supplied by the dictionary.
+        The dictionary is expected to supply values to the keys as give by the getsettings() method.
+        :param settings_dict:
+        :return: True if any settings have been changed successfully
+        """
+        res = False
+        if 'axes' in settings_dict:
+            # list of axis settings, the grid gets as many axes as supplied
+            axes = settings_dict['axes']
+            if not axes:
+                raise pymException.pymOutOfBound
+            while len(self.axes) > len(axes):
+                self.axes.pop()
+            while len(self.axes) < len(axes):
+                self.axes.append(pymGridAxis())
+            for axis, axis_settings in zip(self.axes, axes):
+                axis.updatesettings(axis_settings)
+            res = True
+
+        if 'job' in settings_dict:
+            if settings_dict['job'] == type(self.job).__name__:
+                logging.debug("Same class for Job was supplied as already set, don't change anything")
+            else:
+                del self.job
+                self.job = pymJobFactory.createJob(settings_dict['job'])
+                res = True
+
+        if 'jobSettings' in settings_dict:
+            if isinstance(self.job, pymJob):
+                if self.job.updatejob(settings_dict['jobSettings']):
+                    res = True
+
+        if 'ordering' in settings_dict:
+            if settings_dict['ordering'] not in pymOrdering.ORDERINGS:
+                raise pymException.pymOutOfBound
+            self.ordering = settings_dict['ordering']
+            res = True
+
+        if 'pipelineDepth' in settings_dict:
+            if int(settings_dict['pipelineDepth']) < 1:
+                raise pymException.pymOutOfBound
+            self.pipeline_depth = int(settings_dict['pipelineDepth'])
+            res = True
+
+        return res
+
+    def getsettings(self):
+        """
+        Returns a dictionary with settings to be set. Each key includes a own dictionary with current values (current),
+        expected type (type), optional human readable hint (hint) and flag if parameter is read only (ro)
+        :return: settings_dict
+        """
+        return {
+            'axes': {'current': [axis.getsettings() for axis in self.axes], 'type': 'list', 'hint': 'Parameter, channel, range and steps of each axis, slowest axis first', 'ro': False},
+            'job': {'current': self.job, 'type': 'pynJob', 'hint': 'subjob which will be run for each point', 'ro': False},
+            'ordering': {'current': self.ordering, 'type': 'string', 'hint': 'Order of the points: ' + ", ".join(pymOrdering.ORDERINGS), 'ro': False},
+            'pipelineDepth': {'current': self.pipeline_depth, 'type': 'int', 'hint': 'Points acquired ahead of data collection', 'ro': False},
+            'jobSettings': {'current': self.job.getsettings() if isinstance(self.job, pymJob) else None, 'type': 'settings_dict', 'hint': 'Settings of the attached subjob', 'ro': False},
+        }
+
+    def get_points(self):
+        """
+        Parameter tuples of all points in the order they will be visited
+        :return: (index tuples, parameter tuples), both of shape (points, axes)
+        """
+        order = pymOrdering.ORDERINGS[self.ordering](self.get_shape())
+        values = np.column_stack([axis.points()[order[:, k]] for k, axis in enumerate(self.axes)])
+        return order, values
+
+    def process_late_collection(self, result, point):
+        """
+        Callback of the acquisition pipeline, receives the collected results in point order
+        """
+        if result:
+            pymJournal.assign_point_to_job(result, point, self.journal_id)
+            pymEvents.publish("point", {"journal_id": self.journal_id, "point": point,
+                                        "value": self.values[point].tolist(), "assoc_job": result})
+
+    async def run(self, parent_id):
+        """
+        Run the grid as a asyncio coroutine
+        :return:
+        """
+        if not self.axes:
+            raise pymException.pymJobException("Grid has no axes")
+        for axis in self.axes:
+            if not isinstance(axis.parameter, pymParameter):
+                raise pymException.pymJobException("Grid axis without parameter")
+        self.running = True
+        order, values = self.get_points()
+        self.values = values
+        # the parameter tuples of all points are stored once with the meta data, not as data of the grid, the journal
+        # only links point numbers to jobs
+        self.journal_id = pymJournal.add_job(parent_id, self.description()[0], json.dumps(
+            {'axes': [axis.getsettings() for axis in self.axes],
+             'ordering': self.ordering,
+             'shape': self.get_shape(),
+             'points': values.tolist()}))
+        pipeline = pymPipeline(self.pipeline_depth, self.process_late_collection)
+        last = None
+        try:
+            for point, index in enumerate(order):
+                # only move axes which change, all at once: the channels of a device by one move
+                moves = {}
+                for k, axis in enumerate(self.axes):
+                    if last is None or index[k] != last[k]:
+                        moves.setdefault(axis.parameter, {})[axis.channel] = values[point, k]
+                await asyncio.gather(*(parameter.go_multi(targets) for parameter, targets in moves.items()))
+                last = index
+                result = await self.job.run(self.journal_id)
+                await pipeline.submit(result, point)
+            await pipeline.drain()
+        finally:
+            pipeline.cancel()
+            self.running = False
+        return self.journal_id
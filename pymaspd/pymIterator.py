@@ -1,8 +1,26 @@
 import logging
 import json
+import numpy as np
 import pymJournal
+import pymException
+import pymEvents
+import pymDevices
+import pymOrdering
 from pymJob import *
 from pymParameter import *
+from pymPipeline import pymPipeline
+
+# how the values between range_min and range_max are spaced: by stepsize (range_max excluded), or steps values
+# including both ends, linearly or logarithmically
+SPACINGS = ('step', 'linear', 'log')
+
+
+def log_range(range_min, range_max):
+    """
+    Can the range be spaced logarithmically: both ends on the same side of zero
+    """
+    return range_min != 0 and range_max != 0 and (range_min < 0) == (range_max < 0)
+
 
 class pymIterator(pymJob):
     __doc__ =  "iterates over one parameter's range and does one job for each parameter"
@@ -13,6 +31,28 @@ class pymIterator(pymJob):
         self.job = None
         self.running = None
         self.use_altunit = False
+        self.channel = 0
+        self.range_min = 0
+        self.range_max = 0
+        self.stepsize = 1
+        self.spacing = 'step'
+        # number of values in any spacing, None: as many as the stepsize gives
+        self.num_steps = None
+        # values to visit instead of the range, in any order
+        self.points = None
+        # values of one repetition, see get_grid
+        self._grid = None
+        # order of the values in every repetition, see pymOrdering.SEQUENCES
+        self.ordering = 'loop'
+        self.repeats = 1
+        self.seed = None
+        # how many points may be acquired but not yet collected
+        self.pipeline_depth = 1
+
+    def get_subjobs(self):
+        if isinstance(self.job, pymJob):
+            return [self.job]
+        return []
 
     def ismutable(self):
         if isinstance(self.job, pymJob):
@@ -44,7 +84,7 @@ class pymIterator(pymJob):
 
     def description(self):
         if isinstance(self.parameter, pymParameter):
-            param_name = self.parameter.description()
+            param_name = str(self.parameter.description()[0])
             if self.use_altunit:
                 param_unit = str(self.parameter.altUnitString)
             else:
@@ -53,35 +93,78 @@ class pymIterator(pymJob):
             param_name = "(tbd)"
             param_unit = ""
         (param_min, param_max) = self.get_range()
-        desc = "Vary " + param_name + " from " + str(param_min) + " to " + str(param_max) + " " + param_unit + " (" + str(self.get_steps()) + " Steps)"
+        if self.points is not None:
+            desc = "Vary " + param_name + " over " + str(len(self.points)) + " points " + param_unit
+        else:
+            desc = "Vary " + param_name + " from " + str(param_min) + " to " + str(param_max) + " " + param_unit + " (" + str(self.get_steps()) + " Steps)"
+        if self.repeats > 1 or self.ordering != 'loop':
+            desc += ", " + self.ordering + " x" + str(self.repeats)
         return (desc, [self.parameter, self.job])
 
     def updatejob(self, settings_dict):
         """
         Update settings of this job according to values supplied by the dictionary.
         The dictionary is expected to supply values to the keys as give by the getsettings() method.
+        Either all settings are taken or none: if one is rejected, the job is left as it was. Settings of the attached
+        parameter and subjob are taken by those.
         :param settings_dict:
         :return: True if any settings have been changed successfully
         """
+        # check what doesn't depend on the parameter before anything is changed
+        self._check_settings(settings_dict)
+        saved = dict(self.__dict__)
+        old_parameter = self.parameter
+        try:
+            res = self._apply_settings(settings_dict)
+        except Exception:
+            # give a new parameter back to the device pool and restore our own settings
+            if self.parameter is not old_parameter:
+                pymDevices.release(self.parameter, owner=self)
+            self.__dict__.clear()
+            self.__dict__.update(saved)
+            raise
+        if self.parameter is not old_parameter:
+            # give the old parameter back to the device pool
+            pymDevices.release(old_parameter, owner=self)
+        return res
+
+    def _check_settings(self, settings_dict):
+        if 'pipelineDepth' in settings_dict and int(settings_dict['pipelineDepth']) < 1:
+            raise pymException.pymOutOfBound
+        if 'ordering' in settings_dict and settings_dict['ordering'] not in pymOrdering.SEQUENCES:
+            raise pymException.pymOutOfBound
+        if 'repeats' in settings_dict and int(settings_dict['repeats']) < 1:
+            raise pymException.pymOutOfBound
+        if settings_dict.get('seed') is not None:
+            int(settings_dict['seed'])
+        if settings_dict.get('points') is not None:
+            [float(x) for x in settings_dict['points']]
+        if settings_dict.get('spacing', self.spacing) not in SPACINGS:
+            raise pymException.pymOutOfBound
+        if 'range' in settings_dict and len(settings_dict['range']) != 2:
+            raise pymException.pymOutOfBound
+        if settings_dict.get('steps') is not None and int(settings_dict['steps']) < 1:
+            raise pymException.pymOutOfBound
+
+    def _apply_settings(self, settings_dict):
         res = False
+        # the values are computed again on next use
+        self._grid = None
         if 'parameter' in settings_dict:
-            if settings_dict['parameter'] == type(self.parameter):
+            if settings_dict['parameter'] == type(self.parameter).__name__:
                 logging.debug("Same class for Parameter was supplied as already set, don't change anything")
             else:
-                # explicitly delete parameter
-                del self.parameter
-                # create new instance of parameter out of factory
-                self.parameter = pynParameterFactory.createParameter(settings_dict['parameter'])
+                # get the new parameter from the pool, the old one is released by updatejob()
+                self.parameter = pynParameterFactory.createParameter(settings_dict['parameter'], owner=self)
                 self.set_range(self.range_min,self.range_max,False) # recheck sanity of range and stepsize
-                self.set_stepsize(self.stepsize, False) # internal values are always natural unit!
+                if self.num_steps is None:
+                    self.set_stepsize(self.stepsize, False) # internal values are always natural unit!
                 res = True
 
         if 'job' in settings_dict:
             if settings_dict['job'] == type(self.job):
                 logging.debug("Same class for Job was supplied as already set, don't change anything")
             else:
-                # explicitly deleter job
-                del self.job
                 # create new instance of job out of factory
                 self.job = pymJobFactory.createJob(settings_dict['job'])
                 res = True
@@ -102,18 +185,56 @@ class pymIterator(pymJob):
             # change the alternative unit setting first!
             if isinstance(self.parameter, pymParameter):
                 if self.parameter.hasAltUnit:
-                    use_altunit = settings_dict['useAltUnit']
+                    self.use_altunit = settings_dict['useAltUnit']
                     res = True
 
+        if 'pipelineDepth' in settings_dict:
+            self.pipeline_depth = int(settings_dict['pipelineDepth'])
+            res = True
+
+        if 'ordering' in settings_dict:
+            self.ordering = settings_dict['ordering']
+            res = True
+
+        if 'repeats' in settings_dict:
+            self.repeats = int(settings_dict['repeats'])
+            res = True
+
+        if 'seed' in settings_dict:
+            self.seed = None if settings_dict['seed'] is None else int(settings_dict['seed'])
+            res = True
+
+        if 'points' in settings_dict:
+            # values are in natural units, like range_min and range_max
+            if settings_dict['points'] is None:
+                self.points = None
+            else:
+                self.points = [float(x) for x in settings_dict['points']]
+            res = True
+
+        # a log spacing needs a range on one side of zero, the range may have been clamped by the parameter
+        spacing = settings_dict.get('spacing', self.spacing)
         if 'range' in settings_dict:
             if self.set_range(settings_dict['range'][0], settings_dict['range'][1], self.use_altunit):
                 res = True
+        if spacing == 'log' and not log_range(self.range_min, self.range_max):
+            raise pymException.pymOutOfBound
+        if 'spacing' in settings_dict:
+            self.spacing = spacing
+            res = True
 
         if 'steps' in settings_dict:
-            if self.set_steps(settings_dict['steps']):
+            if settings_dict['steps'] is None:
+                # back to as many values as the stepsize gives
+                self.num_steps = None
+                res = True
+            elif self.set_steps(settings_dict['steps']):
                 res = True
 
         if 'stepsize' in settings_dict:
+            if 'steps' not in settings_dict:
+                # a stepsize on its own decides the number of values
+                self.num_steps = None
             if self.set_stepsize(settings_dict['stepsize'], self.use_altunit):
                 res = True
 
@@ -134,6 +255,12 @@ class pymIterator(pymJob):
             'stepsize': {'current': self.get_stepsize(), 'type': 'double', 'hint': 'Stepsize', 'ro': False},
             'hasAltUnit':  {'current': self.get_altunitavailable(), 'type': 'string', 'hint': 'Is there an alternative unit available?', 'ro': True},
             'useAltUnit':  {'current': self.use_altunit, 'type': 'bool', 'hint': 'Give range or stepsize in alternative unit?', 'ro': False},
+            'pipelineDepth': {'current': self.pipeline_depth, 'type': 'int', 'hint': 'Points acquired ahead of data collection', 'ro': False},
+            'spacing': {'current': self.spacing, 'type': 'string', 'hint': 'Spacing of the values: ' + ", ".join(SPACINGS), 'ro': False},
+            'points': {'current': self.points, 'type': 'list', 'hint': 'Values to visit instead of the range (natural unit)', 'ro': False},
+            'ordering': {'current': self.ordering, 'type': 'string', 'hint': 'Order of the values in each repetition: ' + ", ".join(pymOrdering.SEQUENCES), 'ro': False},
+            'repeats': {'current': self.repeats, 'type': 'int', 'hint': 'Repetitions of the scan', 'ro': False},
+            'seed': {'current': self.seed, 'type': 'int', 'hint': 'Seed of the random ordering', 'ro': False},
             'jobSettings': {'current': self.get_subjobsettings(), 'type' : 'settings_dict', 'hint': 'Settings of the attached subjob', 'ro': False},
             'parameterSettings': {'current': self.get_parametersettings(), 'type' : 'settings_dict', 'hint': 'Settings of the attached parameter', 'ro': False}
         }
@@ -163,6 +290,7 @@ class pymIterator(pymJob):
         :param altUnit:
         :return:
         """
+        self._grid = None
         if isinstance(self.parameter, pymParameter):
             if altUnit and self.parameter.hasAltUnit:
                 self.range_min = self.parameter.sanityCheckValue(self.parameter.convertFromAlt(range_min, self.channel), self.channel)
@@ -173,10 +301,14 @@ class pymIterator(pymJob):
         else:
             self.range_min = range_min
             self.range_max = range_max
+        if self.num_steps is not None:
+            # keep the number of steps, 'step' spacing needs the stepsize for it
+            self.set_steps(self.num_steps)
+        return True
 
     def get_range(self):
         if self.use_altunit and isinstance(self.parameter, pymParameter):
-            return (self.parameter.convertToAlt(self.range_min),self.parameter.convertToAlt(self.range_max))
+            return (self.parameter.convertToAlt(self.range_min, self.channel),self.parameter.convertToAlt(self.range_max, self.channel))
         else:
             return (self.range_min, self.range_max)
 
@@ -187,10 +319,87 @@ class pymIterator(pymJob):
         :return:
         """
 
-        self.stepsize = self.parameter.getClosestParameterStep((self.range_max-self.range_min)/steps, self.channel)
+        if int(steps) < 1:
+            raise pymException.pymOutOfBound
+        self._grid = None
+        self.num_steps = int(steps)
+        if isinstance(self.parameter, pymParameter):
+            self.stepsize = self.parameter.getClosestParameterStep((self.range_max-self.range_min)/self.num_steps, self.channel)
+        else:
+            self.stepsize = (self.range_max-self.range_min)/self.num_steps
+        return True
 
     def get_steps(self):
-        return len(range(self.range_min, self.range_max, self.stepsize))
+        return len(self.get_grid()[0])
+
+    def get_values(self):
+        """
+        Values of one repetition, in natural unit
+        """
+        return self.get_grid()[0].tolist()
+
+    def get_grid(self):
+        """
+        Values of one repetition, computed once until the settings change. They are clamped to the sane range,
+        rounded to values the parameter can reach and converted to the alternative unit in one call each.
+        :return: values in natural unit, values in alternative unit or None (numpy arrays)
+        """
+        if self._grid is None:
+            values = self._raw_values()
+            alt_values = None
+            if isinstance(self.parameter, pymParameter):
+                values = self.parameter.sanityCheckValue(values, self.channel)
+                values = np.asarray(self.parameter.getClosestParameterValue(values, self.channel), dtype=float)
+                if self.parameter.hasAltUnit:
+                    alt_values = np.asarray(self.parameter.convertToAlt(values, self.channel), dtype=float)
+            self._grid = (values, alt_values)
+        return self._grid
+
+    def _raw_values(self):
+        if self.points is not None:
+            return np.asarray(self.points, dtype=float)
+        if self.spacing == 'step':
+            if self.stepsize <= 0:
+                return np.zeros(0)
+            # range_max excluded, like range(), without the float error of np.arange
+            if self.num_steps is not None:
+                # the stepsize is rounded to a step of the parameter, the number of steps is kept anyway
+                steps = self.num_steps
+            else:
+                # range_max excluded, like range(), without the float error of np.arange
+                steps = max(int(np.ceil((self.range_max - self.range_min) / self.stepsize - 1e-9)), 0)
+            return self.range_min + self.stepsize * np.arange(steps)
+        steps = self.num_steps
+        if steps is None:
+            steps = int(round((self.range_max - self.range_min) / self.stepsize)) + 1 if self.stepsize > 0 else 1
+        if self.spacing == 'log':
+            if not log_range(self.range_min, self.range_max):
+                # eg. the range got clamped to the sane range of a new parameter, run() refuses to start
+                return np.zeros(0)
+            return np.geomspace(self.range_min, self.range_max, steps)
+        return np.linspace(self.range_min, self.range_max, steps)
+
+    def get_orders(self, values):
+        """
+        Order of the values in each repetition, see pymOrdering.SEQUENCES
+        :return: list of index arrays, estimated move time of all repetitions
+        """
+        sequence = pymOrdering.SEQUENCES[self.ordering]
+        if isinstance(self.parameter, pymParameter):
+            position = self.parameter.get_position(self.channel)
+            move_time = lambda start, end: self.parameter.move_time(start, end, self.channel)
+        else:
+            position = None
+            move_time = lambda start, end: abs(end - start)
+        orders = []
+        total = 0.0
+        for repeat in range(self.repeats):
+            order = sequence(values, repeat, position, move_time, self.seed)
+            total += pymOrdering.travel_time(values, order, position, move_time)
+            if len(order):
+                position = values[order[-1]]
+            orders.append(order)
+        return orders, total
 
 
     def set_stepsize(self, stepsize, altUnit=False):
@@ -199,36 +408,40 @@ class pymIterator(pymJob):
         :param stepsize:
         :return:
         """
+        self._grid = None
         if isinstance(self.parameter, pymParameter):
             if altUnit:
-                self.stepsize = self.parameter.getClosestParameterStep(self.parameter.convertFromAlt(stepsize), self.channel)
+                self.stepsize = self.parameter.getClosestParameterStep(self.parameter.convertFromAlt(stepsize, self.channel), self.channel)
             else:
                 self.stepsize = self.parameter.getClosestParameterStep(stepsize, self.channel)
         else:
             self.stepsize = stepsize
+        return True
 
     def get_stepsize(self):
         if self.use_altunit and self.get_altunitavailable():
-            return self.parameter.convertToAlt(self.stepsize)
+            return self.parameter.convertToAlt(self.stepsize, self.channel)
+        return self.stepsize
 
 
 
     def set_channel(self, channel):
+        self._grid = None
         self.channel = channel
 
 
     def get_channel(self):
         return self.channel
 
-    async def process_late_collection(self, result, late_param):
-        if callable(result):
-            # last iteration returned a callable to do a lazy collection of the data
-            # collect data now and append its journal_id to our list
-            result = await result()
+    def process_late_collection(self, result, late_param):
+        """
+        Callback of the acquisition pipeline, receives the collected results in parameter order
+        """
         if result:
-            # result is not None, so no error and not the first iteration.
+            # result is not None, so no error
             pymJournal.assign_parameter_to_job(result, late_param, self.journal_id)
-        return result
+            pymEvents.publish("point", {"journal_id": self.journal_id, "value": late_param, "assoc_job": result})
+        self.assoc_list.append(result)
 
 
 
@@ -237,40 +450,52 @@ class pymIterator(pymJob):
         Run the iterator as a asyncio coroutine
         :return:
         """
+        if self.points is None and self.spacing == 'log' and not log_range(self.range_min, self.range_max):
+            raise pymException.pymOutOfBound
         self.running = True
-        # calculate what our parameter range will actually be
-        parameter_list = range(self.range_min, self.range_max, self.stepsize)
+        # calculate what our parameter values will actually be and the order we visit them in. The parameter's own
+        # settings may have changed meanwhile
+        self._grid = None
+        values, alt_values = self.get_grid()
+        parameter_list = values.tolist()
+        orders, move_time = self.get_orders(parameter_list)
+        meta = {'parameter_list': parameter_list,
+                'alt_parameter_list': None if alt_values is None else alt_values.tolist(),
+                'range': (self.range_min, self.range_max),
+                'stepsize': self.stepsize,
+                'spacing': self.spacing,
+                'steps': len(parameter_list),
+                'ordering': self.ordering,
+                'repeats': self.repeats,
+                'seed': self.seed,
+                'order': [order.tolist() for order in orders],
+                'move_time': move_time}
         # obtain a journal_id
-        self.journal_id = pymJournal.add_job(parent_id, self.description()[0], json.dumps(
-            {'parameter_list':parameter_list,
-             'range':(self.range_min,self.range_max),
-             'stepsize':self.stepsize,
-             'steps':len(parameter_list)}))
-        result = None
-        res = []
-        last_x = None
-        for x in parameter_list:
-            # start movement of the parameter
-            await self.parameter.go(x,self.channel,wait=False)
-            #do late collection of data
-            res.append(self.process_late_collection(result, last_x))
-            # wait until parameter is where we want it to be
-            await self.parameter.go(x, self.channel, wait=True)
-            # now do the job for this iteration
-            result = await self.job.run(self.journal_id)
-            last_x = x
-
-        # last late collection
-        res.append(self.process_late_collection(result, last_x))
-        # our job is done
-        self.running = False
+        self.journal_id = pymJournal.add_job(parent_id, self.description()[0], json.dumps(meta))
+        self.assoc_list = []
+        # up to pipeline_depth points are collected while we already move on
+        pipeline = pymPipeline(self.pipeline_depth, self.process_late_collection)
+        try:
+            for order in orders:
+                for k in order:
+                    # every point is journaled with the value the parameter was at, whatever the order
+                    x = parameter_list[k]
+                    # start movement of the parameter
+                    await self.parameter.go(x,self.channel,wait=False)
+                    # wait until parameter is where we want it to be
+                    await self.parameter.go(x, self.channel, wait=True)
+                    # now do the job for this iteration, its data is collected by the pipeline
+                    result = await self.job.run(self.journal_id)
+                    await pipeline.submit(result, x)
+            # wait for the last collections
+            await pipeline.drain()
+        finally:
+            pipeline.cancel()
+            # our job is done
+            self.running = False
         # update our job entry in the database TODO refactor this to be unified
-        pymJournal.update_job(self.journal_id, self.description()[0], json.dump(
-            {'parameter_list':parameter_list,
-             'assoc_list':res,
-             'range':(self.range_min,self.range_max),
-             'stepsize':self.stepsize,
-             'steps':len(parameter_list)}))
+        meta['assoc_list'] = self.assoc_list
+        pymJournal.update_job(self.journal_id, title=self.description()[0], json_meta=json.dumps(meta))
         return self.journal_id
 
 
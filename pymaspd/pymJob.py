@@ -1,5 +1,7 @@
 import logging
+import itertools
 import pymException
+import pymRegistry
 
 class pymJob(object):
     """
@@ -16,7 +18,6 @@ class pymJob(object):
 
     @classmethod
     def create_job(cls, jobid):
-        logging.debug("Factory is going to create class %s" % cls.__name__)
         return cls(jobid)
 
     def __init__(self, jobid):
@@ -62,12 +63,28 @@ class pymJob(object):
 
 
 class pymJobFactory:
+    # source of unique job ids for this session
+    _jobids = itertools.count()
+
+    @staticmethod
+    def newJobId():
+        return next(pymJobFactory._jobids)
+
     @staticmethod
-    def createJob(classid, jobid):
-        logging.debug("Checking for class %s" % classid)
-        for jobs in pymJob.__subclasses__(): # potentially harmful if one can manipulate subclasses to load malicious jobs.
-            if classid == jobs.__name__:
-                logging.debug("Success for class %s" % jobs.__name__)
-                return jobs.create_job(jobid)
-        raise pymException.pymJobNotExist
+    def jobclass(classid):
+        """
+        Find a job class by name, see pymRegistry
+        :return: the class
+        """
+        try:
+            return pymRegistry.get('job', classid)
+        except pymException.pymPluginError as err:
+            logging.debug(err)
+            raise pymException.pymJobNotExist
 
+    @staticmethod
+    def createJob(classid, jobid=None):
+        logging.debug("Checking for class %s", classid)
+        if jobid is None:
+            jobid = pymJobFactory.newJobId()
+        return pymJobFactory.jobclass(classid).create_job(jobid)
@@ -1,28 +1,90 @@
 import sqlite3
 from datetime import datetime, timezone
-import asyncio
 import numpy as np
 import io
+import itertools
+import math
+import struct
+import json
+import os
+import threading
+
+from .writer import pymJournalWriter
+from .storage import pymBlobStorage, load_chunk
 
 
 _conn = None
 _cur = None
+_writer = None
+_storage = pymBlobStorage()
+_db_dir = ""
+_db_path = None
+# queries from other threads (eg. an executor of the rpc server) use their own connection
+_owner = None
+_local = threading.local()
+_readers = []
+_readers_lock = threading.Lock()
+# next free primary key per table. Ids are handed out here, so we can return them before the writer committed the row
+_ids = {}
+
+
+# Raw array codec: a fixed header followed by the plain array buffer.
+#   magic (4s), version (B), ndim (B), padding (2x), dtype string incl. byte order (8s), shape (ndim * Q)
+# The header length is a multiple of 8, so the buffer stays aligned for np.frombuffer.
+_ARRAY_MAGIC = b'PYMA'
+_ARRAY_VERSION = 1
+_ARRAY_HEADER = struct.Struct('<4sBB2x8s')
+_NPY_MAGIC = b'\x93NUMPY'
 
 
 def adapt_array(arr):
     """
-    Adapt numpy for sqlite3. Taken from
-    http://stackoverflow.com/a/31312102/190597 (SoulNibbler)
+    Adapt numpy for sqlite3. Writes our raw codec, falls back to the .npy format for arrays it can't describe
+    (object arrays, structured dtypes).
     :param arr:
     :return:
     """
+    dtype = arr.dtype.str.encode('ascii')
+    if arr.dtype.hasobject or arr.dtype.names is not None or len(dtype) > 8 or arr.ndim > 255:
+        return _adapt_array_npy(arr)
+    if not arr.flags.c_contiguous:
+        arr = np.ascontiguousarray(arr)
+    header = _ARRAY_HEADER.pack(_ARRAY_MAGIC, _ARRAY_VERSION, arr.ndim, dtype) + \
+             struct.pack('<%dQ' % arr.ndim, *arr.shape)
+    # the only copy: header and buffer have to end up in one blob
+    blob = bytearray(len(header) + arr.nbytes)
+    blob[:len(header)] = header
+    blob[len(header):] = memoryview(arr.reshape(-1).view(np.uint8))
+    return blob
+
+
+def convert_array(blob):
+    """
+    Convert a blob back to numpy. The returned array is a read-only view on the blob, use .copy() if you need to
+    modify it. Blobs in the .npy format of older journals are still understood.
+    :param blob:
+    :return:
+    """
+    if blob[:4] == _ARRAY_MAGIC:
+        _, version, ndim, dtype = _ARRAY_HEADER.unpack_from(blob)
+        shape = struct.unpack_from('<%dQ' % ndim, blob, _ARRAY_HEADER.size)
+        return np.frombuffer(blob, dtype=np.dtype(dtype.rstrip(b'\0').decode('ascii')), count=math.prod(shape),
+                             offset=_ARRAY_HEADER.size + 8 * ndim).reshape(shape)
+    return _convert_array_npy(blob)
+
+
+def _adapt_array_npy(arr):
+    """
+    Adapt numpy for sqlite3 using the .npy format. Taken from
+    http://stackoverflow.com/a/31312102/190597 (SoulNibbler)
+    """
     out = io.BytesIO()
     np.save(out, arr)
     out.seek(0)
     return sqlite3.Binary(out.read())
 
 
-def convert_array(text):
+def _convert_array_npy(text):
     out = io.BytesIO(text)
     out.seek(0)
     return np.load(out)
@@ -32,27 +94,189 @@ sqlite3.register_adapter(np.ndarray, adapt_array)
 sqlite3.register_converter("array", convert_array)
 
 
-def open(db_path):
-    _conn = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES)
+def open(db_path, use_writer=False, flush_interval=0.05, batch_size=512, storage=None):
+    """
+    Open a journal database.
+    :param db_path: path of the sqlite database
+    :param use_writer: apply all writes from a background thread in group committed transactions (WAL mode)
+    :param flush_interval: writer mode: maximum time in seconds a write waits before it is committed
+    :param batch_size: writer mode: maximum number of writes in one transaction
+    :param storage: storage backend for arrays, e.g. pymChunkStorage. Default: inline blobs in the database
+    :return:
+    """
+    global _conn, _cur, _writer, _db_dir, _db_path, _owner
+    close()
+    _db_path = db_path
+    _owner = threading.get_ident()
+    _db_dir = os.path.dirname(os.path.abspath(db_path))
+    set_storage(storage if storage is not None else pymBlobStorage())
+    _conn = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
     _conn.row_factory= sqlite3.Row
     _cur = _conn.cursor()
+    _ids.clear()
+    if use_writer:
+        _cur.execute('''PRAGMA journal_mode=WAL''')
+        _writer = pymJournalWriter(db_path, flush_interval, batch_size)
+        _writer.start()
+
+
+def set_storage(storage):
+    """
+    Change the storage backend used by add_data. Data stored before stays readable.
+    """
+    global _storage
+    _storage.close()
+    _storage = storage
+
+
+def begin_experiment(key):
+    """
+    Tell the storage backend that a new experiment starts, e.g. to start new chunk files
+    """
+    _storage.begin_experiment(key)
+
+
+def close():
+    global _conn, _cur, _writer
+    _storage.close()
+    with _readers_lock:
+        for conn in _readers:
+            conn.close()
+        _readers.clear()
+    if _writer is not None:
+        _writer.stop()
+        _writer = None
+    if _conn is not None:
+        _conn.commit()
+        _conn.close()
+        _conn = None
+        _cur = None
+
+
+def flush(timeout=None):
+    """
+    Barrier to end an experiment consistently: returns once every write issued before is committed to disk.
+    Blocks, so call it from an executor if you are on the event loop.
+    :param timeout: seconds to wait at most (writer mode only)
+    :return: True if everything has been committed
+    """
+    _storage.flush()
+    if _writer is not None:
+        return _writer.flush(timeout)
+    _conn.commit()
+    return True
+
+
+def uses_writer():
+    """
+    :return: True if writes go through the writer thread. flush() then only waits for it and may be called from an
+    executor, otherwise it has to be called on the thread which opened the journal.
+    """
+    return _writer is not None
+
+
+def sync(timeout=None):
+    """
+    Wait until the writer thread committed every write issued before, so other connections see them. Unlike flush()
+    this may be called from any thread. Without writer there is nothing to wait for.
+    :return: True if everything has been committed
+    """
+    if _writer is not None:
+        return _writer.flush(timeout)
+    return True
+
+
+def _execute(sql, params=()):
+    # route a write either to the writer thread or directly to our connection
+    if _writer is not None:
+        _writer.submit(sql, params)
+    else:
+        _cur.execute(sql, params)
+
+
+def _read_cursor(synced=False):
+    """
+    Cursor for queries. Threads other than the one which opened the journal get a connection of their own, which
+    sees everything committed (in writer mode that is at most flush_interval behind).
+    :param synced: in writer mode, wait until the writes queued so far are committed, so the query sees them. The
+    writer commits right away for this, so it's a short wait even on the event loop.
+    """
+    if synced:
+        sync()
+    if threading.get_ident() == _owner:
+        return _cur
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.path != _db_path:
+        conn = sqlite3.connect(_db_path, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+                               check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        _local.conn = conn
+        _local.path = _db_path
+        with _readers_lock:
+            _readers.append(conn)
+    return conn.cursor()
+
+
+def _next_id(table):
+    if table not in _ids:
+        _cur.execute('''SELECT MAX(id) FROM %s''' % table)
+        _ids[table] = itertools.count((_cur.fetchone()[0] or 0) + 1)
+    return next(_ids[table])
 
 
 def create_new_db():
-    _cur.execute('''CREATE TABLE experiments
+    _cur.execute('''CREATE TABLE IF NOT EXISTS experiments
                     (id INTEGER PRIMARY KEY, date timestamp, title TEXT, assoc_job INT)''')
-    _cur.execute('''CREATE TABLE jobs
+    _cur.execute('''CREATE TABLE IF NOT EXISTS jobs
                     (id INTEGER PRIMARY KEY, parent_id INT, date timestamp, title TEXT, note TEXT, assoc_data INT)''')
 #    _cur.execute('''CREATE TABLE jobs_to_data #deprecated
 #                    (parent_id INT, associated_id INT, isjob BOOLEAN)''')
-    _cur.execute('''CREATE TABLE parameter_and_job
+    _cur.execute('''CREATE TABLE IF NOT EXISTS parameter_and_job
                     (parent_id INT, param_value REAL, assoc_job INT)''')
-    _cur.execute('''CREATE TABLE data
+    _cur.execute('''CREATE TABLE IF NOT EXISTS data
                     (id INTEGER PRIMARY KEY, job_id INT, data BLOB)''')
-    _cur.execute('''CREATE TABLE labbook
+    _cur.execute('''CREATE TABLE IF NOT EXISTS labbook
                     (date timestamp, note TEXT)''')
 #    _cur.execute('''CREATE TABLE saved_experiments
 #                    (title TEXT, pickle BLOB)''')
+    _migrate()
+    _conn.commit()
+
+
+_SCHEMA_VERSION = 4
+
+
+def _migrate():
+    """
+    Bring the schema of an existing database up to date. The schema version is kept in sqlite's user_version.
+    """
+    version = _cur.execute('''PRAGMA user_version''').fetchone()[0]
+    if version < 1:
+        # location of arrays kept in sidecar files
+        columns = [row['name'] for row in _cur.execute('''PRAGMA table_info(data)''')]
+        for column, coltype in (('file_path', 'TEXT'), ('file_offset', 'INT'), ('dtype', 'TEXT'), ('shape', 'TEXT')):
+            if column not in columns:
+                _cur.execute('''ALTER TABLE data ADD COLUMN %s %s''' % (column, coltype))
+    if version < 2:
+        # indexes for tree walks, data lookups and date filters
+        _cur.execute('''CREATE INDEX IF NOT EXISTS jobs_parent_id ON jobs(parent_id)''')
+        _cur.execute('''CREATE INDEX IF NOT EXISTS jobs_date ON jobs(date)''')
+        _cur.execute('''CREATE INDEX IF NOT EXISTS parameter_and_job_parent_id
+                        ON parameter_and_job(parent_id, param_value)''')
+        _cur.execute('''CREATE INDEX IF NOT EXISTS parameter_and_job_assoc_job ON parameter_and_job(assoc_job)''')
+        _cur.execute('''CREATE INDEX IF NOT EXISTS data_job_id ON data(job_id)''')
+        _cur.execute('''CREATE INDEX IF NOT EXISTS experiments_date ON experiments(date)''')
+    if version < 3:
+        # points of multidimensional scans, their parameter tuples are stored once in the meta data of the scanning
+        # job (as its array in older journals)
+        _cur.execute('''CREATE TABLE IF NOT EXISTS grid_points
+                        (parent_id INT, point INT, assoc_job INT)''')
+        _cur.execute('''CREATE INDEX IF NOT EXISTS grid_points_parent_id ON grid_points(parent_id, point)''')
+    if version < 4:
+        # experiment templates by name, see pymTemplate
+        _cur.execute('''CREATE TABLE IF NOT EXISTS templates
+                        (name TEXT PRIMARY KEY, date TIMESTAMP, version INT, body TEXT)''')
+    _cur.execute('''PRAGMA user_version = %d''' % _SCHEMA_VERSION)
 
 """
 UPDATE DATABASE
@@ -60,29 +284,31 @@ UPDATE DATABASE
 
 
 def add_job(parent=None, title=None, json_meta=None, data_id=None):
-    _cur.execute('''INSERT INTO jobs(parent_id, date, title, note, assoc_data) VALUES (?, ?, ?, ? , ?)''',
-                 (parent, datetime.utcnow(),title, json_meta, data_id))
+    job_id = _next_id('jobs')
+    _execute('''INSERT INTO jobs(id, parent_id, date, title, note, assoc_data) VALUES (?, ?, ?, ?, ? , ?)''',
+             (job_id, parent, datetime.utcnow(),title, json_meta, data_id))
 
-    return _cur.lastrowid
+    return job_id
 
 
 def update_job(job_id, parent_id=None, title=None, json_meta=None, assoc_data=None):
-    cmd_str = '''Update jobs SET '''
+    cols = []
     val=()
     if parent_id:
-        cmd_str = cmd_str + '''parent_id=?, '''
+        cols.append('''parent_id=?''')
         val = val + (parent_id,)
     if title:
-        cmd_str = cmd_str + '''title=?, '''
+        cols.append('''title=?''')
         val = val + (title,)
     if json_meta:
-        cmd_str = cmd_str + '''note=?, '''
+        cols.append('''note=?''')
         val = val + (json_meta,)
     if assoc_data:
-        cmd_str = cmd_str + '''assoc_data=?, '''
+        cols.append('''assoc_data=?''')
         val = val + (assoc_data,)
-    cmd_str = cmd_str + '''WHERE id=?'''
-    _cur.execute(cmd_str, val)
+    if not cols:
+        return
+    _execute('''UPDATE jobs SET ''' + ', '.join(cols) + ''' WHERE id=?''', val + (job_id,))
     #_cur.execute('''UPDATE jobs SET date=?, title=?, note=? WHERE id=?''', (datetime.utcnow(),title,json_meta,job_id))
 
 
@@ -94,12 +320,38 @@ def assign_parameter_to_job(job_id, parameter_value, parent_id=None):
     :param parameter_value:
     :return:
     """
-    _cur.execute('''INSERT INTO parameter_and_job(parent_id, param_value, assoc_job) VALUES (?,?,?)''',(parent_id,parameter_value,job_id))
+    _execute('''INSERT INTO parameter_and_job(parent_id, param_value, assoc_job) VALUES (?,?,?)''',(parent_id,parameter_value,job_id))
+
+
+def assign_point_to_job(job_id, point, parent_id):
+    """
+    Assign a point of a multidimensional scan to a job. The parameter tuple of the point is entry number point of
+    'points' in the meta data of the scanning job (parent_id).
+    :param job_id:
+    :param point: index of the point
+    :param parent_id: journal id of the scanning job
+    :return:
+    """
+    _execute('''INSERT INTO grid_points(parent_id, point, assoc_job) VALUES (?,?,?)''', (parent_id, point, job_id))
 
 
 def add_data(data, job_id=None):
-    _cur.execute('''INSERT INTO data(job_id, data), VALUES (?,?)''',job_id, data)
-    return _cur.lastrowid
+    """
+    Store an array in the data table or with the storage backend. In writer mode inline arrays are serialized on
+    the writer thread, so don't modify it after handing it over.
+    :param data: numpy array
+    :param job_id: journal id of the job the data belongs to
+    :return: data id
+    """
+    data_id = _next_id('data')
+    location = _storage.store(data)
+    if location is None:
+        _execute('''INSERT INTO data(id, job_id, data) VALUES (?,?,?)''', (data_id, job_id, data))
+    else:
+        path, offset, dtype, shape = location
+        _execute('''INSERT INTO data(id, job_id, file_path, file_offset, dtype, shape) VALUES (?,?,?,?,?,?)''',
+                 (data_id, job_id, os.path.relpath(path, _db_dir), offset, dtype, json.dumps(shape)))
+    return data_id
 
 #DEPRECATED
 #def add_children(parent,children):
@@ -108,43 +360,326 @@ def add_data(data, job_id=None):
 
 
 def add_experiment(title, root_job):
-    _cur.execute('''INSERT INTO experiments(date, title, assoc_job) VALUES(?, ?, ?)''', (datetime.utcnow(),title,root_job))
+    experiment_id = _next_id('experiments')
+    _execute('''INSERT INTO experiments(id, date, title, assoc_job) VALUES(?, ?, ?, ?)''',
+             (experiment_id, datetime.utcnow(),title,root_job))
+    return experiment_id
+
+
+def save_template(name, version, body):
+    """
+    Store an experiment template, replacing one of the same name
+    :param name: name of the template
+    :param version: format version of the template
+    :param body: the template as JSON string
+    """
+    _execute('''INSERT OR REPLACE INTO templates(name, date, version, body) VALUES (?, ?, ?, ?)''',
+             (name, datetime.utcnow(), version, body))
+
+
+def delete_template(name):
+    _execute('''DELETE FROM templates WHERE name = ?''', (name,))
 
 """
 QUERY DATABASE
 """
 
 
-def list_experiments(time_range=None):
-    if time_range:
-        _cur.execute('''SELECT * FROM experiments WHERE date >= ? AND data <= ?''',
-                     datetime.fromtimestamp(time_range,timezone.utc))
-    else:
-        _cur.execute('''SELECT * FROM experiments''')
-    rows = _cur.fetchall()
-    return rows
+_COLUMNS = {
+    'experiments': ('id', 'date', 'title', 'assoc_job'),
+    'jobs': ('id', 'parent_id', 'date', 'title', 'note', 'assoc_data'),
+}
 
 
-def list_jobs(time_range=None):
-    if time_range:
-        _cur.execute('''SELECT * FROM jobs WHERE date >= ? AND data <= ?''',
-                     datetime.fromtimestamp(time_range,timezone.utc))
+def _list(table, time_range=None, after=None, limit=100, columns=None):
+    """
+    Keyset paginated listing of a table.
+    :param time_range: (start, end) as unix timestamps, either may be None
+    :param after: cursor returned by the previous call, None for the first page
+    :param limit: maximum number of rows
+    :param columns: list of columns to return, None for all. id is always included.
+    :return: (rows, cursor), cursor is None if there are no more rows
+    """
+    if columns is None:
+        columns = _COLUMNS[table]
     else:
-        _cur.execute('''SELECT * FROM jobs''')
-    return _cur.fetchall()
+        unknown = set(columns) - set(_COLUMNS[table])
+        if unknown:
+            raise ValueError("Unknown columns: %s" % ", ".join(sorted(unknown)))
+        columns = ('id',) + tuple(c for c in columns if c != 'id')
+    where = []
+    val = ()
+    if after is not None:
+        where.append('''id > ?''')
+        val = val + (after,)
+    if time_range:
+        start, end = time_range
+        # dates are stored as naive utc datetimes
+        if start is not None:
+            where.append('''date >= ?''')
+            val = val + (datetime.fromtimestamp(start, timezone.utc).replace(tzinfo=None),)
+        if end is not None:
+            where.append('''date <= ?''')
+            val = val + (datetime.fromtimestamp(end, timezone.utc).replace(tzinfo=None),)
+    cmd_str = '''SELECT ''' + ', '.join(columns) + ''' FROM ''' + table
+    if where:
+        cmd_str = cmd_str + ''' WHERE ''' + ' AND '.join(where)
+    cur = _read_cursor()
+    cur.execute(cmd_str + ''' ORDER BY id LIMIT ?''', val + (limit,))
+    rows = cur.fetchall()
+    cursor = rows[-1]['id'] if rows and len(rows) == limit else None
+    return rows, cursor
+
+
+def list_experiments(time_range=None, after=None, limit=100, columns=None):
+    """
+    List experiments page by page, see _list for the arguments
+    :return: (rows, cursor)
+    """
+    return _list('experiments', time_range, after, limit, columns)
+
+
+def list_jobs(time_range=None, after=None, limit=100, columns=None):
+    """
+    List jobs page by page, see _list for the arguments
+    :return: (rows, cursor)
+    """
+    return _list('jobs', time_range, after, limit, columns)
+
+
+def get_template(name):
+    """
+    :return: JSON string of the template or None
+    """
+    cur = _read_cursor()
+    cur.execute('''SELECT body FROM templates WHERE name = ?''', (name,))
+    row = cur.fetchone()
+    return row['body'] if row is not None else None
+
+
+def list_templates():
+    cur = _read_cursor()
+    cur.execute('''SELECT name, date, version FROM templates ORDER BY name''')
+    return cur.fetchall()
 
 
 def get_job_children(job_id):
-    _cur.execute('''SELECT * FROM jobs WHERE parent_id = ?''',(job_id,))
-    return _cur.fetchall()
+    cur = _read_cursor()
+    cur.execute('''SELECT * FROM jobs WHERE parent_id = ?''',(job_id,))
+    return cur.fetchall()
+
+
+def get_job_tree(root_id):
+    """
+    Obtain a job and all its descendants in one query.
+    :param root_id: journal id of the root job, eg. the assoc_job of an experiment
+    :return: rows of the jobs table with an additional depth column, parents before their children
+    """
+    cur = _read_cursor()
+    cur.execute('''WITH RECURSIVE tree(id, parent_id, date, title, note, assoc_data, depth) AS (
+                        SELECT id, parent_id, date, title, note, assoc_data, 0 FROM jobs WHERE id = ?
+                        UNION ALL
+                        SELECT jobs.id, jobs.parent_id, jobs.date, jobs.title, jobs.note, jobs.assoc_data, tree.depth + 1
+                        FROM jobs JOIN tree ON jobs.parent_id = tree.id)
+                    SELECT id, parent_id, date AS "date [timestamp]", title, note, assoc_data, depth FROM tree''',
+                 (root_id,))
+    return cur.fetchall()
 
 
 def get_job_details(job_id):
-    _cur.execute('''SELECT * FROM jobs WHERE id = ?''',(job_id,))
-    return _cur.fetchall()
+    cur = _read_cursor()
+    cur.execute('''SELECT * FROM jobs WHERE id = ?''',(job_id,))
+    return cur.fetchall()
 
 
 def get_data(data_id):
-    _cur.execute('''SELECT * FROM data WHERE id= ?''',(data_id,))
-    return _cur.fetchall()
+    """
+    Obtain an array from the journal. Arrays of the sidecar storage are returned as read-only np.memmap.
+    :param data_id:
+    :return: numpy array or None
+    """
+    # the data column is declared as BLOB, so ask for the converter explicitly
+    cur = _read_cursor(synced=True)
+    cur.execute('''SELECT id, job_id, data AS "data [array]", file_path, file_offset, dtype, shape FROM data
+                    WHERE id= ?''',(data_id,))
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return _load_data(row)
+
+
+def _load_data(row):
+    if row['file_path'] is None:
+        return row['data']
+    return load_chunk(os.path.join(_db_dir, row['file_path']), row['file_offset'], row['dtype'],
+                      json.loads(row['shape']))
+
+
+
+# columns needed by _load_data
+_DATA_COLUMNS = '''d.data AS "data [array]", d.file_path, d.file_offset, d.dtype, d.shape'''
+# data set of a child job c of a point job: the children are told apart by the order they were added in at each point,
+# counting those without data as well
+_CHILD_SET = '''(SELECT COUNT(*) FROM jobs s WHERE s.parent_id = c.parent_id AND s.id < c.id) AS "set"'''
+
 
+def get_1d_data(job_id, decimate=1):
+    """
+    Assemble the data of a scan over one parameter (eg. a pymIterator) in one query.
+    Points measured more than once are averaged, points without data are NaN.
+    If the job at each point has no data of its own (eg. a pymParallel), the data of its children is used, one data
+    set per child.
+    :param job_id: journal id of the scanning job
+    :param decimate: only use every n-th parameter value
+    :return: (axis, data) with data.shape == (len(axis),) + frame shape, data is a list of such arrays (one per child
+    of the point jobs) if the data is one level down
+    """
+    cur = _read_cursor(synced=True)
+    cur.execute('''SELECT p.param_value AS v0, ''' + _DATA_COLUMNS + '''
+                    FROM parameter_and_job p JOIN jobs j ON j.id = p.assoc_job JOIN data d ON d.id = j.assoc_data
+                    WHERE p.parent_id = ?''', (job_id,))
+    rows = cur.fetchall()
+    if rows:
+        axes, data = _assemble(rows, (decimate,))
+        return axes[0], data
+    cur.execute('''SELECT p.param_value AS v0, ''' + _CHILD_SET + ''', ''' + _DATA_COLUMNS + '''
+                    FROM parameter_and_job p JOIN jobs c ON c.parent_id = p.assoc_job JOIN data d ON d.id = c.assoc_data
+                    WHERE p.parent_id = ?''', (job_id,))
+    axes, data = _assemble_children(cur.fetchall(), (decimate,))
+    return axes[0], data
+
+
+def get_2d_data(job_id, decimate=(1, 1)):
+    """
+    Assemble the data of two nested scans (eg. a pymIterator running a pymIterator) in one query.
+    :param job_id: journal id of the outer scanning job
+    :param decimate: only use every n-th parameter value, per axis
+    :return: (outer axis, inner axis, data) with data.shape == (len(outer), len(inner)) + frame shape
+    """
+    cur = _read_cursor(synced=True)
+    cur.execute('''SELECT o.param_value AS v0, i.param_value AS v1, ''' + _DATA_COLUMNS + '''
+                    FROM parameter_and_job o JOIN parameter_and_job i ON i.parent_id = o.assoc_job
+                    JOIN jobs j ON j.id = i.assoc_job JOIN data d ON d.id = j.assoc_data
+                    WHERE o.parent_id = ?''', (job_id,))
+    axes, data = _assemble(cur.fetchall(), decimate)
+    return axes[0], axes[1], data
+
+
+def get_grid_data(job_id, decimate=None):
+    """
+    Assemble the data of a multidimensional scan (pymGrid) in one query.
+    Like get_1d_data, the data of the children of the point jobs is used if they have none of their own.
+    :param job_id: journal id of the scanning job
+    :param decimate: only use every n-th parameter value, per axis
+    :return: (axes, data) with data.shape == tuple(len(axis) for axis in axes) + frame shape, or a list of such arrays
+    """
+    cur = _read_cursor(synced=True)
+    cur.execute('''SELECT note FROM jobs WHERE id = ?''', (job_id,))
+    row = cur.fetchone()
+    meta = json.loads(row['note']) if row is not None and row['note'] else {}
+    if 'points' in meta:
+        points = np.asarray(meta['points'], dtype=float)
+    else:
+        # journals written before the parameter tuples were kept in the meta data of the grid
+        cur.execute('''SELECT d.id, ''' + _DATA_COLUMNS + ''' FROM jobs j JOIN data d ON d.id = j.assoc_data
+                        WHERE j.id = ?''', (job_id,))
+        row = cur.fetchone()
+        if row is None:
+            raise ValueError("Job %s has no parameter tuples" % job_id)
+        points = np.asarray(_load_data(row), dtype=float)
+    if decimate is None:
+        decimate = (1,) * points.shape[1]
+    cur.execute('''SELECT g.point, ''' + _DATA_COLUMNS + '''
+                    FROM grid_points g JOIN jobs j ON j.id = g.assoc_job JOIN data d ON d.id = j.assoc_data
+                    WHERE g.parent_id = ?''', (job_id,))
+    rows = _with_point_values(cur.fetchall(), points)
+    if rows:
+        return _assemble(rows, tuple(decimate))
+    cur.execute('''SELECT g.point, ''' + _CHILD_SET + ''', ''' + _DATA_COLUMNS + '''
+                    FROM grid_points g JOIN jobs c ON c.parent_id = g.assoc_job JOIN data d ON d.id = c.assoc_data
+                    WHERE g.parent_id = ?''', (job_id,))
+    return _assemble_children(_with_point_values(cur.fetchall(), points), tuple(decimate))
+
+
+def _with_point_values(rows, points):
+    # parameter values of the grid points as columns v0, v1, ...
+    entries = []
+    for row in rows:
+        entry = dict(row)
+        entry.update(('v%d' % k, value) for k, value in enumerate(points[row['point']]))
+        entries.append(entry)
+    return entries
+
+
+def get_full_data(job_id):
+    """
+    Obtain all data recorded by a job and its children, as raw as possible.
+    :param job_id:
+    :return: list of dicts with data_id, job_id, param_value (None if the job wasn't a scan point) and data
+    """
+    cur = _read_cursor(synced=True)
+    cur.execute('''WITH RECURSIVE tree(id) AS (
+                        SELECT ? UNION ALL SELECT jobs.id FROM jobs JOIN tree ON jobs.parent_id = tree.id)
+                    SELECT d.id AS data_id, d.job_id, p.param_value, ''' + _DATA_COLUMNS + '''
+                    FROM tree JOIN data d ON d.job_id = tree.id LEFT JOIN parameter_and_job p ON p.assoc_job = d.job_id
+                    ORDER BY d.id''', (job_id,))
+    return [{'data_id': row['data_id'], 'job_id': row['job_id'], 'param_value': row['param_value'],
+             'data': _load_data(row)} for row in cur.fetchall()]
+
+
+def _assemble(rows, decimate, sets=None):
+    """
+    Fill the frames of rows (with parameter values in columns v0, v1, ...) into one preallocated array
+    :param sets: number of data sets, the rows then have the index of their set in column set. A list of arrays on
+    the same axes is returned then.
+    """
+    if isinstance(decimate, int):
+        decimate = (decimate,)
+    naxes = len(decimate)
+    if not rows:
+        return [np.empty(0)] * naxes, (np.empty((0,) * naxes) if sets is None else [])
+    values = np.array([[row['v%d' % k] for k in range(naxes)] for row in rows], dtype=float)
+    axes = []
+    index = np.empty(values.shape, dtype=np.intp)
+    for k in range(naxes):
+        axis, index[:, k] = np.unique(values[:, k], return_inverse=True)
+        axes.append(axis[::decimate[k]])
+    steps = np.array(decimate)
+    keep = np.flatnonzero(np.all(index % steps == 0, axis=1))
+    index = index[keep] // steps
+    shape = tuple(len(axis) for axis in axes)
+    if sets is None:
+        return axes, _average(rows, list(zip(keep, map(tuple, index))), shape)
+    selected = [[] for _ in range(sets)]
+    for n, idx in zip(keep, map(tuple, index)):
+        selected[rows[n]['set']].append((n, idx))
+    return axes, [_average(rows, points, shape) for points in selected]
+
+
+def _average(rows, points, shape):
+    """
+    Average the frames of rows at the points of an array
+    :param points: list of (row number, index in the array) tuples
+    :return: array of shape + frame shape, NaN where there is no frame
+    """
+    if not points:
+        return np.full(shape, np.nan)
+    first = _load_data(rows[points[0][0]])
+    data = np.zeros(shape + first.shape, dtype=np.result_type(first.dtype, np.float64))
+    count = np.zeros(shape)
+    for n, idx in points:
+        data[idx] += _load_data(rows[n])
+        count[idx] += 1
+    with np.errstate(invalid='ignore', divide='ignore'):
+        data /= count.reshape(shape + (1,) * first.ndim)
+    return data
+
+
+def _assemble_children(rows, decimate):
+    """
+    Assemble the data of the children of the point jobs (eg. the detectors of a pymParallel), one data set per child
+    :param rows: rows with parameter values (v0, v1, ...) and the set column, see _CHILD_SET
+    """
+    if not rows:
+        return _assemble(rows, decimate)
+    return _assemble(rows, decimate, max(row['set'] for row in rows) + 1)
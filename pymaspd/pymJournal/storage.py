@@ -0,0 +1,115 @@
+import os
+import logging
+import numpy as np
+
+
+class pymBlobStorage:
+    """
+    Default storage backend of the journal: arrays are stored inline as blobs in the data table.
+    A backend's store() returns None to have an array stored inline, or the path of the file, the offset, dtype
+    and shape of where it put the array.
+    """
+
+    def begin_experiment(self, key):
+        pass
+
+    def store(self, data):
+        return None
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class pymChunkStorage(pymBlobStorage):
+    """
+    Sidecar storage for large detector frames. Arrays are appended to per-experiment chunk files, the journal only
+    records file, offset, dtype and shape. Reading such an entry gives a np.memmap, so a large scan can be sliced
+    without loading it.
+    """
+
+    def __init__(self, directory, chunk_size=1 << 30, inline_below=4096, alignment=64):
+        """
+        :param directory: directory of the chunk files
+        :param chunk_size: start a new chunk file once a file grew beyond this size (bytes)
+        :param inline_below: arrays smaller than this (bytes) are still stored inline in the database
+        :param alignment: alignment of arrays in the chunk files (bytes)
+        """
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.inline_below = inline_below
+        self.alignment = alignment
+        self.prefix = "journal"
+        self.chunk_no = 0
+        self._file = None
+        self._path = None
+        self._size = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def begin_experiment(self, key):
+        """
+        Start a new set of chunk files for the upcoming experiment
+        :param key: name to prefix the chunk files with
+        """
+        self.close()
+        self.prefix = key
+        self.chunk_no = 0
+
+    def store(self, data):
+        if not isinstance(data, np.ndarray) or data.nbytes < self.inline_below or data.dtype.hasobject \
+                or data.dtype.names is not None:
+            # small or not describable by a dtype string, keep it in the database
+            return None
+        if not data.flags.c_contiguous:
+            data = np.ascontiguousarray(data)
+        if self._file is None or self._size + data.nbytes > self.chunk_size:
+            self._next_chunk()
+        # pad to alignment, so the memmap of this array starts aligned
+        pad = -self._size % self.alignment
+        if pad:
+            self._write(b'\0' * pad)
+        offset = self._size
+        self._write(memoryview(data.reshape(-1).view(np.uint8)))
+        return self._path, offset, data.dtype.str, data.shape
+
+    def _next_chunk(self):
+        self.close()
+        while True:
+            self._path = os.path.join(self.directory, "%s_%04d.chunk" % (self.prefix, self.chunk_no))
+            self.chunk_no += 1
+            if not os.path.exists(self._path):
+                break
+        logging.debug("Opening new chunk file %s" % self._path)
+        # unbuffered, a memmap of the file has to see everything we wrote
+        self._file = open(self._path, 'wb', buffering=0)
+        self._size = 0
+
+    def _write(self, buf):
+        view = memoryview(buf)
+        while len(view):
+            n = self._file.write(view)
+            view = view[n:]
+            self._size += n
+
+    def flush(self):
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+
+def load_chunk(path, offset, dtype, shape):
+    """
+    Map an array stored by pymChunkStorage
+    """
+    dtype = np.dtype(dtype)
+    if dtype.itemsize * int(np.prod(shape)) == 0:
+        # can't map zero bytes
+        return np.empty(shape, dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=tuple(shape) or (1,)).reshape(shape)
@@ -0,0 +1,152 @@
+import sqlite3
+import threading
+import queue
+import logging
+import time
+
+
+class pymJournalWriter(threading.Thread):
+    """
+    Background writer for the journal. Statements are put on a queue by the event loop thread and applied by this
+    thread in group committed transactions, so a running scan never waits for sqlite. The writer uses its own
+    connection in WAL mode, which lets the main connection keep reading while we write.
+    """
+
+    def __init__(self, db_path, flush_interval=0.05, batch_size=512):
+        """
+        :param db_path: path of the sqlite database
+        :param flush_interval: maximum time in seconds a statement waits in the queue before it is committed
+        :param batch_size: maximum number of statements in one transaction
+        """
+        super().__init__(name="pymJournalWriter", daemon=True)
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        # last error of a statement, raised once by the next submit() or flush()
+        self.error = None
+        # error which ended the thread, raised by every later call
+        self.failed = None
+        # some statistics
+        self.statements = 0
+        self.transactions = 0
+
+    def submit(self, sql, params=()):
+        """
+        Queue a statement to be written. Raises the last error of the writer thread, if there was one.
+        """
+        self.check()
+        self.queue.put((sql, params))
+
+    def flush(self, timeout=None):
+        """
+        Barrier: block until everything submitted before this call is committed.
+        :param timeout: seconds to wait at most
+        :return: True if the barrier was reached
+        """
+        self.check()
+        barrier = threading.Event()
+        self.queue.put(barrier)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # don't wait for a thread which is gone
+        while not barrier.wait(0.1 if deadline is None else max(0, min(0.1, deadline - time.monotonic()))):
+            if not self.is_alive() or (deadline is not None and time.monotonic() >= deadline):
+                break
+        self.check()
+        return barrier.is_set()
+
+    def check(self):
+        if self.failed is not None:
+            raise self.failed
+        if self.error is not None:
+            err, self.error = self.error, None
+            raise err
+
+    def stop(self):
+        """
+        Commit outstanding statements and end the thread.
+        """
+        self.queue.put(None)
+        self.join()
+        self.check()
+
+    def run(self):
+        try:
+            self._run()
+        except Exception as err:
+            logging.exception("Journal writer failed")
+            self.failed = err
+        finally:
+            # release everybody waiting for a barrier, later calls raise the error
+            while True:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if isinstance(item, threading.Event):
+                    item.set()
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
+        conn.execute('''PRAGMA journal_mode=WAL''')
+        conn.execute('''PRAGMA synchronous=NORMAL''')
+        cur = conn.cursor()
+        stop = False
+        while not stop:
+            item = self.queue.get()
+            batch = []
+            barrier = None
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is None:
+                    stop = True
+                    break
+                if isinstance(item, threading.Event):
+                    # commit right away, someone is waiting for us
+                    barrier = item
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+            try:
+                if batch:
+                    self._commit(cur, batch)
+            except Exception as err:
+                logging.exception("Journal group commit failed")
+                self.error = err
+            finally:
+                if barrier is not None:
+                    barrier.set()
+        conn.close()
+        logging.debug("Journal writer stopped after %d statements in %d transactions" %
+                      (self.statements, self.transactions))
+
+    def _commit(self, cur, batch):
+        try:
+            cur.execute('''BEGIN''')
+            for sql, params in batch:
+                cur.execute(sql, params)
+            cur.execute('''COMMIT''')
+        except Exception as err:
+            # not only sqlite3.Error, eg. an adapter raises TypeError for a value it can't store
+            logging.warning("Journal group commit failed, retrying statements one by one: %s" % err)
+            if cur.connection.in_transaction:
+                cur.execute('''ROLLBACK''')
+            # isolate the faulty statement(s) so the rest of the batch is not lost
+            for sql, params in batch:
+                try:
+                    cur.execute(sql, params)
+                except Exception as err:
+                    logging.warning("Couldn't write to journal: %s" % err)
+                    self.error = err
+            self.transactions += len(batch)
+        else:
+            self.transactions += 1
+        self.statements += len(batch)
@@ -27,7 +27,7 @@ class pymList(pymJob):
 
     def appendjob(self, job):
         if isinstance(job, pymJob):
-            self.joblist.append(newjob)
+            self.joblist.append(job)
             return True
         else:
             logging.warning("Supplied Job not valid")
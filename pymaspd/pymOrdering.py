@@ -0,0 +1,132 @@
+"""
+Orderings of the points of a multidimensional scan. Each ordering takes the shape of the grid and returns an integer
+array of shape (points, dimensions) with the index tuples in the order they will be visited.
+
+Sequences are the orderings of the values of one parameter, for scans which are repeated. A sequence is called for
+every repetition with the values, the number of the repetition, the current position of the parameter (None if
+unknown), the move time model of the parameter (see pymParameter.move_time, it takes arrays) and a seed, and returns the indices of
+the values in the order they will be visited.
+"""
+import logging
+import numpy as np
+
+
+def raster(shape):
+    """
+    Line by line, every line starts at the beginning of the fast (last) axis
+    """
+    return np.indices(shape).reshape(len(shape), -1).T
+
+
+def serpentine(shape):
+    """
+    Boustrophedon: every other line (plane, ...) is run backwards, so we never travel back to the start of an axis
+    """
+    order = np.arange(shape[-1]).reshape(-1, 1)
+    for n in reversed(shape[:-1]):
+        sub = order
+        order = np.concatenate([np.column_stack((np.full(len(sub), i), sub if i % 2 == 0 else sub[::-1]))
+                                for i in range(n)])
+    return order
+
+
+def hilbert(shape):
+    """
+    Hilbert curve through a 2d grid. Neighbouring points on the curve are neighbours on the grid, which keeps the
+    moves of both axes short. Grids which are not 2d fall back to serpentine.
+    """
+    if len(shape) != 2:
+        logging.warning("Hilbert ordering only supports 2d grids, using serpentine")
+        return serpentine(shape)
+    order = raster(shape)
+    # the curve fills a square with a power of two as side length, our points are a subset of it
+    n = 1
+    while n < max(shape):
+        n *= 2
+    return order[np.argsort(_hilbert_distance(n, order[:, 0], order[:, 1]), kind='stable')]
+
+
+def _hilbert_distance(n, x, y):
+    # distance along the curve, vectorized version of xy2d from https://en.wikipedia.org/wiki/Hilbert_curve
+    x = x.copy()
+    y = y.copy()
+    d = np.zeros_like(x)
+    s = n // 2
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx) ^ ry)
+        # rotate the quadrant
+        flip = ~ry & rx
+        x[flip] = n - 1 - x[flip]
+        y[flip] = n - 1 - y[flip]
+        swap = ~ry
+        x[swap], y[swap] = y[swap], x[swap]
+        s //= 2
+    return d
+
+
+def loop(values, repeat, position, move_time, seed=None):
+    """
+    Every repetition from the first to the last value
+    """
+    return np.arange(len(values))
+
+
+def bounce(values, repeat, position, move_time, seed=None):
+    """
+    Every other repetition backwards, so the parameter doesn't travel back to the start
+    """
+    order = np.arange(len(values))
+    return order[::-1] if repeat % 2 else order
+
+
+def shuffle(values, repeat, position, move_time, seed=None):
+    """
+    Random order, different for every repetition. The same seed gives the same orders.
+    """
+    return np.random.default_rng(None if seed is None else (seed, repeat)).permutation(len(values))
+
+
+def nearest(values, repeat, position, move_time, seed=None):
+    """
+    Greedy nearest neighbour by move time, starting at the current position: for any list of values, eg. one given
+    point by point
+    """
+    values = np.asarray(values, dtype=float)
+    remaining = np.arange(len(values))
+    order = np.empty(len(values), dtype=int)
+    if position is None and len(values):
+        position = values[0]
+    for k in range(len(values)):
+        j = int(np.argmin(move_time(position, values[remaining])))
+        order[k] = remaining[j]
+        position = values[remaining[j]]
+        remaining = np.delete(remaining, j)
+    return order
+
+
+def travel_time(values, order, position, move_time):
+    """
+    Estimated time the parameter needs for the moves of one repetition
+    """
+    path = np.asarray(values, dtype=float)[order]
+    if len(path) == 0:
+        return 0.0
+    starts = np.concatenate(([path[0] if position is None else position], path[:-1]))
+    return float(np.sum(move_time(starts, path)))
+
+
+SEQUENCES = {
+    'loop': loop,
+    'bounce': bounce,
+    'random': shuffle,
+    'nearest': nearest,
+}
+
+
+ORDERINGS = {
+    'raster': raster,
+    'serpentine': serpentine,
+    'hilbert': hilbert,
+}
@@ -0,0 +1,90 @@
+import logging
+import asyncio
+import json
+import pymJournal
+import pymException
+from pymList import *
+from pymDetector import pymDetector
+
+
+class pymParallel(pymList):
+    """
+    pymParallel arms and triggers all attached detectors together, so acquiring from several detectors at the same
+    point takes as long as the slowest one instead of the sum of all
+    """
+    __doc__ = "Acquire from a list of detectors simultaneously"
+
+    def __init__(self, jobid):
+        super().__init__(jobid)
+        # seconds each detector may take for acquisition and for collection, None to wait forever
+        self.timeout = None
+
+    def description(self):
+        return "Simultaneously:", self.joblist
+
+    def appendjob(self, job):
+        if isinstance(job, pymDetector):
+            self.joblist.append(job)
+            return True
+        else:
+            logging.warning("Supplied Job is not a detector")
+            return False
+
+    def insertjobafter(self, newjob, refjob):
+        if not isinstance(newjob, pymDetector):
+            logging.warning("Supplied Job is not a detector")
+            return False
+        return super().insertjobafter(newjob, refjob)
+
+    def updatejob(self, settings_dict):
+        res = False
+        if 'timeout' in settings_dict:
+            timeout = settings_dict['timeout']
+            if timeout is not None and timeout <= 0:
+                raise pymException.pymOutOfBound
+            self.timeout = timeout
+            res = True
+        return res
+
+    def getsettings(self):
+        return {
+            'timeout': {'current': self.timeout, 'type': 'double', 'hint': 'Timeout per detector in seconds (none: wait forever)', 'ro': False},
+        }
+
+    async def _with_timeout(self, job, coro):
+        try:
+            return await asyncio.wait_for(coro, self.timeout)
+        except asyncio.TimeoutError:
+            logging.warning("Detector %s timed out" % type(job).__name__)
+            raise pymException.pymJobTimeout
+
+    async def _gather(self, coros):
+        # let every detector finish (or time out) before reporting an error, so none is left running
+        results = await asyncio.gather(*coros, return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results
+
+    async def _collect(self, job, result):
+        if callable(result):
+            return await self._with_timeout(job, result())
+        return result
+
+    async def run(self, parent_id):
+        # all detectors journal their data under our journal id
+        journal_id = pymJournal.add_job(parent_id, title=str(self.description()[0]))
+        jobs = list(self.joblist)
+        self.running = True
+        try:
+            results = await self._gather(self._with_timeout(job, job.run(journal_id)) for job in jobs)
+        finally:
+            self.running = False
+
+        async def late_collection():
+            # collect the data of all detectors together as well
+            collected = await self._gather(self._collect(job, result) for job, result in zip(jobs, results))
+            pymJournal.update_job(journal_id, json_meta=json.dumps({'assoc_list': collected}))
+            return journal_id
+
+        return late_collection
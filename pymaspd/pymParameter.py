@@ -1,5 +1,9 @@
 from pymJob import *
 import asyncio
+import functools
+import numpy as np
+import pymRegistry
+import pymDevices
 
 class pymParameter:
     """
@@ -8,6 +12,11 @@ class pymParameter:
     a parameter might have different channels (such as two axis)
     An important difference of a parameter to a job is, that a parameter can not act on its own. The method to do the
     main action of a parameter is set(value, channel, [wait]) instead of run()
+    The value methods (sanityCheckValue, getClosestParameterValue, getClosestParameterStep, convertToAlt and
+    convertFromAlt) take a number or a numpy array and return the same, scans call them once for all their points
+    Parameters are devices shared by all jobs using them (see pymDevices), jobs move them with go(). go() skips moves to
+    where the parameter is already, merges moves to the same target and approaches targets from the backlash direction
+    set() must not block the event loop, declare blocking driver calls with pymDriver.blocking
     """
     def description(self):
         raise NotImplementedError
@@ -16,23 +25,48 @@ class pymParameter:
     def create_param(cls):
         return cls()
 
+    @classmethod
+    def create_device(cls, config):
+        # parameters are created by the device pool
+        param = cls.create_param()
+        param.config = dict(config)
+        return param
+
     def __init__(self):
         # do we have more than one channel?
         self.num_channels = 1
 
+        # device settings, eg. a port, given to the pool when the parameter got created
+        self.config = {}
+
         # does the parameter start initialized or do we need to do stuff?
         self.initialized = True
+        # otherwise _initialize() gets called on first use, it returns True on success
 
         # does your parameter have a convenient unit you might want to be able to use? Eg ps instead of mm on a motorized stage?
         self.hasAltUnit = False
         self.altUnitString = ""
         self.natUnitString = ""
 
+        # targets are approached from below (backlash > 0) or above (< 0), moving backlash further first if necessary
+        self.backlash = 0
+        # channel -> last target go() reached, None if unknown
+        self.commanded = {}
+        # channel -> (target, task) of the move of go() in progress
+        self._moves = {}
+        self.move_stats = {'requested': 0, 'moves': 0, 'skipped': 0, 'merged': 0, 'backlash': 0}
+
+    def __getstate__(self):
+        # moves in progress and positions of the device aren't part of a pickled job tree
+        state = self.__dict__.copy()
+        state['commanded'] = {}
+        state['_moves'] = {}
+        return state
+
     def initialize(self):
-        if self.initialized:
-            return True
-        else:
-            return self._initialize()
+        if not self.initialized:
+            self.initialized = bool(self._initialize())
+        return self.initialized
 
     def _initialize(self):
         # private init function
@@ -40,34 +74,58 @@ class pymParameter:
 
     def sanityCheckValue(self, value, channel):
         """
-        check whether a supplied value is inside a sane range for Device/Hardware
+        clamp a supplied value into the sane range for Device/Hardware
         """
-        pass
+        return value
+
+    def getClosestParameterValue(self, value, channel):
+        """
+        return next value the parameter can actually reach, eg. a full step of a stepper motor
+        """
+        return value
 
     def getClosestParameterStep(self, step, channel):
         """
         return next reasonable stepsize for parameter. Also acts as a sanity check for steps
         """
-        pass
+        return step
 
 
     def convertToAlt(self, value, channel):
         """
         calculate alternative unit from raw
         """
-        pass
+        return value
 
     def convertFromAlt(self, value, channel):
         """
         calculate raw from alternative unit
         """
-        pass
+        return value
+
+    def get_position(self, channel):
+        """
+        current value of the channel, None if unknown
+        """
+        return None
+
+    def move_time(self, start, end, channel=0):
+        """
+        model of the time a move from start to end takes, scans order their points by it. start and end may be numpy
+        arrays. Without a model of the device the distance is used.
+        """
+        return np.abs(np.asarray(end, dtype=float) - start)
 
     def updatesettings(self, settings_dict):
-        pass
+        if 'backlash' in settings_dict:
+            self.backlash = float(settings_dict['backlash'])
+            return True
+        return False
 
     def getsettings(self):
-        pass
+        return {
+            'backlash': {'current': self.backlash, 'type': 'double', 'hint': 'Overtravel to approach targets from one direction, positive from below', 'ro': False},
+        }
 
     async def set(self, value, channel, wait=True):
         """
@@ -79,13 +137,123 @@ class pymParameter:
         """
         pass
 
+    async def set_multi(self, values, wait=True):
+        """
+        set several channels at once, {channel: value}. Drivers of devices with coordinated motion implement this,
+        otherwise the channels are set concurrently
+        :return:
+        """
+        await asyncio.gather(*(self.set(value, channel, wait) for channel, value in values.items()))
+
+    async def go(self, value, channel, wait=True):
+        """
+        set() for jobs, see go_multi()
+        :param wait: wait for the move to finish, otherwise it runs on in the background
+        :return: True
+        """
+        return await self.go_multi({channel: value}, wait)
+
+    async def go_multi(self, values, wait=True):
+        """
+        set_multi() for jobs: parameters are shared between jobs (see pymDevices), so moves hold the device's lock and
+        initialize the device on first use.
+        A move of a channel to where it is (within its resolution, see getClosestParameterValue) is skipped, a move to
+        the target of the move of the channel in progress joins it. Counted in move_stats.
+        :param values: {channel: value}, the channels which move are moved by one set_multi()
+        :param wait: wait for the move to finish, otherwise it runs on in the background
+        :return: True
+        """
+        targets = {}
+        joined = []
+        previous = []
+        for channel, value in values.items():
+            self.move_stats['requested'] += 1
+            target = self.getClosestParameterValue(value, channel)
+            move = self._moves.get(channel)
+            if move is not None and not move[1].done():
+                if move[0] == target:
+                    self.move_stats['merged'] += 1
+                    joined.append(move[1])
+                    continue
+                previous.append(move[1])
+            elif self.at_target(target, channel):
+                self.move_stats['skipped'] += 1
+                continue
+            targets[channel] = target
+        if targets:
+            task = asyncio.ensure_future(self._move(targets, previous))
+            for channel, target in targets.items():
+                self._moves[channel] = (target, task)
+            task.add_done_callback(functools.partial(self._moved, list(targets)))
+            joined.append(task)
+        if wait and joined:
+            await asyncio.gather(*joined)
+        return True
+
+    def at_target(self, target, channel):
+        """
+        Is the parameter at target already? By the readback if there is one, otherwise by the last target reached
+        """
+        position = self.get_position(channel)
+        if position is None:
+            position = self.commanded.get(channel)
+        return position is not None and self.getClosestParameterValue(position, channel) == target
+
+    async def _move(self, targets, previous):
+        if previous:
+            # moves of a channel are done in order
+            await asyncio.wait(previous)
+        async with pymDevices.lock(self):
+            if not self.initialize():
+                raise pynParameterException("Can't initialize %s" % type(self).__name__)
+            overtravel = {}
+            for channel, target in targets.items():
+                self.commanded[channel] = None
+                if self.backlash:
+                    start = self.get_position(channel)
+                    # without knowing where we are, the approach from the backlash side is the safe choice
+                    if start is None or (target - start) * self.backlash < 0:
+                        overtravel[channel] = self.sanityCheckValue(target - self.backlash, channel)
+            if overtravel:
+                self.move_stats['backlash'] += len(overtravel)
+                await self.set_multi(overtravel, True)
+            self.move_stats['moves'] += len(targets)
+            await self.set_multi(targets, True)
+            self.commanded.update(targets)
+
+    def _moved(self, channels, task):
+        for channel in channels:
+            if self._moves.get(channel, (None, None))[1] is task:
+                del self._moves[channel]
+        if not task.cancelled() and task.exception() is not None:
+            # raised to the callers waiting, logged as well for moves nobody waits for
+            logging.warning("Move of %s failed: %s" % (type(self).__name__, task.exception()))
+
+
+def unbox(value):
+    """
+    numpy scalars, eg. np.clip() of a number, as plain numbers. Arrays are returned unchanged
+    """
+    return value.item() if isinstance(value, np.generic) else value
+
 
 class pynParameterFactory:
     @staticmethod
-    def createParameter(classid):
-        for params in pymParameter.__subclasses__(): # potentially harmful if one can manipulate subclasses to load malicious jobs.
-            if classid == params.__name__:
-                return params.create_param()
+    def createParameter(classid, config=None, owner=None):
+        """
+        Get a parameter by class name (see pymRegistry) from the device pool
+        :param config: settings of the device, parameters of the same class and config are shared
+        :param owner: job using the parameter, see pymDevices.acquire
+        :return: the parameter or None if there is no such parameter
+        """
+        if classid is None:
+            return None
+        try:
+            cls = pymRegistry.get('parameter', classid)
+        except pymException.pymPluginError as err:
+            logging.warning(err)
+            return None
+        return pymDevices.acquire(cls, config, owner)
 
 
 
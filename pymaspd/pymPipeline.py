@@ -0,0 +1,77 @@
+import asyncio
+import collections
+import logging
+
+
+class pymPipeline:
+    """
+    Bounded pipeline for late collections. A job's run() may return a callable to collect its data later. The
+    pipeline runs up to depth of these collections concurrently while the caller moves on to the next point, and
+    hands the results to a callback in the order they were submitted.
+    """
+
+    def __init__(self, depth, callback):
+        """
+        :param depth: maximum number of acquired but not yet collected points
+        :param callback: called as callback(result, tag) for every collection, in submission order
+        """
+        self.depth = max(1, int(depth))
+        self.callback = callback
+        self._pending = collections.deque()
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def submit(self, result, tag=None):
+        """
+        Start the late collection of result. If depth collections are in flight already, wait for the oldest one
+        (backpressure). Errors of any collection are raised here, after all other collections got cancelled.
+        :param result: return value of a job's run(), either a callable for late collection or the result itself
+        :param tag: handed to the callback, eg. the parameter value of this point
+        """
+        if callable(result):
+            future = asyncio.ensure_future(result())
+        else:
+            future = asyncio.get_event_loop().create_future()
+            future.set_result(result)
+        self._pending.append((future, tag))
+        # hand on what's done already, keeping the order
+        while self._pending and self._pending[0][0].done():
+            await self._retire()
+        self._check()
+        while len(self._pending) > self.depth:
+            await self._retire()
+
+    async def drain(self):
+        """
+        Wait for all collections in flight
+        """
+        while self._pending:
+            await self._retire()
+
+    def cancel(self):
+        """
+        Cancel all collections in flight
+        """
+        for future, _ in self._pending:
+            future.cancel()
+        self._pending.clear()
+
+    async def _retire(self):
+        future, tag = self._pending[0]
+        try:
+            result = await future
+        except BaseException:
+            self.cancel()
+            raise
+        self._pending.popleft()
+        self.callback(result, tag)
+
+    def _check(self):
+        # don't wait for an error of a later collection to become the oldest
+        for future, tag in self._pending:
+            if future.done() and not future.cancelled() and future.exception() is not None:
+                logging.warning("Late collection for %s failed" % (tag,))
+                err = future.exception()
+                self.cancel()
+                raise err
@@ -0,0 +1,138 @@
+"""
+Command dispatch of the pymaspd RPC protocol.
+Handlers are registered by name with the command decorator. A message is either
+    a dict of commands, {command: payload, ...}, the classic format. Results are put under the reply key of each
+    command, errors go into "errors" (by command) and "error" (the last one)
+    a batch, {"batch": [{"cmd": command, "args": payload}, ...], "stop_on_error": False}. The commands run in order
+    and each one gets its own slot with result, error and time in the reply's batch list
+"""
+import time
+import asyncio
+import logging
+
+
+COMMANDS = {}
+# raised by handlers which got malformed arguments
+PROTOCOL_ERRORS = (IndexError, KeyError, TypeError, ValueError)
+
+
+class pymRPCCommand:
+    def __init__(self, name, func, reply_key, errors):
+        self.name = name
+        self.func = func
+        self.reply_key = reply_key
+        self.errors = errors
+
+    def error_message(self, err):
+        """
+        Message for the client if err is an expected error of this command, otherwise None
+        """
+        for cls in type(err).__mro__:
+            if cls in self.errors:
+                return self.errors[cls].format(err)
+        if isinstance(err, PROTOCOL_ERRORS):
+            return "Protocol Error: {}".format(err)
+        return None
+
+
+def command(name, reply_key=None, errors=None):
+    """
+    Register a handler for an RPC command. The handler is called with the server and the payload of the command and
+    may be a coroutine function.
+    :param name: name of the command
+    :param reply_key: key of the result in classic replies, defaults to the name. False: no result. A tuple of keys if
+    the handler returns a tuple of results
+    :param errors: dict exception class -> message for the client, {} in the message is replaced by the exception
+    """
+    def register(func):
+        COMMANDS[name] = pymRPCCommand(name, func, name if reply_key is None else reply_key, errors or {})
+        return func
+    return register
+
+
+class pymRPCDispatcher:
+    """
+    Runs the commands of RPC messages and keeps timing statistics of each command
+    """
+
+    def __init__(self, target):
+        """
+        :param target: passed as first argument to the handlers
+        """
+        self.target = target
+        # command -> [calls, total seconds]
+        self.timing = {}
+
+    async def call(self, name, payload):
+        """
+        Run a single command
+        :return: {'cmd': name, 'result': result, 'error': None or message, 'time': seconds}
+        """
+        cmd = COMMANDS.get(name)
+        result = None
+        error = None
+        start = time.perf_counter()
+        if cmd is None:
+            error = "Unknown command: %s" % name
+        else:
+            try:
+                result = cmd.func(self.target, payload)
+                if asyncio.iscoroutine(result):
+                    result = await result
+            except Exception as err:
+                error = cmd.error_message(err)
+                if error is None:
+                    logging.exception("RPC command %s failed" % name)
+                    error = "Processing failed: %s" % err
+        elapsed = time.perf_counter() - start
+        if cmd is not None:
+            stats = self.timing.setdefault(name, [0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+            if error is None and isinstance(cmd.reply_key, tuple):
+                result = dict(zip(cmd.reply_key, result))
+        return {"cmd": name, "result": result, "error": error, "time": elapsed}
+
+    async def process(self, msg):
+        """
+        Process a message in classic or batch format
+        :return: reply
+        """
+        if "batch" in msg:
+            return {"batch": await self.batch(msg["batch"], msg.get("stop_on_error", False))}
+        reply = {}
+        for name, payload in msg.items():
+            res = await self.call(name, payload)
+            reply.setdefault("timing", {})[name] = res["time"]
+            key = COMMANDS[name].reply_key if name in COMMANDS else False
+            if res["error"] is not None:
+                reply["error"] = res["error"]
+                reply.setdefault("errors", {})[name] = res["error"]
+                if isinstance(key, str):
+                    reply[key] = False
+            elif isinstance(key, tuple):
+                reply.update(res["result"])
+            elif key:
+                reply[key] = res["result"]
+        return reply
+
+    async def batch(self, entries, stop_on_error=False):
+        """
+        Run a list of commands in order. Each entry is {'cmd': name, 'args': payload} or [name, payload]
+        :param stop_on_error: skip the remaining commands after the first error
+        :return: list with one call() result per entry
+        """
+        results = []
+        failed = False
+        for entry in entries:
+            if isinstance(entry, dict):
+                name, payload = entry.get("cmd"), entry.get("args")
+            else:
+                name, payload = entry[0], entry[1] if len(entry) > 1 else None
+            if failed and stop_on_error:
+                results.append({"cmd": name, "result": None, "error": "Skipped after previous error", "time": 0.0})
+                continue
+            res = await self.call(name, payload)
+            failed = failed or res["error"] is not None
+            results.append(res)
+        return results
@@ -0,0 +1,265 @@
+"""
+Registry of the plugins of pymaspd: jobs (including detectors) and parameters, by class name.
+Plugins are found once, in three places:
+    classes already imported, eg. pymList or pymIterator
+    the plugin directories (detectors/, parameters/ and whatever add_directory() adds). Their modules are only parsed
+    to find the plugin classes, a module is imported when one of its classes is used for the first time
+    the entry point groups pymasp.jobs and pymasp.parameters of installed packages, loaded on first use as well.
+    The name of an entry point has to be the class name.
+So the daemon starts fast even with lots of hardware drivers installed, and only the drivers in use get imported.
+"""
+import os
+import ast
+import sys
+import logging
+import importlib
+import threading
+
+import pymException
+
+
+KINDS = ('job', 'parameter')
+# base classes of the kinds, as module and class name
+_BASES = {'job': ('pymJob', 'pymJob'), 'parameter': ('pymParameter', 'pymParameter')}
+ENTRY_POINT_GROUPS = {'job': 'pymasp.jobs', 'parameter': 'pymasp.parameters'}
+# abstract classes of pymaspd which plugins derive from, eg. class my_camera(pymDetector)
+_FRAMEWORK_MODULES = ('pymDetector',)
+
+_here = os.path.dirname(os.path.abspath(__file__))
+_directories = [os.path.join(_here, 'detectors'), os.path.join(_here, 'parameters')]
+
+# kind -> name -> pymPlugin
+_plugins = {kind: {} for kind in KINDS}
+_discovered = False
+_lock = threading.RLock()
+
+
+class pymPlugin:
+    """
+    A plugin class which may not be imported yet
+    """
+    def __init__(self, kind, name, description=None, cls=None, path=None, entry_point=None):
+        self.kind = kind
+        self.name = name
+        self.description = description
+        self.cls = cls
+        # source file of a plugin from a plugin directory
+        self.path = path
+        self.entry_point = entry_point
+
+    def load(self):
+        """
+        Import the plugin's module if necessary
+        :return: the class
+        """
+        if self.cls is None:
+            logging.debug("Loading plugin %s" % self.name)
+            try:
+                if self.entry_point is not None:
+                    cls = self.entry_point.load()
+                else:
+                    directory, filename = os.path.split(self.path)
+                    # plugins import the modules of pymaspd and each other by plain module names
+                    if directory not in sys.path:
+                        sys.path.append(directory)
+                    cls = getattr(importlib.import_module(os.path.splitext(filename)[0]), self.name)
+            except (ImportError, AttributeError) as err:
+                # eg. the library of a hardware driver is missing
+                logging.warning("Can't load plugin %s: %s" % (self.name, err))
+                raise pymException.pymPluginError("Can't load %s: %s" % (self.name, err))
+            if not isinstance(cls, type) or not issubclass(cls, _base(self.kind)):
+                raise pymException.pymPluginError("%s is not a %s" % (self.name, self.kind))
+            self.cls = cls
+            if self.description is None:
+                self.description = cls.__doc__
+        return self.cls
+
+
+def add_directory(path):
+    """
+    Look for plugins in another directory as well
+    """
+    with _lock:
+        path = os.path.abspath(path)
+        if path not in _directories:
+            _directories.append(path)
+            if _discovered:
+                _scan_directory(path)
+
+
+def get(kind, name):
+    """
+    Class of a plugin, importing it if necessary
+    :param kind: 'job' or 'parameter'
+    :param name: class name
+    :return: the class
+    """
+    with _lock:
+        plugin = _find(kind, name)
+        if plugin is None:
+            raise pymException.pymPluginError("No %s named %s" % (kind, name))
+        return plugin.load()
+
+
+def available(kind):
+    """
+    List the plugins of a kind without importing them
+    :return: list of dicts with classname and description
+    """
+    with _lock:
+        _discover()
+        _add_loaded(kind)
+        return [{'classname': plugin.name, 'description': plugin.description}
+                for plugin in _plugins[kind].values()]
+
+
+def rediscover():
+    """
+    Forget what has been found (but not what has been loaded) and look again, eg. after installing a driver
+    """
+    global _discovered
+    with _lock:
+        for kind in KINDS:
+            for name in [name for name, plugin in _plugins[kind].items() if plugin.cls is None]:
+                del _plugins[kind][name]
+        _discovered = False
+        _discover()
+
+
+def _find(kind, name):
+    _discover()
+    plugin = _plugins[kind].get(name)
+    if plugin is None:
+        # imported after discovery, eg. a job module the daemon imports itself
+        _add_loaded(kind)
+        plugin = _plugins[kind].get(name)
+    return plugin
+
+
+def _base(kind):
+    module, name = _BASES[kind]
+    return getattr(importlib.import_module(module), name)
+
+
+def _source(plugin):
+    if plugin.path is not None:
+        return plugin.path
+    if plugin.cls is not None:
+        module_file = getattr(sys.modules.get(plugin.cls.__module__), '__file__', None)
+        if module_file:
+            return os.path.abspath(module_file)
+    return None
+
+
+def _register(plugin):
+    known = _plugins[plugin.kind].get(plugin.name)
+    if known is None:
+        _plugins[plugin.kind][plugin.name] = plugin
+        return
+    source = _source(plugin)
+    if source is None or source != _source(known):
+        logging.warning("Plugin %s found twice, using the first one" % plugin.name)
+    elif known.cls is None:
+        # a plugin module which got imported directly
+        known.cls = plugin.cls
+
+
+def _add_loaded(kind):
+    # register subclasses which are imported already, including subclasses of subclasses
+    pending = _base(kind).__subclasses__()
+    while pending:
+        cls = pending.pop()
+        plugin = _plugins[kind].get(cls.__name__)
+        if plugin is None or plugin.cls is not cls:
+            _register(pymPlugin(kind, cls.__name__, cls.__doc__, cls=cls))
+        pending.extend(cls.__subclasses__())
+
+
+def _discover():
+    global _discovered
+    if _discovered:
+        return
+    _discovered = True
+    for module in _FRAMEWORK_MODULES:
+        importlib.import_module(module)
+    for kind in KINDS:
+        _add_loaded(kind)
+    for directory in _directories:
+        _scan_directory(directory)
+    _scan_entry_points()
+
+
+def _scan_directory(directory):
+    if not os.path.isdir(directory):
+        return
+    classes = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.py') or filename.startswith('_'):
+            continue
+        path = os.path.join(directory, filename)
+        try:
+            with open(path, 'rb') as source:
+                tree = ast.parse(source.read(), path)
+        except (OSError, SyntaxError, ValueError) as err:
+            logging.warning("Can't read plugin module %s: %s" % (path, err))
+            continue
+        for node in tree.body:
+            if isinstance(node, ast.ClassDef):
+                classes.append((node, path))
+    # a class is a plugin if one of its bases is a plugin (or a base class of plugins), resolved until nothing changes
+    kinds = {name: kind for kind in KINDS for name in _known_names(kind)}
+    pending = classes
+    while pending:
+        unresolved = []
+        for node, path in pending:
+            kind = next((kinds[base] for base in _base_names(node) if base in kinds), None)
+            if kind is None:
+                unresolved.append((node, path))
+                continue
+            kinds[node.name] = kind
+            _register(pymPlugin(kind, node.name, _docstring(node), path=path))
+        if len(unresolved) == len(pending):
+            break
+        pending = unresolved
+
+
+def _known_names(kind):
+    names = {_BASES[kind][1]}
+    names.update(_plugins[kind])
+    return names
+
+
+def _base_names(node):
+    for base in node.bases:
+        if isinstance(base, ast.Name):
+            yield base.id
+        elif isinstance(base, ast.Attribute):
+            yield base.attr
+
+
+def _docstring(node):
+    # the __doc__ assignment some jobs use wins over the docstring, as it does at runtime
+    for stmt in node.body:
+        if isinstance(stmt, ast.Assign) and any(isinstance(t, ast.Name) and t.id == '__doc__' for t in stmt.targets):
+            if isinstance(stmt.value, ast.Constant) and isinstance(stmt.value.value, str):
+                return stmt.value.value
+    return ast.get_docstring(node, clean=False)
+
+
+def _scan_entry_points():
+    try:
+        from importlib import metadata
+    except ImportError:
+        return
+    try:
+        all_entry_points = metadata.entry_points()
+    except Exception as err:
+        logging.warning("Can't read entry points: %s" % err)
+        return
+    for kind, group in ENTRY_POINT_GROUPS.items():
+        if hasattr(all_entry_points, 'select'):
+            entry_points = all_entry_points.select(group=group)
+        else:
+            entry_points = all_entry_points.get(group, [])
+        for entry_point in entry_points:
+            _register(pymPlugin(kind, entry_point.name, entry_point=entry_point))
@@ -0,0 +1,235 @@
+"""
+Experiment templates: a job tree as plain, versioned data, built from the settings contract of the jobs
+(getsettings/updatejob) and their class names. Loading a template creates jobs through the job factory only, so unlike
+a pickle it can't run arbitrary code and survives changes to the attributes of job classes.
+    template = {"format": "pymTemplate", "version": 1, "root": node}
+    node = {"class": class name, "settings": {key: value}, "children": [node, ...]}
+Settings which equal the ones of a new job of the class are left out, as are empty settings and children.
+Named templates are stored in the journal and kept in memory, with resolved classes, once used. All jobs created from
+a template get the same settings dicts, updatejob() must copy mutable values it keeps.
+"""
+import json
+import logging
+import pymException
+import pymJournal
+from pymJob import *
+from pymParameter import *
+
+
+FORMAT = "pymTemplate"
+VERSION = 1
+# settings which are carried by the children of a node
+_SUBJOB_SETTINGS = ('jobSettings',)
+
+# class -> settings of a new job of the class
+_defaults = {}
+# name -> template
+_cache = {}
+# name -> plan of the template, see prepare()
+_plans = {}
+
+
+def dump(job):
+    """
+    Template of a job tree
+    :param job: root job
+    :return: template, JSON serializable
+    """
+    return {"format": FORMAT, "version": VERSION, "root": _dump_node(job)}
+
+
+def load(template):
+    """
+    Create a job tree from a template. The jobs get new ids.
+    :param template: template as returned by dump()
+    :return: root job
+    """
+    return _build(*prepare(template))
+
+
+def prepare(template):
+    """
+    Check a template. The classes it uses are resolved while building and kept with the plan, building from the
+    same plan again skips that work.
+    :return: plan for _build(), (root node, classes)
+    """
+    if not isinstance(template, dict) or template.get("format") != FORMAT:
+        raise pymException.pymTemplateError("Not a template")
+    if template.get("version", 0) > VERSION:
+        raise pymException.pymTemplateError("Template version %s is newer than supported version %d" %
+                                            (template["version"], VERSION))
+    return template["root"], {}
+
+
+def save(name, job):
+    """
+    Store the template of a job tree in the journal
+    :return: the template
+    """
+    template = dump(job)
+    pymJournal.save_template(name, VERSION, json.dumps(template, separators=(',', ':')))
+    _cache[name] = template
+    _plans.pop(name, None)
+    return template
+
+
+def get(name):
+    """
+    Stored template by name
+    """
+    if name not in _cache:
+        body = pymJournal.get_template(name)
+        if body is None:
+            raise pymException.pymTemplateError("No template named %s" % name)
+        _cache[name] = json.loads(body)
+    return _cache[name]
+
+
+def delete(name):
+    _cache.pop(name, None)
+    _plans.pop(name, None)
+    pymJournal.delete_template(name)
+
+
+def instantiate(template):
+    """
+    Create a job tree from a stored template (by name) or a template supplied as dict
+    """
+    if isinstance(template, str):
+        if template not in _plans:
+            _plans[template] = prepare(get(template))
+        return _build(*_plans[template])
+    return load(template)
+
+
+def clear_cache():
+    """
+    Forget the templates in memory, eg. after another journal got opened
+    """
+    _cache.clear()
+    _plans.clear()
+
+
+def _dump_node(job):
+    node = {"class": type(job).__name__}
+    settings = _changed_settings(type(job), _settings(job))
+    if settings:
+        node["settings"] = settings
+    children = [_dump_node(subjob) for subjob in _subjobs(job)]
+    if children:
+        node["children"] = children
+    return node
+
+
+def _changed_settings(cls, settings):
+    """
+    Leave out the settings which equal the ones of a new job, as long as a job built from the rest gets all of them
+    back. Settings depend on each other, eg. steps and stepsize of an iterator, leaving out one can change another.
+    """
+    defaults = _default_settings(cls)
+    changed = {key: value for key, value in settings.items() if key not in defaults or defaults[key] != value}
+    try:
+        # a second try keeps the settings which came out different as well
+        for _ in range(2):
+            if len(changed) == len(settings):
+                return changed
+            job = cls(None)
+            if changed:
+                job.updatejob(changed)
+            rebuilt = _settings(job)
+            if rebuilt == settings:
+                return changed
+            changed.update((key, value) for key, value in settings.items() if rebuilt.get(key) != value)
+    except Exception as err:
+        logging.debug("Can't check the settings of %s: %s" % (cls.__name__, err))
+    return settings
+
+
+def _job_class(node, classes):
+    # classes are resolved once per template
+    name = node["class"]
+    cls = classes.get(name)
+    if cls is None:
+        cls = classes[name] = pymJobFactory.jobclass(name)
+    return cls
+
+
+def _build(node, classes):
+    job = _job_class(node, classes).create_job(pymJobFactory.newJobId())
+    settings = node.get("settings")
+    if settings:
+        job.updatejob(settings)
+    children = node.get("children")
+    if children:
+        _build_children(job, children, classes)
+    return job
+
+
+def _build_children(job, children, classes):
+    existing = _subjobs(job)
+    if not existing:
+        for child in children:
+            if not job.appendjob(_build(child, classes)):
+                raise pymException.pymTemplateError("%s doesn't take %s" % (_name_of(job), child["class"]))
+        return
+    # the settings created the subjobs already, eg. the job of an iterator
+    if len(existing) != len(children):
+        raise pymException.pymTemplateError("%s has %d subjobs, template has %d" %
+                                            (_name_of(job), len(existing), len(children)))
+    for subjob, child in zip(existing, children):
+        if type(subjob) is not _job_class(child, classes):
+            raise pymException.pymTemplateError("%s expected, %s created by settings" %
+                                                (child["class"], _name_of(subjob)))
+        settings = child.get("settings")
+        if settings:
+            subjob.updatejob(settings)
+        grandchildren = child.get("children")
+        if grandchildren:
+            _build_children(subjob, grandchildren, classes)
+
+
+def _name_of(job):
+    return type(job).__name__
+
+
+def _settings(job):
+    # current values of the settings which can be changed, as plain data
+    res = {}
+    for key, setting in (job.getsettings() or {}).items():
+        if setting.get('ro') or key in _SUBJOB_SETTINGS:
+            continue
+        value = _plain(setting.get('current'))
+        if value is not None:
+            res[key] = value
+    return res
+
+
+def _plain(value):
+    if isinstance(value, (pymJob, pymParameter)):
+        return type(value).__name__
+    if isinstance(value, dict):
+        if value and all(isinstance(v, dict) and 'current' in v for v in value.values()):
+            # nested settings dict, eg. of a parameter
+            return {k: _plain(v['current']) for k, v in value.items() if not v.get('ro')}
+        return {k: _plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    return value
+
+
+def _default_settings(cls):
+    if cls not in _defaults:
+        try:
+            _defaults[cls] = _settings(cls(None))
+        except Exception as err:
+            # settings of some jobs only work once they are set up, store all of them then
+            logging.debug("No default settings of %s: %s" % (cls.__name__, err))
+            _defaults[cls] = {}
+    return _defaults[cls]
+
+
+def _subjobs(job):
+    try:
+        return job.get_subjobs() or []
+    except (AttributeError, NotImplementedError):
+        return []
@@ -0,0 +1,104 @@
+"""
+Binary wire format of the pymaspd RPC protocol.
+A binary message is a multipart message:
+    MAGIC, a JSON header, one raw frame per buffer
+The header is {"msg": message, "frames": [...]}. Every array or bytes object in the message is replaced by
+{"__frame__": n} and sent as raw frame n, the header's frames list holds dtype and shape of arrays (None for bytes).
+Clients which send a single JSON frame keep getting JSON replies, arrays become lists and bytes base64 strings there.
+"""
+import json
+import base64
+import numpy as np
+
+
+MAGIC = b"PYMW1"
+
+
+def is_binary(frames):
+    """
+    Is the multipart message (without envelope) in the binary format
+    """
+    return len(frames) > 1 and bytes(frames[0]) == MAGIC
+
+
+def pack(msg):
+    """
+    Encode a message in the binary format. Arrays are not copied, don't modify them until the message was sent.
+    :return: list of frames
+    """
+    buffers = []
+    meta = []
+    header = {"msg": _strip(msg, buffers, meta), "frames": meta}
+    return [MAGIC, json.dumps(header, default=_json_default).encode('utf8')] + buffers
+
+
+def unpack(frames):
+    """
+    Decode a message in the binary format. Arrays are read only views of the received frames.
+    :param frames: list of bytes or zmq frames, starting with MAGIC
+    :return: message
+    """
+    header = json.loads(bytes(frames[1]).decode('utf8'))
+    meta = header["frames"]
+    if len(meta) != len(frames) - 2:
+        raise ValueError("header describes %d frames, got %d" % (len(meta), len(frames) - 2))
+    buffers = []
+    for info, frame in zip(meta, frames[2:]):
+        buf = frame.buffer if hasattr(frame, 'buffer') else frame
+        if info is None:
+            buffers.append(bytes(buf))
+        else:
+            buffers.append(np.frombuffer(buf, dtype=np.dtype(info["dtype"])).reshape(info["shape"]))
+    return _fill(header["msg"], buffers)
+
+
+def to_json(msg):
+    """
+    Encode a message for JSON-only clients
+    :return: bytes
+    """
+    return json.dumps(msg, default=_json_default).encode('utf8')
+
+
+def _strip(obj, buffers, meta):
+    # replace buffers by placeholders, collecting them
+    if isinstance(obj, np.ndarray) and not obj.dtype.hasobject:
+        if not obj.flags.c_contiguous:
+            obj = np.ascontiguousarray(obj)
+        buffers.append(obj)
+        meta.append({"dtype": obj.dtype.str, "shape": obj.shape})
+        return {"__frame__": len(buffers) - 1}
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        buffers.append(obj)
+        meta.append(None)
+        return {"__frame__": len(buffers) - 1}
+    if isinstance(obj, dict):
+        return {key: _strip(value, buffers, meta) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_strip(value, buffers, meta) for value in obj]
+    if isinstance(obj, np.ndarray):
+        return _strip(obj.tolist(), buffers, meta)
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return obj
+
+
+def _fill(obj, buffers):
+    if isinstance(obj, dict):
+        if len(obj) == 1 and "__frame__" in obj:
+            return buffers[obj["__frame__"]]
+        return {key: _fill(value, buffers) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [_fill(value, buffers) for value in obj]
+    return obj
+
+
+def _json_default(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return base64.b64encode(obj).decode('ascii')
+    # eg. a parameter in the settings of a job, the client gets a description rather than no reply at all
+    return str(obj)
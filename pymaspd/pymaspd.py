@@ -1,5 +1,11 @@
 import pickle
 import json
+import base64
+import binascii
+import functools
+import concurrent.futures
+import sqlite3
+from datetime import datetime, timezone
 import zmq
 import zmq.asyncio
 
@@ -10,11 +16,24 @@ from pymaspd_worker import pymaspd_worker
 from pymParameter import *
 
 import pymException
-
-# configure which detectors you want to use
-# configure which parameters (stages etc.) you want to use
+import pymJournal
+from pymJournal.storage import pymChunkStorage
+import pymEvents
+import pymRPC
+import pymWire
+import pymTemplate
+import pymRegistry
+import pymDevices
+
+# detectors and parameters (stages etc.) are plugins, found in detectors/, parameters/ and the plugin_directories
+# setting or installed with an entry point, see pymRegistry. They are loaded once they are used.
 # configure which other jobs (kinds of loops) you want to use
 # (probably safe to leave them all enabled)
+import pymList
+import pymIterator
+import pymGrid
+import pymFlyScan
+import pymParallel
 
 logging.basicConfig(level=logging.DEBUG)
 PYTHONASYNCIODEBUG=1
@@ -30,452 +49,573 @@ class pymaspd:
         #self.context = zmq.Context()
         self.shutdown = False
         self.version = "PynocchioMaster 0.1"
-        self.job_counter = 0
 
         # set listening addr. Currently the frontend will run on the same mashine, so we can use inproc communication
         self.rpc_addr = "tcp://127.0.0.1:80555"
+        # seconds between checks for shutdown while no requests come in
+        self.rpc_poll_interval = 0.5
+        # RPC requests in flight and threads for the ones which block (journal queries)
+        self.rpc_tasks = set()
+        self.dispatcher = pymRPC.pymRPCDispatcher(self)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="pymaspd-rpc")
+        # live events (progress, data, queue changes) are published here
+        self.pub_addr = "tcp://127.0.0.1:5556"
+        # minimal interval in seconds between two events of a topic, eg. {"data": 0.04} for 25 Hz live plots
+        self.event_rate_limits = {}
+
+        # journal settings. The writer thread takes sqlite off the event loop and group commits our writes
+        self.db_path = "pymasp_journal.db"
+        self.journal_writer = True
+        self.journal_flush_interval = 0.05
+        self.journal_batch_size = 512
+        # store large detector frames in memory mapped chunk files next to the database (None: inline blobs)
+        self.data_dir = "pymasp_data"
+        # listing of the journal
+        self.list_page_size = 100
+        self.list_page_size_max = 1000
+        # allow expert commands, such as listing all jobs in the journal
+        self.expert_mode = False
+        # further directories with detector or parameter modules
+        self.plugin_directories = []
+        # seconds unused devices stay open (see pymDevices), None to keep them until shutdown
+        self.device_ttl = 300.0
 
     def list_available_jobs(self):
-        alljobs = pymJob.__subclasses__()
-        res = []
-        for job in alljobs:
-            res.append({'classname': job.__name__, 'description': job.__doc__})
-            # also check subclasses (pynDetector's!)
-            res.extend({'classname': sjob.__name__, 'description': sjob.__doc__} for sjob in job.__subclasses__())
-        return res
+        # includes detectors and the plugins which are not loaded yet
+        return pymRegistry.available('job')
 
     def list_available_parameters(self):
-        alljobs = pymParameter.__subclasses__()
-        res = []
-        for job in alljobs:
-            res.append({'classname': job.__name__, 'description': job.__doc__})
-        return res
+        return pymRegistry.available('parameter')
 
 
     def createjob(self,job):
         logging.debug("Use the Factory to create Job")
-        try:
-            newjob = pymJobFactory.createJob(job, self.job_counter)
-        finally:
-            # always increase job_counter to give unique ids.
-            self.job_counter += 1
-        return newjob
+        # the factory hands out unique ids
+        return pymJobFactory.createJob(job)
 
     def unpicklejob(self,pickeld_job):
         """
         Unpickles a job to load saved experiments. Warning: This is currently unrestricted and allows for
         remote code execution!
-        :param pickeld_job:
+        :param pickeld_job: the pickle, base64 encoded from JSON clients
         :return:
         """
         try:
+            if isinstance(pickeld_job, str):
+                pickeld_job = base64.b64decode(pickeld_job)
             newjob = pickle.loads(pickeld_job)
-        except pickle.UnpicklingError:
+        except (pickle.UnpicklingError, binascii.Error):
             logging.warning("Couldn't load job from pickle")
             raise pymException.pymJobNotExist
         if isinstance(newjob, pymJob):
+            # ids of a saved job are from another session, give the whole tree new ones
+            self.worker.renumber(newjob)
+            self._pool_parameters(newjob)
             return newjob
         else:
             raise pymException.pymJobNotExist
 
+    def _pool_parameters(self, job):
+        """
+        Unpickled jobs carry copies of their parameters of their own, which would bypass the device pool. Replace
+        them by the shared instances (see pymDevices), like jobs created from a template get, keeping their settings.
+        :param job: root of the job tree
+        """
+        for tjob in self.worker._walk(job):
+            # the parameter of an iterator, or of the axes of a grid or fly scan
+            holders = [tjob, getattr(tjob, 'axis', None)] + list(getattr(tjob, 'axes', None) or [])
+            for holder in holders:
+                parameter = getattr(holder, 'parameter', None)
+                if not isinstance(parameter, pymParameter):
+                    continue
+                pooled = pynParameterFactory.createParameter(type(parameter).__name__,
+                                                             getattr(parameter, 'config', None), owner=holder)
+                if pooled is None:
+                    raise pymException.pymJobNotExist
+                for key, setting in parameter.getsettings().items():
+                    if not setting.get('ro'):
+                        pooled.updatesettings({key: setting['current']})
+                holder.parameter = pooled
+
 
 
     def main_loop(self):
-        # set the context for zmq
+        for directory in self.plugin_directories:
+            pymRegistry.add_directory(directory)
+        pymDevices.ttl = self.device_ttl
 
+        # open the journal
+        pymJournal.open(self.db_path, use_writer=self.journal_writer, flush_interval=self.journal_flush_interval,
+                        batch_size=self.journal_batch_size,
+                        storage=pymChunkStorage(self.data_dir) if self.data_dir else None)
+        pymJournal.create_new_db()
+
+        # set the context for zmq
+        pymEvents.open(self.pub_addr, rate_limits=self.event_rate_limits)
 
         # we want to be able to use the zmq polls
         rpcloop = zmq.asyncio.ZMQEventLoop()
         asyncio.set_event_loop(rpcloop)
 
-        # setup tasks
+        # setup tasks, asyncio.wait takes tasks only
         tasks=[
-            self.worker_loop(),
-            self.rpc_loop()
+            rpcloop.create_task(self.worker_loop()),
+            rpcloop.create_task(self.rpc_loop()),
+            rpcloop.create_task(self.device_loop())
         ]
         # now start the zmq message loop
         rpcloop.run_until_complete(asyncio.wait(tasks))
+        # make sure everything ended up in the journal
+        self.executor.shutdown()
+        pymDevices.unload_all()
+        pymJournal.close()
+        pymEvents.close()
 
 
     async def rpc_loop(self):
         #initialize connection
-        sock = self.context.socket(zmq.REP)
+        # a ROUTER socket lets us take further requests while slow ones are still being processed. Every request gets
+        # its own task, replies go back by the identity frames of the envelope
+        sock = self.context.socket(zmq.ROUTER)
         logging.debug("Trying to bind to socket")
         sock.bind(self.rpc_addr)
         logging.debug("Socket Opened, awaiting message")
         while not self.shutdown:
-            # wait for messages
-            try:
-                logging.debug("Wait for message")
-                msg = await sock.recv()
-                # Currently we are using json to communicate on the protocol level and then we maybe will
-                # have a pickle as payload.
-                # For some reason we can't await sock.recv_json(). Therefore: Call recv and decode JSON by hand
-                # Consider moving this logic to process_rpc...
-                if isinstance(msg, bytes):
-                    msg = msg.decode('utf8')
-                msg = json.loads(msg)
-            except Exception as exc:
-                # Dangerous! We should rather do exception handling for seperate cases: zmq errors and json errors.
-                logging.debug("Error in receiving Message: %s" % exc)
-                raise
-            logging.debug("Received Message from RPC, going to process")
-            # process directly
-            reply = self.process_rpc(msg)
-            logging.debug("Processing of RPC Message done, going to send reply")
-
-            if reply:
-                # response can be slow
-                await sock.send_json(reply)
-                logging.debug("RPC Message send, returning to start of loop")
-
+            # poll with a timeout, so a shutdown is noticed even without further messages
+            if not await sock.poll(self.rpc_poll_interval * 1000):
+                continue
+            # without copying, array payloads of binary messages are used in place
+            frames = await sock.recv_multipart(copy=False)
+            split = self.split_envelope(frames)
+            envelope, body = frames[:split], frames[split:]
+            if not body:
+                logging.warning("Dropping RPC message without body")
+                continue
+            task = asyncio.ensure_future(self.handle_rpc(sock, envelope, body))
+            self.rpc_tasks.add(task)
+            task.add_done_callback(self.rpc_tasks.discard)
+
+        # let requests in flight finish before the socket goes away
+        if self.rpc_tasks:
+            await asyncio.wait(self.rpc_tasks)
+        sock.close(linger=0)
         #socket was closed, complete this task
 
-
-    def process_rpc(self, msg):
+    @staticmethod
+    def split_envelope(frames):
         """
-        Process Messages from RPC. msg is built as a dict containing the command as the key and the payload as value.
-        :param msg:
-        :return:
+        Find the start of the message in a multipart message received on the ROUTER socket. REQ clients put an empty
+        delimiter between the identities and the message, DEALER clients may not. A binary message starts with
+        pymWire.MAGIC, a JSON message is the last frame.
+        Frames of a binary message may be empty (eg. an empty array), so only the frames before MAGIC are identities.
+        :param frames: list of zmq frames
+        :return: index of the first frame of the message
         """
-        logging.debug(msg)
-        reply = {}
-
+        for k, frame in enumerate(frames):
+            if len(frame) == 0:
+                return k + 1
+            if k > 0 and frame.bytes == pymWire.MAGIC:
+                return k
+        return len(frames) - 1
+
+    async def handle_rpc(self, sock, envelope, body):
         """
-        Worker related commands
+        Process one RPC message and send the reply to the client it came from. Messages are a single JSON frame or
+        binary multipart messages (see pymWire), the reply uses the format of the message.
+        :param sock: ROUTER socket the message was received on
+        :param envelope: identity frames (and delimiter) of the client
+        :param body: frames of the message
         """
-
-        # pause or continue worker loop
-        if "start" in msg:
-            self.worker.paused = False
-
-        if "pause" in msg:
-            self.worker.paused = True
-
-        # list jobs in queue
-        if "get_job_queue" in msg:
-            reply["job_queue"] = self.worker.unrolllist()
-
-        # get available jobs
-        if "list_jobs" in msg:
-            reply["job_list"] = self.list_available_jobs()
-
-        if "list_parameters" in msg:
-            reply["parameter_list"] = self.list_available_parameters()
-
-        # manipulate queue
-        if "move_job" in msg:
-            try:
-                # obtain reference to instance
-                logging.debug("Trying to move Job")
-                reply["move_job"] = self.worker.movejob(self.worker.id2job(msg["move_job"][0]),msg["move_job"][1])
-                logging.debug("Moved Job")
-            except pymException.pymJobRunning:
-                reply["error"] = "Can't move running job or swap with one"
-                reply["move_job"] = False
-            except pymException.pymJobNonMutable:
-                reply["error"] = "Can't move job, it is immutable."
-                reply["move_job"] = False
-            except pymException.pymJobNotFound:
-                reply["error"] = "Referenced job not found."
-                reply["move_job"] = False
-            except pymException.pymJobNotExist:
-                reply["error"] = "Job doesn't exist."
-                reply["move"] = False
-            except AttributeError:
-                reply["error"] = "Supplied parameter out of bounds"
-                reply["move"] = False
-
-        # add new job to end of some list
-        if "add_job_new" in msg:
-            try:
-                tref = None
-                logging.debug("Creating New Job")
-                if len(msg["add_job_new"])==2:
-                    # reference supplied, add it there
-                    try:
-                        # obtain referenced job instance
-                        tref = self.worker.id2job(msg["add_job_new"][1])
-                    except pymException.pymJobNotFound:
-                        reply["error"] = "Couldn't find reference to add Job to."
-                        reply["add_job_new"] = False
-                if "add_job_new" not in reply:
-                    tjob = self.createjob(msg["add_job_new"][0])
-                    if tjob is not None:
-                        logging.debug("Succesfully Created New Job")
-                        # now try to attatch the job somewhere
-                        if self.worker.appendjob(tjob,tref):
-                            logging.debug("Succesfully Added Job To List")
-                            reply["add_job_new"] = True
-            except pymException.pymJobNonMutable:
-                reply["error"] = "Can't add job to referenced job: reference is inmutable."
-                reply["add_job_new"] = False
-            except pymException.pymJobNotFound:
-                reply["error"] = "Referenced job not found."
-                reply["add_job_new"] = False
-            except pymException.pymJobNotExist:
-                reply["error"] = "Job can't be created: Job doesn't exist."
-                reply["add_job_new"] = False
-
-        # add new job after a referenced job
-        if "add_job_new_after" in msg:
-            try:
-                logging.debug("Creating New Job")
-                if len(msg["add_job_new_after"])==2:
-                    try:
-                        # obtain referenced job instance
-                        tref = self.worker.id2job(msg["add_job_new_after"][1])
-                    except pymException.pymJobNotFound:
-                        reply["error"] = "Couldn't find reference to add Job to."
-                        reply["add_job_new_after"] = False
-                    else:
-                        # only create job if we found that reference
-                        tjob = self.createjob(msg["add_job_new_after"][0])
-                        logging.debug("Succesfully Created New Job")
-                        if (self.worker.insertjobafterref(tjob,tref)):
-                            logging.debug("Succesfully Added Job after Reference")
-                            reply["add_job_new_after"] = True
-
-                else:
-                    # someone made a mistake
-                    reply["error"] = "Protocol Error"
-                    reply["add_job_new_after"] = False
-            except pymException.pymJobNonMutable:
-                reply["error"] = "Can't add job to referenced job: reference is inmutable."
-                reply["add_job_new_after"] = False
-            except pymException.pymJobNotFound:
-                reply["error"] = "Referenced job not found."
-                reply["add_job_new_after"] = False
-            except pymException.pymJobNotExist:
-                reply["error"] = "Job can't be created: Job doesn't exist."
-                reply["add_job_new_after"] = False
-
-        # add a pickled job at the end of a list
-        if "add_job_pickle" in msg:
-            try:
-                tref = None
-                logging.debug("Unpickle Job")
-                if len(msg["add_job_pickle"])==2:
-                    # reference supplied, add it there
-                    try:
-                        # obtain referenced job instance
-                        tref = self.worker.id2job(msg["add_job_pickle"][1])
-                    except pymException.pymJobNotFound:
-                        reply["error"] = "Couldn't find reference to add Job to."
-                        reply["add_job_pickle"] = False
-                        tjob = None
-                if not "add_job_pickle" in reply:
-                    # no errors so far
-                    tjob = self.unpicklejob(msg["add_job_pickle"][0])
-                    if tjob is not None:
-                        logging.debug("Succesfully Unpickled Job")
-                        # now try to attatch the job somewhere
-                        if self.worker.appendjob(tjob,tref):
-                            logging.debug("Succesfully Added Job To List")
-                            reply["add_job_pickle"] = True
-            except pymException.pymJobNonMutable:
-                reply["error"] = "Can't add job to referenced job: reference is inmutable."
-                reply["add_job_pickle"] = False
-            except pymException.pymJobNotFound:
-                reply["error"] = "Referenced job not found."
-                reply["add_job_pickle"] = False
-            except pymException.pymJobNotExist:
-                reply["error"] = "Job can't be created: Job doesn't exist."
-                reply["add_job_pickle"] = False
-
-        # add a pickled job after a referenced job
-        if "add_job_pickle_after" in msg:
-            try:
-                logging.debug("Unpickle Job")
-                if len(msg["add_job_pickle_after"])==2:
-                    try:
-                        # obtain referenced job instance
-                        tref = self.worker.id2job(msg["add_job_pickle_after"][1])
-                    except pymException.pymJobNotFound:
-                        reply["error"] = "Couldn't find reference to add Job to."
-                        reply["add_job_pickle_after"] = False
-                    else:
-                        # only create job if we found that reference
-                        tjob = self.unpicklejob(msg["add_job_pickle_after"][0])
-                        logging.debug("Succesfully Unpickled Job")
-                        if (self.worker.insertjobafterref(tjob,tref)):
-                            logging.debug("Succesfully Added Job after Reference")
-                            reply["add_job_pickle_after"] = True
-
-                else:
-                    # someone made a mistake
-                    reply["error"] = "Protocol Error"
-                    reply["add_job_pickle_after"] = False
-            except pymException.pymJobNonMutable:
-                reply["error"] = "Can't add job to referenced job: reference is inmutable."
-                reply["add_job_pickle_after"] = False
-            except pymException.pymJobNotFound:
-                reply["error"] = "Referenced job not found."
-                reply["add_job_pickle_after"] = False
-            except pymException.pymJobNotExist:
-                reply["error"] = "Job can't be created: Job doesn't exist."
-                reply["add_job_pickle_after"] = False
-
-
-
-        # delete job
-        if "delete_job" in msg:
-            try:
-                logging.debug("Getting Reference to Job")
-                tjob = self.worker.id2job(msg["delete_job"])
-                reply["delete_job"] = self.worker.deletejob(tjob)
-            except (pymException.pymJobNotFound, pymException.pymJobNotExist):
-                reply["error"] = "Can't delete job: Referenced Job not Found!"
-                reply["delete_job"] = False
-            except pymException.pymJobRunning:
-                reply["error"] = "Can't delete job: Job is currently running!"
-                reply["delete_job"] = False
-            except pymException.pymJobNonMutable:
-                reply["error"] = "Can't delete job: Parent Job marks it as inmutable."
-                reply["delete_job"] = False
-
-
-        if "get_settings" in msg:
-            try:
-                tref = self.worker.id2job(msg["get_settings"])
-                reply["get_settings"] = tref.getsettings()
-            except (pymException.pymJobNotFound, pymException.pymJobNotExist):
-                reply["error"] = "Can't get settings: Referenced Job not Found!"
-                reply["get_settings"] = False
-            except pymException.pymJobRunning:
-                reply["error"] = "Can't get settings: Job is currently running!"
-                reply["get_settings"] = False
-            except NotImplementedError:
-                reply["error"] = "Can't get settings: Job has no settings!"
-                reply["get_settings"] = False
-
-        if "update_settings" in msg:
-            try:
-                tref = self.worker.id2job(msg["update_settings"][0])
-                reply["update_settings"] = tref.updatejob(msg["update_settings"][1])
-            except (pymException.pymJobNotFound, pymException.pymJobNotExist):
-                reply["error"] = "Can't set settings: Referenced Job not Found!"
-                reply["get_settings"] = False
-            except pymException.pymJobRunning:
-                reply["error"] = "Can't set settings: Job is currently running!"
-                reply["get_settings"] = False
-            except pymException.pymOutOfBound:
-                reply["error"] = "Can't set settings: Parameter out of bound!"
-                reply["get_settings"] = False
-            except NotImplementedError:
-                reply["error"] = "Can't set settings: Job has no settings!"
-                reply["get_settings"] = False
-            except (AttributeError, TypeError):
-                reply["error"] = "Can't set settings: Faulty settings supplied!"
-                reply["get_settings"] = False
-            except IndexError:
-                reply["error"] = "Can't set settings: Faulty settings supplied!"
-                reply["get_settings"] = False
-
-        # pickle existing job
-        if "save_job" in msg:
+        binary = pymWire.is_binary(body)
+        try:
+            if binary:
+                msg = pymWire.unpack(body)
+            else:
+                msg = json.loads(body[0].bytes.decode('utf8'))
+            if not isinstance(msg, dict):
+                raise ValueError("message is not a dict")
+        except (UnicodeDecodeError, ValueError, KeyError, TypeError) as exc:
+            logging.debug("Error in receiving Message: %s" % exc)
+            reply = {"error": "Can't decode message: %s" % exc}
+        else:
+            logging.debug("Received Message from RPC, going to process")
             try:
-                logging.debug("Saving Job as a pickle")
-                tjob = self.worker.id2job(msg["save_job"])
-            except (pymException.pymJobNotFound, pymException.pymJobNotExist):
-                reply["error"] = "Can't save job: Referenced Job not Found!"
+                reply = await self.process_rpc(msg)
+            except Exception as exc:
+                # the client waits for an answer in any case
+                logging.exception("Processing of RPC Message failed")
+                reply = {"error": "Processing failed: %s" % exc}
+        logging.debug("Processing of RPC Message done, going to send reply")
+        try:
+            if binary:
+                frames = pymWire.pack(reply)
             else:
-                try:
-                    reply["save_job"] = pickle.dumps(tjob)
-                except pickle.PickleError as err:
-                    reply["error"] = "Job can't be pickled. Ask a developer."
-                    logging.warning("Couldn't pickle job %s: %s" % (tjob, err))
-                    reply["save_job"] = False
-
+                # turning arrays into lists is slow, keep it off the event loop
+                frames = [await self.offload(pymWire.to_json, reply)]
+        except Exception as exc:
+            logging.exception("Encoding of RPC reply failed")
+            error = {"error": "Can't encode reply: %s" % exc}
+            frames = pymWire.pack(error) if binary else [json.dumps(error).encode('utf8')]
+        await sock.send_multipart(envelope + frames, copy=False)
+
+    async def offload(self, func, *args):
         """
-        Journal related commands
+        Run a blocking function (journal queries, array conversion) on the thread pool, so the event loop keeps
+        serving the worker and other requests meanwhile
         """
+        return await asyncio.get_event_loop().run_in_executor(self.executor, functools.partial(func, *args))
 
-        if "create_new_database" in msg:
-            """
-            Creates new database file and uses it, requires main loop to be stopped
-            """
-            pass
-
-        if "load_database" in msg:
-            """
-            Loads an existing database file and uses it, requires main loop to be stopped
-            """
-            pass
-
-        if "archive_database" in msg:
-            """
-            Transform existing database to long term storage file, requires main loop to be stopped
-            """
-            pass
-
-        if "delete_database" in msg:
-            """
-            Delete database file on disk. Requires main loop to be stopped and a flag to be set in the pymaspd settings
-            """
-            pass
-
-        if "list_experiments" in msg:
-            """
-            Return a list of experiments from the current database
-            """
-            pass
-
-        if "list_jobs" in msg:
-            """
-            Return a list of all jobs from the current database. Expert option, requires a flag to be set in the pymaspd settings
-            """
-            pass
-
-        if "get_1d_data" in msg:
-            """
-            Try to obtain a 1d representation of data associated with supplied job/experiment
-            """
-            pass
-
-        if "get_2d_data" in msg:
-            """
-            Try to obtain a 2d representation of data associated with supplied job/experiment
-            """
-            pass
-
-        if "get_full_data" in msg:
-            """
-            Try to obtain all data associated with supplied job/experiment and return it as raw as possible
-            """
-            pass
-
-
-
-        #TODO: Labbook functions...
-
+    async def process_rpc(self, msg):
         """
-        Daemon related commands
+        Process Messages from RPC. msg is built as a dict containing the command as the key and the payload as value,
+        or is a batch of commands, see pymRPC.
+        :param msg:
+        :return:
         """
+        logging.debug(msg)
+        return await self.dispatcher.process(msg)
 
-        #TODO
+    """
+    Worker related commands
+    """
 
-        # respond to a ping
-        if "ping" in msg:
-            reply["pong"]= self.version
+    # pause or continue worker loop
+    @pymRPC.command("start", reply_key=False)
+    def rpc_start(self, payload):
+        self.worker.paused = False
+
+    @pymRPC.command("pause", reply_key=False)
+    def rpc_pause(self, payload):
+        self.worker.paused = True
+
+    # list jobs in queue
+    @pymRPC.command("get_job_queue", reply_key=("job_queue", "job_queue_revision"))
+    def rpc_get_job_queue(self, payload):
+        return self.worker.unrolllist(), self.worker.revision
+
+    # changes of the queue since the revision the client knows
+    @pymRPC.command("get_job_queue_diff")
+    def rpc_get_job_queue_diff(self, payload):
+        return self.worker.queue_diff(payload)
+
+    # get available jobs
+    @pymRPC.command("list_jobs", reply_key="job_list")
+    def rpc_list_jobs(self, payload):
+        return self.list_available_jobs()
+
+    @pymRPC.command("list_parameters", reply_key="parameter_list")
+    def rpc_list_parameters(self, payload):
+        return self.list_available_parameters()
+
+    # manipulate queue
+    @pymRPC.command("move_job", errors={
+        pymException.pymJobRunning: "Can't move running job or swap with one",
+        pymException.pymJobNonMutable: "Can't move job, it is immutable.",
+        pymException.pymJobNotFound: "Referenced job not found.",
+        pymException.pymJobNotExist: "Job doesn't exist.",
+        AttributeError: "Supplied parameter out of bounds"})
+    def rpc_move_job(self, payload):
+        return self.worker.movejob(self.worker.id2job(payload[0]), payload[1])
+
+    _add_job_errors = {
+        pymException.pymJobNonMutable: "Can't add job to referenced job: reference is inmutable.",
+        pymException.pymJobNotFound: "Referenced job not found.",
+        pymException.pymJobNotExist: "Job can't be created: Job doesn't exist."}
+
+    def _add_job(self, make, payload, after):
+        """
+        Create a job and add it to the queue
+        :param make: creates the job from payload[0]
+        :param payload: [job, reference id], the reference is optional unless after is set
+        :param after: insert the job after the reference instead of appending it to the reference (or the queue)
+        :return: True if the job was added
+        """
+        if after and len(payload) != 2:
+            raise ValueError("reference job required")
+        # find the reference before creating the job
+        tref = self.worker.id2job(payload[1]) if len(payload) == 2 else None
+        tjob = make(payload[0])
+        logging.debug("Succesfully Created New Job")
+        if after:
+            return self.worker.insertjobafterref(tjob, tref)
+        return self.worker.appendjob(tjob, tref)
+
+    # add new job to end of some list
+    @pymRPC.command("add_job_new", errors=_add_job_errors)
+    def rpc_add_job_new(self, payload):
+        return self._add_job(self.createjob, payload, after=False)
+
+    # add new job after a referenced job
+    @pymRPC.command("add_job_new_after", errors=_add_job_errors)
+    def rpc_add_job_new_after(self, payload):
+        return self._add_job(self.createjob, payload, after=True)
+
+    # add a pickled job at the end of a list
+    @pymRPC.command("add_job_pickle", errors=_add_job_errors)
+    def rpc_add_job_pickle(self, payload):
+        return self._add_job(self.unpicklejob, payload, after=False)
+
+    # add a pickled job after a referenced job
+    @pymRPC.command("add_job_pickle_after", errors=_add_job_errors)
+    def rpc_add_job_pickle_after(self, payload):
+        return self._add_job(self.unpicklejob, payload, after=True)
+
+    _template_errors = dict(_add_job_errors)
+    _template_errors.update({
+        pymException.pymTemplateError: "Can't create job from template: {}",
+        KeyError: "Can't create job from template: faulty template, missing {}"})
+
+    # add the job tree of a template (name of a stored template or the template itself) at the end of a list
+    @pymRPC.command("add_job_template", errors=_template_errors)
+    def rpc_add_job_template(self, payload):
+        return self._add_job(pymTemplate.instantiate, payload, after=False)
+
+    # add the job tree of a template after a referenced job
+    @pymRPC.command("add_job_template_after", errors=_template_errors)
+    def rpc_add_job_template_after(self, payload):
+        return self._add_job(pymTemplate.instantiate, payload, after=True)
+
+    # delete job
+    @pymRPC.command("delete_job", errors={
+        pymException.pymJobNotFound: "Can't delete job: Referenced Job not Found!",
+        pymException.pymJobNotExist: "Can't delete job: Referenced Job not Found!",
+        pymException.pymJobRunning: "Can't delete job: Job is currently running!",
+        pymException.pymJobNonMutable: "Can't delete job: Parent Job marks it as inmutable."})
+    def rpc_delete_job(self, payload):
+        return self.worker.deletejob(self.worker.id2job(payload))
+
+    @pymRPC.command("get_settings", errors={
+        pymException.pymJobNotFound: "Can't get settings: Referenced Job not Found!",
+        pymException.pymJobNotExist: "Can't get settings: Referenced Job not Found!",
+        pymException.pymJobRunning: "Can't get settings: Job is currently running!",
+        NotImplementedError: "Can't get settings: Job has no settings!"})
+    def rpc_get_settings(self, payload):
+        return self.worker.id2job(payload).getsettings()
+
+    @pymRPC.command("update_settings", errors={
+        pymException.pymJobNotFound: "Can't set settings: Referenced Job not Found!",
+        pymException.pymJobNotExist: "Can't set settings: Referenced Job not Found!",
+        pymException.pymJobRunning: "Can't set settings: Job is currently running!",
+        pymException.pymOutOfBound: "Can't set settings: Parameter out of bound!",
+        NotImplementedError: "Can't set settings: Job has no settings!",
+        AttributeError: "Can't set settings: Faulty settings supplied!",
+        TypeError: "Can't set settings: Faulty settings supplied!",
+        IndexError: "Can't set settings: Faulty settings supplied!"})
+    def rpc_update_settings(self, payload):
+        return self.worker.updatejob(self.worker.id2job(payload[0]), payload[1])
+
+    # pickle existing job, binary clients get the raw pickle and JSON clients base64
+    @pymRPC.command("save_job", errors={
+        pymException.pymJobNotFound: "Can't save job: Referenced Job not Found!",
+        pymException.pymJobNotExist: "Can't save job: Referenced Job not Found!",
+        pickle.PickleError: "Job can't be pickled. Ask a developer."})
+    def rpc_save_job(self, payload):
+        logging.debug("Saving Job as a pickle")
+        return pickle.dumps(self.worker.id2job(payload))
+
+    # store the template of an existing job tree by name: [job id, name]
+    @pymRPC.command("save_template", errors={
+        pymException.pymJobNotFound: "Can't save template: Referenced Job not Found!",
+        pymException.pymJobNotExist: "Can't save template: Referenced Job not Found!",
+        sqlite3.Error: "Can't save template: {}"})
+    def rpc_save_template(self, payload):
+        pymTemplate.save(payload[1], self.worker.id2job(payload[0]))
+        return True
+
+    # the template of an existing job tree, without storing it
+    @pymRPC.command("dump_template", errors={
+        pymException.pymJobNotFound: "Can't dump template: Referenced Job not Found!",
+        pymException.pymJobNotExist: "Can't dump template: Referenced Job not Found!"})
+    def rpc_dump_template(self, payload):
+        return pymTemplate.dump(self.worker.id2job(payload))
+
+    @pymRPC.command("get_template", errors={
+        pymException.pymTemplateError: "{}",
+        sqlite3.Error: "Can't get template: {}"})
+    def rpc_get_template(self, payload):
+        return pymTemplate.get(payload)
+
+    @pymRPC.command("list_templates", errors={sqlite3.Error: "Can't list templates: {}"})
+    async def rpc_list_templates(self, payload):
+        # templates saved just before may still be queued for the writer
+        await self.offload(pymJournal.sync)
+        return [{"name": row["name"], "date": row["date"].replace(tzinfo=timezone.utc).timestamp(),
+                 "version": row["version"]} for row in pymJournal.list_templates()]
+
+    @pymRPC.command("delete_template", errors={sqlite3.Error: "Can't delete template: {}"})
+    def rpc_delete_template(self, payload):
+        pymTemplate.delete(payload)
+        return True
 
-        # respond to special ping
-        if "workerping" in msg:
-            reply["workerpong"] = self.worker.get_version()
+    """
+    Journal related commands
+    """
 
-        if "shutdown" in msg:
-            logging.debug("Received Shutdown Signal")
-            self.shutdown = True
-            reply["shutdown"] = "Goodbye"
-        #TODO we should evaluate errors up until here and then include them in the error field
+    #TODO: create_new_database: Creates new database file and uses it, requires main loop to be stopped
+    #TODO: load_database: Loads an existing database file and uses it, requires main loop to be stopped
+    #TODO: archive_database: Transform existing database to long term storage file, requires main loop to be stopped
+    #TODO: delete_database: Delete database file on disk. Requires main loop to be stopped and a flag to be set in the
+    # pymaspd settings
+
+    # Return a list of experiments from the current database
+    @pymRPC.command("list_experiments", errors={
+        sqlite3.Error: "Can't list experiments: {}",
+        ValueError: "Can't list experiments: {}",
+        TypeError: "Can't list experiments: {}"})
+    async def rpc_list_experiments(self, payload):
+        return await self.offload(self._list_journal, pymJournal.list_experiments, payload)
+
+    # Return a list of all jobs from the current database. Expert option, requires a flag to be set in the pymaspd
+    # settings
+    @pymRPC.command("list_journal_jobs", errors={
+        PermissionError: "{}",
+        sqlite3.Error: "Can't list jobs: {}",
+        ValueError: "Can't list jobs: {}",
+        TypeError: "Can't list jobs: {}"})
+    async def rpc_list_journal_jobs(self, payload):
+        if not self.expert_mode:
+            raise PermissionError("Listing journal jobs requires expert mode.")
+        return await self.offload(self._list_journal, pymJournal.list_jobs, payload)
+
+    # Try to obtain a 1d representation of data associated with supplied job/experiment
+    @pymRPC.command("get_1d_data", errors={
+        sqlite3.Error: "Can't obtain 1d data: {}",
+        ValueError: "Can't obtain 1d data: {}",
+        TypeError: "Can't obtain 1d data: {}"})
+    async def rpc_get_1d_data(self, payload):
+        job_id, decimate = self._data_request(payload, 1)
+        return await self.offload(self._1d_data, job_id, decimate)
+
+    # Try to obtain a 2d representation of data associated with supplied job/experiment
+    @pymRPC.command("get_2d_data", errors={
+        sqlite3.Error: "Can't obtain 2d data: {}",
+        ValueError: "Can't obtain 2d data: {}",
+        TypeError: "Can't obtain 2d data: {}"})
+    async def rpc_get_2d_data(self, payload):
+        job_id, decimate = self._data_request(payload, (1, 1))
+        if isinstance(decimate, int):
+            decimate = (decimate, decimate)
+        return await self.offload(self._2d_data, job_id, tuple(decimate))
+
+    # Try to obtain the n-dimensional representation of data recorded by a grid job
+    @pymRPC.command("get_grid_data", errors={
+        sqlite3.Error: "Can't obtain grid data: {}",
+        ValueError: "Can't obtain grid data: {}",
+        TypeError: "Can't obtain grid data: {}",
+        IndexError: "Can't obtain grid data: {}"})
+    async def rpc_get_grid_data(self, payload):
+        job_id, decimate = self._data_request(payload, None)
+        return await self.offload(self._grid_data, job_id, decimate)
+
+    # Try to obtain all data associated with supplied job/experiment and return it as raw as possible
+    @pymRPC.command("get_full_data", errors={
+        sqlite3.Error: "Can't obtain data: {}",
+        ValueError: "Can't obtain data: {}",
+        TypeError: "Can't obtain data: {}"})
+    async def rpc_get_full_data(self, payload):
+        return await self.offload(pymJournal.get_full_data, payload)
+
+    #TODO: Labbook functions...
 
+    """
+    Daemon related commands
+    """
 
-        return reply
+    # respond to a ping
+    @pymRPC.command("ping", reply_key="pong")
+    def rpc_ping(self, payload):
+        return self.version
+
+    # respond to special ping
+    @pymRPC.command("workerping", reply_key="workerpong")
+    def rpc_workerping(self, payload):
+        return self.worker.get_version()
+
+    # calls and total processing time in seconds of each command
+    @pymRPC.command("rpc_stats")
+    def rpc_stats(self, payload):
+        return {name: {"calls": calls, "time": total} for name, (calls, total) in self.dispatcher.timing.items()}
+
+    # devices in the pool with their references and idle time
+    @pymRPC.command("list_devices", reply_key="device_list")
+    def rpc_list_devices(self, payload):
+        return pymDevices.stats()
+
+    @pymRPC.command("shutdown")
+    def rpc_shutdown(self, payload):
+        logging.debug("Received Shutdown Signal")
+        self.shutdown = True
+        return "Goodbye"
+
+    def _list_journal(self, func, payload):
+        """
+        Paginated listing. payload is a dict with the optional keys after (cursor), limit, time_range and columns
+        :return: {'rows': [...], 'cursor': cursor for the next page or None}
+        """
+        if not isinstance(payload, dict):
+            payload = {}
+        limit = payload.get("limit", self.list_page_size)
+        if not isinstance(limit, int) or isinstance(limit, bool):
+            raise ValueError("limit has to be an integer")
+        # a page holds at least one row, or the cursor could never move on
+        limit = max(1, min(limit, self.list_page_size_max))
+        rows, cursor = func(payload.get("time_range"), payload.get("after"), limit, payload.get("columns"))
+        res = []
+        for row in rows:
+            entry = dict(row)
+            if isinstance(entry.get("date"), datetime):
+                entry["date"] = entry["date"].replace(tzinfo=timezone.utc).timestamp()
+            res.append(entry)
+        return {"rows": res, "cursor": cursor}
+
+    # data replies, these run on the thread pool. Arrays are sent raw to binary clients and as lists to JSON clients
+    @staticmethod
+    def _1d_data(job_id, decimate):
+        axis, data = pymJournal.get_1d_data(job_id, decimate)
+        return {"axis": axis, "data": data}
+
+    @staticmethod
+    def _2d_data(job_id, decimate):
+        axis0, axis1, data = pymJournal.get_2d_data(job_id, decimate)
+        return {"axis": [axis0, axis1], "data": data}
+
+    @staticmethod
+    def _grid_data(job_id, decimate):
+        axes, data = pymJournal.get_grid_data(job_id, decimate)
+        return {"axis": list(axes), "data": data}
+
+    @staticmethod
+    def _data_request(payload, decimate):
+        """
+        Data requests are either a journal id, [journal id] or [journal id, decimation]. The decimation is a positive
+        int or a list of them, one per axis.
+        :param decimate: decimation if the request has none or None
+        :return: journal id, decimation
+        """
+        if isinstance(payload, (list, tuple)):
+            if not 1 <= len(payload) <= 2:
+                raise ValueError("Expected [journal id] or [journal id, decimation], got %d values" % len(payload))
+            if len(payload) == 2 and payload[1] is not None:
+                decimate = payload[1]
+            payload = payload[0]
+        if not isinstance(payload, int) or isinstance(payload, bool):
+            raise ValueError("Journal id has to be an int, not %r" % (payload,))
+        steps = decimate if isinstance(decimate, (list, tuple)) else [decimate]
+        if decimate is not None and \
+                not all(isinstance(n, int) and not isinstance(n, bool) and n >= 1 for n in steps):
+            raise ValueError("Decimation has to be a positive int per axis, not %r" % (decimate,))
+        return payload, decimate
 
     async def worker_loop(self):
         while not self.shutdown:
             await self.worker.job_loop()
 
+    async def device_loop(self):
+        # unload devices which have not been used for a while
+        while not self.shutdown:
+            await asyncio.sleep(1)
+            pymDevices.reap()
+
 
 if __name__ == "__main__":
     proc = pymaspd()
@@ -1,9 +1,13 @@
 import asyncio
 import logging
+import weakref
+import collections
+from datetime import datetime
 import pymJournal
 import pymException
+import pymEvents
 
-from pymJob import pymJob
+from pymJob import pymJob, pymJobFactory
 
 
 class pymaspd_worker:
@@ -13,10 +17,16 @@ class pymaspd_worker:
     def __init__(self):
         self.version = "pymaspd Worker 0.1"
         self.joblist = []
-        self.global_devices_instances = []
-        self.job_lut = []
+        # id -> job for every job in the queue, including nested ones
+        self.job_lut = weakref.WeakValueDictionary()
         self.shutdown = False
 
+        # every change of the queue increases the revision, clients can ask for the changes since theirs
+        self.revision = 0
+        self.changes = collections.deque(maxlen=1000)
+        self._unrolled = None
+        self._unrolled_revision = None
+
         #start paused
         self.paused = True
 
@@ -28,8 +38,41 @@ class pymaspd_worker:
         Unroll the JobList to display and edit it.
         :return: [JobDictionary]
         """
-        logging.debug("Unrolling list")
-        return [self.genjobdictionary(job) for job in self.joblist]
+        if self._unrolled_revision != self.revision:
+            logging.debug("Unrolling list")
+            self._unrolled = [self.genjobdictionary(job) for job in self.joblist]
+            self._unrolled_revision = self.revision
+        return self._unrolled
+
+    def queue_changed(self, change, job, **info):
+        """
+        Record a change of the queue
+        :param change: one of added, removed, moved, settings, state
+        :param job: Instance of pymJob which changed
+        :param info: further details of the change
+        """
+        # describe the job first, if that fails the revision must not move on without its entry
+        entry = {"change": change, "id": job.jobid}
+        if change in ("added", "settings"):
+            entry["job"] = self.genjobdictionary(job)
+        entry.update(info)
+        self.revision += 1
+        entry["revision"] = self.revision
+        self.changes.append(entry)
+        pymEvents.publish("queue", {"revision": self.revision, "change": change, "id": job.jobid})
+
+    def queue_diff(self, since=None):
+        """
+        Changes of the queue since a revision the client knows
+        :param since: revision of the client, None for the full queue
+        :return: {'revision': current revision, 'changes': [changes]} or {'revision':..., 'full': unrolled list} if
+                 the changes since that revision aren't known anymore
+        """
+        if since == self.revision:
+            return {"revision": self.revision, "changes": []}
+        if since is None or since > self.revision or not self.changes or since < self.changes[0]["revision"] - 1:
+            return {"revision": self.revision, "full": self.unrolllist()}
+        return {"revision": self.revision, "changes": [c for c in self.changes if c["revision"] > since]}
 
     def genjobdictionary(self, job):
         """
@@ -43,51 +86,75 @@ class pymaspd_worker:
         :param pynJob:
         :return:
         """
-        logging.debug("Generating Entry for Job %s", job)
         if job is not None and isinstance(job, pymJob):
             try:
                 # ask the Job element on the list to give us its description an child elements
                 description, subjob = job.description()
-                logging.debug("Got description and subjob list")
             except AttributeError:
                 # couldn't call description(), maybe it's not a Job? Return an empty element.
                 return {"type": None, "description": None, "child": None, "mutable": False, "running": False}
 
-            answ_dict = {"type": type(job).__name__, "description": description, "child": [self.genjobdictionary(sj) for sj in subjob], "mutable": job.ismutable(), "running": job.isrunning(), "id": job.jobid}
-            logging.debug("Reply dict: {}".format(answ_dict))
-
+            answ_dict = {"type": type(job).__name__, "description": description, "child": [self.genjobdictionary(sj) for sj in subjob or []], "mutable": job.ismutable(), "running": job.isrunning(), "id": job.jobid}
             return answ_dict
         else:
-            logging.debug("Element is not a valid Job or list is empty")
             return {}
 
     def id2job(self, id):
         """
-        Traverses the job list to find the job with supplied id.
-        Future versions of this functions may use a LUT to find id before traversing the list
+        Look up the job with supplied id in the queue, including nested jobs
         """
-        for job in self.joblist:
-            if job.jobid is id:
-                return job
-            else:
-                tjob = self._traverse_id2job(job, id)
-                if tjob is not None:
-                    return tjob
-        logging.warning("Referenced Job does not exist")
-        raise pymException.pymJobNotFound
+        try:
+            return self.job_lut[id]
+        except (KeyError, TypeError):
+            logging.warning("Referenced Job does not exist")
+            raise pymException.pymJobNotFound
 
-    def _traverse_id2job(self,job_ref, id):
+    @staticmethod
+    def _subjobs(job):
+        try:
+            return [sj for sj in job.get_subjobs() or [] if isinstance(sj, pymJob)]
+        except (AttributeError, NotImplementedError):
+            # job isn't configured enough to tell
+            return []
+
+    def _walk(self, job):
         """
-        Subfunction of id2job to recursivly traverse subjobs
+        Yield job and all its nested jobs
         """
-        for job in job_ref.get_subjoblist:
-            if job.jobid is id:
-                return job
-            else:
-                tjob = self._traverse_id2job(job, id)
-                if tjob is not None:
-                    return tjob
-        return None
+        yield job
+        for sj in self._subjobs(job):
+            yield from self._walk(sj)
+
+    def _index(self, job):
+        for tjob in self._walk(job):
+            if self.job_lut.get(tjob.jobid, tjob) is not tjob:
+                logging.warning("Job id %s is used twice, assigning a new one" % tjob.jobid)
+                tjob.jobid = pymJobFactory.newJobId()
+            self.job_lut[tjob.jobid] = tjob
+
+    def _unindex(self, job):
+        for tjob in self._walk(job):
+            if self.job_lut.get(tjob.jobid) is tjob:
+                del self.job_lut[tjob.jobid]
+
+    def reindex(self, job, old_jobs=()):
+        """
+        Update the index after the nested jobs of job changed
+        :param job: Instance of pymJob
+        :param old_jobs: nested jobs before the change
+        """
+        current = set(map(id, self._walk(job)))
+        for tjob in old_jobs:
+            if id(tjob) not in current and self.job_lut.get(tjob.jobid) is tjob:
+                del self.job_lut[tjob.jobid]
+        self._index(job)
+
+    def renumber(self, job):
+        """
+        Give a job and all its nested jobs new ids, eg. after unpickling
+        """
+        for tjob in self._walk(job):
+            tjob.jobid = pymJobFactory.newJobId()
 
     """
     Modify the job list
@@ -102,15 +169,21 @@ class pymaspd_worker:
         """
         if refjob is None:
             self.joblist.append(newjob)
+            self._index(newjob)
+            self.queue_changed("added", newjob, parent=None)
             return True
         else:
             # we need to insert the job into a sublist
             # we should check that referenced object is actually a job...
             if refjob is not None and isinstance(refjob, pymJob):
-                if refjob.ismutable:
+                if refjob.ismutable():
                     # since we directly call refjob, we don't need to walk any lists, but can
                     # tell it directly to insert newjob
-                    return refjob.appendjob(newjob)
+                    if refjob.appendjob(newjob):
+                        self._index(newjob)
+                        self.queue_changed("added", newjob, parent=refjob.jobid)
+                        return True
+                    return False
                 else:
                     logging.warning("Can't insert Job into non mutable")
                     raise pymException.pymJobNonMutable
@@ -139,10 +212,14 @@ class pymaspd_worker:
                 # We're only checking our main list here, which is always mutable, so no need to check!
                 # Found job in main list, delete it from here
                 self.joblist.remove(job)
+                self._unindex(refjob)
+                self.queue_changed("removed", refjob)
                 return True
-            if job.ismutable:
+            if job.ismutable():
                 # refjob might be in sublist and deletable, call job's own procedure to find it
-                if job.deleteJob(refjob):
+                if job.deletejob(refjob):
+                    self._unindex(refjob)
+                    self.queue_changed("removed", refjob)
                     return True
         # None of the above, issue a warning
         logging.warning("Referenced Job not found")
@@ -163,10 +240,14 @@ class pymaspd_worker:
             if job is refjob:
                 # Found refjob in main list, add newjob after
                 self.joblist.insert(self.joblist.index(job)+1, newjob)
+                self._index(newjob)
+                self.queue_changed("added", newjob, after=refjob.jobid)
                 return True
-            elif job.ismutable:
+            elif job.ismutable():
                 # refjob might be in a mutable sublist, call job's own procedure to find it
                 if job.insertjobafter(newjob, refjob):
+                    self._index(newjob)
+                    self.queue_changed("added", newjob, after=refjob.jobid)
                     return True
         # None of the above, issue a warning
         logging.warning("Referenced Job not found")
@@ -183,7 +264,15 @@ class pymaspd_worker:
             logging.warning("Referenced Job does not exist")
             return False
 
-        return refjob.updatejob(*args)
+        # settings may replace nested jobs, keep the index up to date
+        old_jobs = list(self._walk(refjob))
+        try:
+            res = refjob.updatejob(*args)
+        finally:
+            self.reindex(refjob, old_jobs)
+        if res:
+            self.queue_changed("settings", refjob)
+        return res
 
     def getsettings(self, refjob):
         """
@@ -213,27 +302,21 @@ class pymaspd_worker:
             # Our own list will always be mutable, but sublists will have to test for mutability!
             if job is refjob:
                 index = self.joblist.index(job)
-                if (index+n)<0 or (index+n)>len(self.joblist):
+                if (index+n)<0 or (index+n)>=len(self.joblist):
                     logging.warning("Supplied index out of bounds")
                     raise AttributeError
-                if self.joblist[index+n].istrunning():
+                if self.joblist[index+n].isrunning():
                     logging.warning("Can't mutate with running job")
                     raise pymException.pymJobRunning
-                # try to remove job from list
-                res = self.joblist.remove(job)
-                if not res:
-                    logging.warning("Couldn't move job")
-                    return False
-                # now insert the job at the new position
-                res = self.joblist.insert(index+n, job)
-                if res:
-                    return True
-                else:
-                    logging.warning("Couldn't reinsert job")
-                    return False
+                # remove job from list and insert it at the new position
+                self.joblist.remove(job)
+                self.joblist.insert(index+n, job)
+                self.queue_changed("moved", refjob, n=n)
+                return True
             # check if job could be in sublist
             elif job.ismutable():
                 if job.movejob(refjob, n):
+                    self.queue_changed("moved", refjob, n=n)
                     return True
         # loop finished without finding the reference
         logging.warning("Referenced Job not found")
@@ -257,14 +340,29 @@ class pymaspd_worker:
                 return
 
             self.current_job = self.joblist[0]
+            self.queue_changed("state", self.current_job, running=True)
+            pymEvents.publish("job_started", {"id": self.current_job.jobid,
+                                              "description": str(self.current_job.description()[0])})
+            # separate storage (e.g. chunk files) for every experiment
+            pymJournal.begin_experiment(datetime.utcnow().strftime("%Y%m%d_%H%M%S_") + type(self.current_job).__name__)
             # create a new experiment and root job entry for this job
             result = await self.current_job.run(None)
             if callable(result):
                 result = await result()
-            pymJournal.add_experiment(self.current_job.description()[0], result)
+            experiment_id = pymJournal.add_experiment(self.current_job.description()[0], result)
+            # end the experiment consistently: wait until the journal committed everything. The writer thread is
+            # waited for without blocking the loop, our own connection has to commit on this thread
+            if pymJournal.uses_writer():
+                await asyncio.get_event_loop().run_in_executor(None, pymJournal.flush)
+            else:
+                pymJournal.flush()
+            pymEvents.publish("job_finished", {"id": self.current_job.jobid, "journal_id": result,
+                                               "experiment_id": experiment_id})
 
             # remove job from list. Last reference will be self.current_job until the next one starts.
-            self.joblist.remove(0)
+            self.joblist.remove(self.current_job)
+            self._unindex(self.current_job)
+            self.queue_changed("removed", self.current_job)
         except asyncio.CancelledError:
             # implement shutdown if we cancel this
             #TODO
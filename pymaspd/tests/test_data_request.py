@@ -0,0 +1,31 @@
+"""
+Payload of the data requests (get_1d_data, get_2d_data, get_grid_data): malformed requests raise ValueError, which
+the handlers answer with an error message.
+Run from the pymaspd directory: python -m unittest discover -s tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymaspd import pymaspd
+
+
+class TestDataRequest(unittest.TestCase):
+
+    def test_requests(self):
+        self.assertEqual(pymaspd._data_request(5, 1), (5, 1))
+        self.assertEqual(pymaspd._data_request([5], (1, 1)), (5, (1, 1)))
+        self.assertEqual(pymaspd._data_request([5, None], None), (5, None))
+        self.assertEqual(pymaspd._data_request([5, 2], 1), (5, 2))
+        self.assertEqual(pymaspd._data_request((5, [2, 3]), (1, 1)), (5, [2, 3]))
+
+    def test_malformed_requests(self):
+        for payload in ([], [5, 2, 1], '5', 1.5, True, [None], [5, 0], [5, 'a'], [5, [1, 0]], [5, [1.5]]):
+            with self.subTest(payload=payload), self.assertRaises(ValueError):
+                pymaspd._data_request(payload, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+pymFlyScan against the simulated stage and detector: the parameter values interpolated for the frames have to follow
+the move over the whole range.
+Run from the pymaspd directory: python -m unittest discover -s tests
+"""
+import os
+import sys
+import json
+import shutil
+import asyncio
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pymJournal
+import pymFlyScan
+from pymJob import pymJobFactory
+
+
+class TestFlyScan(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # the pooled stage and its locks stay with one loop
+        cls.loop = asyncio.new_event_loop()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.loop.close()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        pymJournal.open(os.path.join(self.directory, 'journal.db'))
+        pymJournal.create_new_db()
+
+    def tearDown(self):
+        pymJournal.close()
+        shutil.rmtree(self.directory)
+
+    def fly(self, range_min, range_max, exposure=0.001):
+        """
+        :return: the scan and the parameter values of its frames, in the order they were taken
+        """
+        scan = pymJobFactory.createJob('pymFlyScan')
+        scan.updatejob({'parameter': 'dummy_parameter', 'range': (range_min, range_max), 'job': 'pynDummyDetector',
+                        'jobSettings': {'exposure': exposure}})
+        journal_id = self.loop.run_until_complete(scan.run(None))
+        values = [row['param_value'] for row in pymJournal.get_full_data(journal_id)
+                  if row['param_value'] is not None]
+        return scan, np.array(values)
+
+    def assertSpans(self, values, start, end):
+        # the first frames are taken right at the start, the last ones within a few frames of the end
+        tolerance = abs(end - start) * 0.05
+        self.assertGreater(len(values), 2)
+        self.assertLessEqual(abs(values[0] - start), tolerance)
+        self.assertLessEqual(abs(values[-1] - end), tolerance)
+
+    def test_values_follow_the_move(self):
+        scan, values = self.fly(0, 500)
+        self.assertTrue(np.all(np.diff(values) >= 0))
+        self.assertSpans(values, 0, 500)
+        self.assertLessEqual(values.max(), 500)
+
+    def test_move_backwards(self):
+        scan, values = self.fly(500, 0)
+        self.assertTrue(np.all(np.diff(values) <= 0))
+        self.assertSpans(values, 500, 0)
+
+    def test_readbacks_cover_all_frames(self):
+        scan, values = self.fly(0, 500)
+        job = pymJournal.get_job_details(scan.journal_id)[0]
+        # the journal entry keeps the readbacks as (time, position) and the frame times in its meta data
+        meta = json.loads(job['note'])
+        samples = pymJournal.get_data(job['assoc_data'])
+        self.assertEqual(samples[0, 1], 0)
+        self.assertEqual(samples[-1, 1], 500)
+        self.assertLess(samples[0, 0], min(meta['frame_times']))
+        self.assertGreater(samples[-1, 0], max(meta['frame_times']))
+        self.assertEqual(meta['unsampled_frames'], [])
+        self.assertEqual(meta['frames'], len(values))
+
+
+if __name__ == '__main__':
+    unittest.main()
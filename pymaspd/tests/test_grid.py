@@ -0,0 +1,81 @@
+"""
+pymGrid against the simulated stage and detector: the journal keeps the parameter tuples of the points apart from the
+measured data.
+Run from the pymaspd directory: python -m unittest discover -s tests
+"""
+import os
+import sys
+import json
+import shutil
+import asyncio
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pymJournal
+import pymException
+import pymGrid
+from pymJob import pymJobFactory
+
+
+class TestGrid(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # the pooled stage and its locks stay with one loop
+        cls.loop = asyncio.new_event_loop()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.loop.close()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        pymJournal.open(os.path.join(self.directory, 'journal.db'))
+        pymJournal.create_new_db()
+        self.grid = pymJobFactory.createJob('pymGrid')
+        self.grid.updatejob({'axes': [{'parameter': 'dummy_parameter', 'range': (0, 20), 'steps': 3},
+                                      {'parameter': 'dummy_parameter', 'channel': 1, 'range': (0, 10), 'steps': 2}],
+                             'job': 'pynDummyDetector'})
+
+    def tearDown(self):
+        pymJournal.close()
+        shutil.rmtree(self.directory)
+
+    def test_points_are_not_data(self):
+        journal_id = self.loop.run_until_complete(self.grid.run(None))
+        rows = pymJournal.get_full_data(journal_id)
+        # one frame of the detector per point, nothing else
+        self.assertEqual(len(rows), 6)
+        self.assertNotIn(journal_id, [row['job_id'] for row in rows])
+        self.assertTrue(all(row['data'].shape == (255,) for row in rows))
+        meta = json.loads(pymJournal.get_job_details(journal_id)[0]['note'])
+        self.assertEqual(len(meta['points']), 6)
+
+        axes, data = pymJournal.get_grid_data(journal_id)
+        self.assertEqual([axis.tolist() for axis in axes], [[0, 10, 20], [0, 10]])
+        self.assertEqual(data.shape, (3, 2, 255))
+        self.assertFalse(np.isnan(data).any())
+
+    def test_empty_axes(self):
+        with self.assertRaises(pymException.pymOutOfBound):
+            self.grid.updatejob({'axes': []})
+        self.assertEqual(len(self.grid.axes), 2)
+
+    def test_run_without_axes(self):
+        grid = pymJobFactory.createJob('pymGrid')
+        grid.updatejob({'job': 'pynDummyDetector'})
+        with self.assertRaises(pymException.pymJobException):
+            self.loop.run_until_complete(grid.run(None))
+
+    def test_run_with_axis_without_parameter(self):
+        self.grid.axes[1].parameter = None
+        with self.assertRaises(pymException.pymJobException):
+            self.loop.run_until_complete(self.grid.run(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
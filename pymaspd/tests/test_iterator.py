@@ -0,0 +1,73 @@
+"""
+pymIterator.updatejob: a rejected update leaves the job as it was, and the number of steps holds in every spacing.
+Run from the pymaspd directory: python -m unittest discover -s tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pymDevices
+import pymException
+import pymIterator
+from pymJob import pymJobFactory
+
+
+def refcount(name):
+    for device in pymDevices.stats():
+        if device['device'].endswith('.' + name):
+            return device['refcount']
+    return 0
+
+
+class TestIteratorUpdate(unittest.TestCase):
+
+    def setUp(self):
+        self.job = pymJobFactory.createJob('pymIterator')
+        self.job.updatejob({'parameter': 'dummy_parameter', 'range': (0, 20), 'stepsize': 4})
+
+    def tearDown(self):
+        pymDevices.release(self.job.parameter, owner=self.job)
+
+    def assertUnchanged(self, settings_dict):
+        before = (self.job.get_values(), self.job.getsettings()['range']['current'], self.job.spacing,
+                  self.job.repeats, self.job.parameter)
+        with self.assertRaises(pymException.pymOutOfBound):
+            self.job.updatejob(settings_dict)
+        after = (self.job.get_values(), self.job.getsettings()['range']['current'], self.job.spacing,
+                 self.job.repeats, self.job.parameter)
+        self.assertEqual(after, before)
+
+    def test_rejected_key_after_valid_ones(self):
+        self.assertUnchanged({'range': (5, 8), 'repeats': 3, 'ordering': 'nope'})
+
+    def test_rejected_log_range(self):
+        self.assertUnchanged({'range': (-5, 8), 'repeats': 3, 'spacing': 'log'})
+
+    def test_rejected_update_releases_new_parameter(self):
+        counts = (refcount('dummy_parameter'), refcount('dummy_xy_stage'))
+        self.assertUnchanged({'parameter': 'dummy_xy_stage', 'repeats': 3, 'spacing': 'log'})
+        self.assertEqual((refcount('dummy_parameter'), refcount('dummy_xy_stage')), counts)
+
+    def test_changed_parameter_releases_old_one(self):
+        counts = (refcount('dummy_parameter'), refcount('dummy_xy_stage'))
+        self.assertTrue(self.job.updatejob({'parameter': 'dummy_xy_stage'}))
+        self.assertEqual((refcount('dummy_parameter'), refcount('dummy_xy_stage')), (counts[0] - 1, counts[1] + 1))
+
+    def test_steps_in_step_spacing(self):
+        self.assertTrue(self.job.updatejob({'range': (0, 10), 'steps': 3}))
+        self.assertEqual(len(self.job.get_values()), 3)
+        # the number of steps is kept when the range changes
+        self.job.updatejob({'range': (0, 20)})
+        self.assertEqual(len(self.job.get_values()), 3)
+        self.assertLess(max(self.job.get_values()), 20)
+
+    def test_stepsize_replaces_steps(self):
+        self.job.updatejob({'steps': 3})
+        self.job.updatejob({'stepsize': 4})
+        self.assertEqual(self.job.get_values(), [0, 4, 8, 12, 16])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+"""
+Error path of the journal writer thread: a failing statement or a writer which couldn't start must surface as an
+exception of submit()/flush(), never as a flush() waiting forever.
+Run from the pymaspd directory: python -m unittest discover -s tests
+"""
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymJournal.writer import pymJournalWriter
+
+
+class Unstorable:
+    pass
+
+
+def adapt_unstorable(value):
+    raise TypeError("can't store %r" % value)
+
+
+sqlite3.register_adapter(Unstorable, adapt_unstorable)
+
+
+class TestJournalWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.directory, 'journal.db')
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''CREATE TABLE values_ (value)''')
+        conn.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def call(self, function, *args):
+        """
+        Call in a thread, so a hanging call fails the test instead of blocking it.
+        :return: the exception raised by the call, None if it returned
+        """
+        result = {}
+
+        def target():
+            try:
+                function(*args)
+            except Exception as err:
+                result['error'] = err
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive(), "%s didn't return" % function.__name__)
+        return result.get('error')
+
+    def stored(self):
+        conn = sqlite3.connect(self.db_path)
+        values = [row[0] for row in conn.execute('''SELECT value FROM values_''')]
+        conn.close()
+        return values
+
+    def test_adapter_error(self):
+        writer = pymJournalWriter(self.db_path)
+        writer.start()
+        writer.submit('''INSERT INTO values_ VALUES (?)''', (1,))
+        writer.submit('''INSERT INTO values_ VALUES (?)''', (Unstorable(),))
+        writer.submit('''INSERT INTO values_ VALUES (?)''', (2,))
+        self.assertIsInstance(self.call(writer.flush), TypeError)
+        # the error is raised once, the writer keeps going
+        self.assertTrue(writer.is_alive())
+        writer.submit('''INSERT INTO values_ VALUES (?)''', (3,))
+        self.assertIsNone(self.call(writer.flush))
+        writer.stop()
+        self.assertEqual(self.stored(), [1, 2, 3])
+
+    def test_writer_failed(self):
+        writer = pymJournalWriter(os.path.join(self.directory, 'missing', 'journal.db'))
+        writer.start()
+        writer.join(5)
+        self.assertFalse(writer.is_alive())
+        self.assertIsInstance(self.call(writer.flush), sqlite3.Error)
+        self.assertIsInstance(self.call(writer.submit, '''INSERT INTO values_ VALUES (1)'''), sqlite3.Error)
+        # stays failed
+        self.assertIsInstance(self.call(writer.flush), sqlite3.Error)
+
+    def test_barrier_released_when_writer_fails(self):
+        writer = pymJournalWriter(os.path.join(self.directory, 'missing', 'journal.db'))
+        # queued before the thread runs into the error
+        writer.queue.put(('''INSERT INTO values_ VALUES (1)''', ()))
+        barrier = threading.Event()
+        writer.queue.put(barrier)
+        writer.start()
+        self.assertTrue(barrier.wait(5))
+        writer.join(5)
+        self.assertIsInstance(self.call(writer.flush), sqlite3.Error)
+
+
+if __name__ == '__main__':
+    unittest.main()
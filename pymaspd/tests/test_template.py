@@ -0,0 +1,99 @@
+"""
+Round trips of job trees through pymTemplate: a job loaded from the template of a job has to scan the same values
+with the same settings.
+Run from the pymaspd directory: python -m unittest discover -s tests
+"""
+import os
+import sys
+import json
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pymTemplate
+from pymJob import pymJobFactory
+# job classes used by the templates below
+import pymList
+import pymGrid
+import pymIterator
+import pymParallel
+
+
+def settings_of(job):
+    # all settings, including the read only ones, as plain data
+    return {key: pymTemplate._plain(setting['current']) for key, setting in job.getsettings().items()}
+
+
+def iterator(settings):
+    job = pymJobFactory.createJob('pymIterator')
+    job.updatejob(dict({'parameter': 'dummy_parameter'}, **settings))
+    return job
+
+
+class TestTemplateRoundTrip(unittest.TestCase):
+
+    def round_trip(self, job):
+        # through JSON, like a stored template
+        return pymTemplate.load(json.loads(json.dumps(pymTemplate.dump(job))))
+
+    def assertSameIterator(self, job):
+        loaded = self.round_trip(job)
+        self.assertEqual(loaded.get_values(), job.get_values())
+        self.assertEqual(settings_of(loaded), settings_of(job))
+
+    def test_stepsize_equal_to_default(self):
+        job = iterator({'range': (0, 2.5), 'stepsize': 1})
+        self.assertEqual(job.get_values(), [0, 1, 2])
+        self.assertSameIterator(job)
+
+    def test_stepsize(self):
+        self.assertSameIterator(iterator({'range': (0, 10), 'stepsize': 3}))
+
+    def test_steps(self):
+        self.assertSameIterator(iterator({'range': (0, 10), 'steps': 4}))
+
+    def test_linear_steps(self):
+        self.assertSameIterator(iterator({'spacing': 'linear', 'range': (0, 10), 'steps': 4}))
+
+    def test_log_spacing(self):
+        self.assertSameIterator(iterator({'spacing': 'log', 'range': (1, 100), 'steps': 3}))
+
+    def test_points_and_ordering(self):
+        self.assertSameIterator(iterator({'points': [3, 1, 2], 'ordering': 'bounce', 'repeats': 2}))
+
+    def test_default_iterator(self):
+        self.assertSameIterator(iterator({}))
+
+    def test_nested_jobs(self):
+        grid = pymJobFactory.createJob('pymGrid')
+        grid.updatejob({'axes': [{'parameter': 'dummy_parameter', 'range': (0, 200), 'steps': 3},
+                                 {'parameter': 'dummy_parameter', 'channel': 1, 'range': (0, 100), 'steps': 2}],
+                        'job': 'pymParallel'})
+        for gain in (2, 3):
+            detector = pymJobFactory.createJob('pynDummyDetector')
+            detector.updatejob({'gain': gain})
+            grid.appendjob(detector)
+        root = pymJobFactory.createJob('pymList')
+        root.appendjob(grid)
+        root.appendjob(iterator({'range': (0, 2.5), 'stepsize': 1, 'job': 'pynDummyDetector'}))
+
+        loaded = self.round_trip(root)
+        self.assertEqual([type(job) for job in loaded.joblist], [type(job) for job in root.joblist])
+        loaded_grid, loaded_iterator = loaded.joblist
+        self.assertEqual(settings_of(loaded_grid), settings_of(grid))
+        self.assertEqual([settings_of(job) for job in loaded_grid.job.joblist],
+                         [settings_of(job) for job in grid.job.joblist])
+        self.assertEqual(loaded_iterator.get_values(), [0, 1, 2])
+        self.assertIsNot(loaded_grid, grid)
+        self.assertNotEqual(loaded_grid.jobid, grid.jobid)
+
+    def test_stored_template(self):
+        job = iterator({'range': (0, 2.5), 'stepsize': 1})
+        plan = pymTemplate.prepare(pymTemplate.dump(job))
+        for _ in range(2):
+            # the plan keeps the resolved classes
+            self.assertEqual(pymTemplate._build(*plan).get_values(), job.get_values())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+"""
+Tests of the id index of pymaspd_worker (job_lut), which id2job looks nested jobs up in.
+Run from the pymaspd directory: python -m unittest discover -s tests
+"""
+import os
+import sys
+import pickle
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pymException
+from pymJob import pymJob, pymJobFactory
+from pymIterator import pymIterator
+# the job created by the iterator settings below
+import pymList
+from pymaspd_worker import pymaspd_worker
+
+
+class pymLeafJob(pymJob):
+    __doc__ = "Job without nested jobs"
+
+    def description(self):
+        return ("Leaf", None)
+
+
+class pymNestJob(pymJob):
+    __doc__ = "Mutable list of nested jobs"
+
+    def __init__(self, jobid):
+        super().__init__(jobid)
+        self.joblist = []
+
+    def description(self):
+        return ("Nest", self.joblist)
+
+    def ismutable(self):
+        return True
+
+    def appendjob(self, job):
+        self.joblist.append(job)
+        return True
+
+    def deletejob(self, job):
+        if job in self.joblist:
+            self.joblist.remove(job)
+            return True
+        return any(sj.deletejob(job) for sj in self.joblist)
+
+
+def new_list():
+    return pymNestJob(pymJobFactory.newJobId())
+
+
+def new_job():
+    return pymLeafJob(pymJobFactory.newJobId())
+
+
+class TestWorkerIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.worker = pymaspd_worker()
+
+    def assertIndexed(self, *jobs):
+        for job in jobs:
+            self.assertIs(self.worker.id2job(job.jobid), job)
+
+    def assertNotIndexed(self, *jobs):
+        for job in jobs:
+            with self.assertRaises(pymException.pymJobNotFound):
+                self.worker.id2job(job.jobid)
+
+    def test_append_top_level(self):
+        job = new_job()
+        self.assertTrue(self.worker.appendjob(job))
+        self.assertIndexed(job)
+
+    def test_append_with_nested_jobs(self):
+        outer, inner, leaf = new_list(), new_list(), new_job()
+        inner.appendjob(leaf)
+        outer.appendjob(inner)
+        self.worker.appendjob(outer)
+        self.assertIndexed(outer, inner, leaf)
+
+    def test_append_nested(self):
+        outer, inner, leaf = new_list(), new_list(), new_job()
+        self.worker.appendjob(outer)
+        self.assertTrue(self.worker.appendjob(inner, outer))
+        self.assertTrue(self.worker.appendjob(leaf, self.worker.id2job(inner.jobid)))
+        self.assertIndexed(outer, inner, leaf)
+
+    def test_updatejob_replaces_nested_jobs(self):
+        iterator = pymIterator(pymJobFactory.newJobId())
+        self.worker.appendjob(iterator)
+        self.assertTrue(self.worker.updatejob(iterator, {'job': 'pymList'}))
+        old = iterator.job
+        self.assertIndexed(iterator, old)
+
+        self.assertTrue(self.worker.updatejob(iterator, {'job': 'pymList'}))
+        self.assertIsNot(iterator.job, old)
+        self.assertIndexed(iterator, iterator.job)
+        # old is still referenced here, it has to leave the index anyway
+        self.assertNotIndexed(old)
+
+    def test_delete_nested_job_with_subtree(self):
+        outer, inner, leaf, sibling = new_list(), new_list(), new_job(), new_job()
+        inner.appendjob(leaf)
+        outer.appendjob(inner)
+        outer.appendjob(sibling)
+        self.worker.appendjob(outer)
+        self.assertTrue(self.worker.deletejob(inner))
+        self.assertNotIndexed(inner, leaf)
+        self.assertIndexed(outer, sibling)
+
+    def test_delete_top_level_job_with_subtree(self):
+        outer, leaf = new_list(), new_job()
+        outer.appendjob(leaf)
+        self.worker.appendjob(outer)
+        self.assertTrue(self.worker.deletejob(outer))
+        self.assertNotIndexed(outer, leaf)
+
+    def test_renumber_after_unpickling(self):
+        outer, leaf = new_list(), new_job()
+        outer.appendjob(leaf)
+        self.worker.appendjob(outer)
+        copy = pickle.loads(pickle.dumps(outer))
+        copy_leaf = copy.joblist[0]
+        self.worker.renumber(copy)
+        self.assertNotEqual(copy.jobid, outer.jobid)
+        self.assertNotEqual(copy_leaf.jobid, leaf.jobid)
+        self.worker.appendjob(copy)
+        self.assertIndexed(outer, leaf, copy, copy_leaf)
+
+    def test_duplicate_id_gets_a_new_one(self):
+        first, second = new_job(), new_job()
+        second.jobid = first.jobid
+        self.worker.appendjob(first)
+        self.worker.appendjob(second)
+        self.assertNotEqual(second.jobid, first.jobid)
+        self.assertIndexed(first, second)
+
+    def test_reindexing_a_job_keeps_its_id(self):
+        job = new_job()
+        self.worker.appendjob(job)
+        jobid = job.jobid
+        self.worker.reindex(job, [job])
+        self.assertEqual(job.jobid, jobid)
+        self.assertIndexed(job)
+
+    def test_removed_job_not_found(self):
+        job = new_job()
+        self.worker.appendjob(job)
+        self.worker.deletejob(job)
+        self.assertNotIndexed(job)
+
+    def test_unknown_id_not_found(self):
+        with self.assertRaises(pymException.pymJobNotFound):
+            self.worker.id2job(None)
+
+
+if __name__ == '__main__':
+    unittest.main()